@@ -1,42 +1,68 @@
+import asyncio
 import dataclasses
-import io
 import json
 import logging
 import mimetypes
 import os
+import time
+from array import array
+from datetime import datetime
 from pathlib import Path
-from typing import AsyncGenerator, cast
+from typing import Any, AsyncGenerator, Callable, Optional, Union, cast
 
-from azure.core.exceptions import ResourceNotFoundError
+import httpx
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceNotFoundError,
+)
 from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
 from azure.keyvault.secrets.aio import SecretClient
-from azure.monitor.opentelemetry import configure_azure_monitor
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.aio import SearchIndexClient
 from azure.storage.blob.aio import BlobServiceClient
 from openai import APIError, AsyncAzureOpenAI, AsyncOpenAI
-from opentelemetry.instrumentation.aiohttp_client import AioHttpClientInstrumentor
-from opentelemetry.instrumentation.asgi import OpenTelemetryMiddleware
-from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
 from quart import (
     Blueprint,
     Quart,
+    Response,
     abort,
     current_app,
     jsonify,
     make_response,
     request,
-    send_file,
     send_from_directory,
 )
 from quart_cors import cors
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import quote_etag, unquote_etag
+from werkzeug.sansio.response import Response as SansIOResponse
 
-from approaches.approach import Approach
+from approaches.approach import Approach, Document
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
-from approaches.chatreadretrievereadvision import ChatReadRetrieveReadVisionApproach
 from approaches.retrievethenread import RetrieveThenReadApproach
-from approaches.retrievethenreadvision import RetrieveThenReadVisionApproach
+from core.admission import AdmissionController, AdmissionRejected
+from core.answercache import AnswerCache
 from core.authentication import AuthenticationHelper
+from core.cache import LRUCache
+from core.httpsessions import SharedHttpSessions
+from core.imageshelper import ImageCache
+from core.indexversion import IndexVersionMonitor
+from core.metrics import (
+    OPENAI_TOKENS,
+    REQUESTS,
+    STAGE_SECONDS,
+    format_server_timing,
+    observe_stage,
+    render_stats,
+    request_timings_ms,
+    start_request_timings,
+)
+from core.modelhelper import TOKEN_COUNT_CACHE
+from core.openaipool import OpenAIBackendPool, parse_backends
+from core.openaischeduler import OpenAIScheduler
+from core.resilience import ResiliencePolicy
+from core.thoughtstore import MINIMAL_VERBOSITY, ThoughtStore
 
 CONFIG_OPENAI_TOKEN = "openai_token"
 CONFIG_CREDENTIAL = "azure_credential"
@@ -49,11 +75,31 @@ CONFIG_AUTH_CLIENT = "auth_client"
 CONFIG_GPT4V_DEPLOYED = "gpt4v_deployed"
 CONFIG_SEARCH_CLIENT = "search_client"
 CONFIG_OPENAI_CLIENT = "openai_client"
+CONFIG_CONTENT_CACHE = "content_cache"
+CONFIG_CONTENT_CACHE_MAX_ENTRY_BYTES = "content_cache_max_entry_bytes"
+CONFIG_CONTENT_REVALIDATE = "content_revalidate_seconds"
+CONFIG_ANSWER_CACHE = "answer_cache"
+CONFIG_EMBEDDING_CACHE = "embedding_cache"
+CONFIG_SEARCH_CACHE = "search_cache"
+CONFIG_INDEX_VERSION_MONITOR = "index_version_monitor"
+CONFIG_HTTP_SESSIONS = "http_sessions"
+CONFIG_IMAGE_CACHE = "image_cache"
+CONFIG_STREAM_COMPACT = "stream_compact"
+CONFIG_THOUGHT_STORE = "thought_store"
+CONFIG_STREAM_COALESCE_WINDOW = "stream_coalesce_window"
+CONFIG_APPROACH_FACTORIES = "approach_factories"
+CONFIG_ADMISSION_CONTROLLER = "admission_controller"
+CONFIG_OPENAI_BACKEND_POOL = "openai_backend_pool"
+CONFIG_OPENAI_SCHEDULER = "openai_scheduler"
+CONFIG_SEARCH_POLICY = "search_policy"
+CONFIG_EMBEDDING_POLICY = "embedding_policy"
+CONFIG_METRICS_ENABLED = "metrics_enabled"
 ERROR_MESSAGE = """The app encountered an error processing your request.
 If you are an administrator of the app, view the full error in the logs. See aka.ms/appservice-logs for more information.
 Error type: {error_type}
 """
 ERROR_MESSAGE_FILTER = """Your message contains content that was flagged by the OpenAI content filter."""
+ERROR_MESSAGE_OVERLOADED = """The app is handling too many requests right now, please try again in a few seconds."""
 
 bp = Blueprint("routes", __name__, static_folder="static")
 # Fix Windows registry issue with mimetypes
@@ -83,31 +129,138 @@ async def assets(path):
     return await send_from_directory(Path(__file__).resolve().parent / "static" / "assets", path)
 
 
+@dataclasses.dataclass
+class CachedContent:
+    etag: str
+    last_modified: Optional[datetime]
+    content_type: str
+    data: bytes
+    validated_at: float
+
+
+def set_content_validators(response: SansIOResponse, etag: Optional[str], last_modified: Optional[datetime]):
+    # Blob ETags come back quoted from storage, the response helper quotes them again
+    if etag:
+        response.set_etag(unquote_etag(etag)[0] or etag)
+    if last_modified:
+        response.last_modified = last_modified
+
+
 # Serve content files from blob storage from within the app to keep the example self-contained.
 # *** NOTE *** this assumes that the content files are public, or at least that all users of the app
-# can access all the files. This is also slow and memory hungry.
+# can access all the files. Blob chunks are streamed to the client as they arrive, and HTTP Range
+# requests are mapped to ranged blob downloads, so large files are never buffered in worker memory.
+# Small files are kept in a bounded in-process cache and revalidated against storage by ETag.
 @bp.route("/content/<path>")
 async def content_file(path: str):
     # Remove page number from path, filename-1.txt -> filename.txt
     if path.find("#page=") > 0:
         path_parts = path.rsplit("#page=", 1)
         path = path_parts[0]
-    logging.info("Opening file %s at page %s", path)
+    logging.info("Opening file %s", path)
     blob_container_client = current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]
+    blob_client = blob_container_client.get_blob_client(path)
+    content_cache: LRUCache[CachedContent] = current_app.config[CONFIG_CONTENT_CACHE]
+
+    offset, length = None, None
+    # Only single byte ranges are supported, anything else is answered with the whole file
+    if request.range and request.range.units == "bytes" and len(request.range.ranges) == 1:
+        start, stop = request.range.ranges[0]
+        offset = start
+        length = stop - start if stop is not None else None
+
+    cached_content = content_cache.get(path)
+    if (
+        cached_content
+        and time.monotonic() - cached_content.validated_at > current_app.config[CONFIG_CONTENT_REVALIDATE]
+    ):
+        # Citation files rarely change, so a stale entry only needs its ETag compared, not a new download
+        try:
+            blob_properties = await blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            blob_properties = None
+        if blob_properties and blob_properties.etag == cached_content.etag:
+            cached_content.validated_at = time.monotonic()
+        else:
+            content_cache.pop(path)
+            cached_content = None
+    if cached_content:
+        data = cached_content.data
+        response = Response(data, mimetype=cached_content.content_type)
+        response.accept_ranges = "bytes"
+        set_content_validators(response, cached_content.etag, cached_content.last_modified)
+        # Answers If-None-Match and If-Modified-Since with 304 Not Modified
+        await response.make_conditional(request)
+        if response.status_code == 200 and offset is not None:
+            start = offset if offset >= 0 else max(len(data) + offset, 0)
+            stop = min(start + length, len(data)) if length is not None else len(data)
+            if start >= len(data):
+                abort(416)
+            response.set_data(data[start:stop])
+            response.status_code = 206
+            response.content_range = ContentRange("bytes", start, stop, len(data))
+        return response
+
+    # If the client already holds a copy, let storage check that it is still current instead of sending it again
+    client_etag = None
+    client_etags = request.if_none_match.as_set()
+    if len(client_etags) == 1 and not request.if_none_match.star_tag:
+        client_etag = quote_etag(client_etags.pop())
+    conditions = {"etag": client_etag, "match_condition": MatchConditions.IfModified} if client_etag else {}
     try:
-        blob = await blob_container_client.get_blob_client(path).download_blob()
+        if offset is not None and offset < 0:
+            # Suffix ranges (bytes=-N) are relative to the end of the blob, so its size is needed first
+            blob_properties = await blob_client.get_blob_properties()
+            offset = max(blob_properties.size + offset, 0)
+        blob = await blob_client.download_blob(offset=offset, length=length, **conditions)
     except ResourceNotFoundError:
         logging.exception("Path not found: %s", path)
         abort(404)
+    except HttpResponseError as error:
+        # Storage reports a failed If-None-Match as an error rather than an empty 304 response
+        if error.status_code == 304:
+            response = Response("", 304)
+            set_content_validators(response, client_etag, None)
+            return response
+        if error.status_code == 416:
+            abort(416)
+        raise
     if not blob.properties or not blob.properties.has_key("content_settings"):
         abort(404)
     mime_type = blob.properties["content_settings"]["content_type"]
     if mime_type == "application/octet-stream":
         mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
-    blob_file = io.BytesIO()
-    await blob.readinto(blob_file)
-    blob_file.seek(0)
-    return await send_file(blob_file, mimetype=mime_type, as_attachment=False, attachment_filename=path)
+
+    if offset is None and blob.size <= current_app.config[CONFIG_CONTENT_CACHE_MAX_ENTRY_BYTES]:
+        cached_content = CachedContent(
+            etag=blob.properties.etag,
+            last_modified=blob.properties.last_modified,
+            content_type=mime_type,
+            data=await blob.readall(),
+            validated_at=time.monotonic(),
+        )
+        content_cache.set(path, cached_content)
+        response = Response(cached_content.data, mimetype=mime_type)
+        response.accept_ranges = "bytes"
+        set_content_validators(response, cached_content.etag, cached_content.last_modified)
+        return response
+
+    async def blob_chunks() -> AsyncGenerator[bytes, None]:
+        async for chunk in blob.chunks():
+            yield chunk
+
+    streamed_response = await make_response(blob_chunks())
+    streamed_response.timeout = None  # type: ignore
+    streamed_response.mimetype = mime_type
+    streamed_response.content_length = blob.size
+    streamed_response.accept_ranges = "bytes"
+    set_content_validators(streamed_response, blob.properties.etag, blob.properties.last_modified)
+    if offset is not None:
+        # The downloader reports the requested range along with the full blob size, e.g. "bytes 0-99/1234"
+        file_size = int(blob.properties.content_range.rsplit("/", 1)[1])
+        streamed_response.status_code = 206
+        streamed_response.content_range = ContentRange("bytes", offset, offset + blob.size, file_size)
+    return streamed_response
 
 
 def error_dict(error: Exception) -> dict:
@@ -117,12 +270,87 @@ def error_dict(error: Exception) -> dict:
 
 
 def error_response(error: Exception, route: str, status_code: int = 500):
+    if isinstance(error, AdmissionRejected):
+        # Expected under load, so it is logged without the traceback
+        logging.warning("Rejected request to %s: %s", route, error.reason)
+        return jsonify({"error": ERROR_MESSAGE_OVERLOADED}), 503, {"Retry-After": str(error.retry_after)}
     logging.exception("Exception in %s: %s", route, error)
     if isinstance(error, APIError) and error.code == "content_filter":
         status_code = 400
     return jsonify(error_dict(error)), status_code
 
 
+async def run_approach(
+    approach: Approach, messages: list[dict], stream: bool, context: dict[str, Any], session_state: Any
+) -> Union[dict[str, Any], AsyncGenerator[dict[str, Any], None]]:
+    admission_controller: AdmissionController = current_app.config[CONFIG_ADMISSION_CONTROLLER]
+    admitted_at = await admission_controller.acquire()
+    try:
+        result = await run_approach_with_thoughts(approach, messages, stream, context, session_state)
+    except BaseException:
+        admission_controller.release(admitted_at)
+        raise
+    if isinstance(result, dict):
+        admission_controller.release(admitted_at)
+        return result
+    return admission_controller.release_after_stream(result, admitted_at)
+
+
+async def run_approach_with_thoughts(
+    approach: Approach, messages: list[dict], stream: bool, context: dict[str, Any], session_state: Any
+) -> Union[dict[str, Any], AsyncGenerator[dict[str, Any], None]]:
+    result = await run_approach_with_cache(approach, messages, stream, context, session_state)
+    if context.get("overrides", {}).get("thought_verbosity") != MINIMAL_VERBOSITY:
+        return result
+
+    # Keep the thought process server-side until the analysis panel asks for it
+    thought_store: ThoughtStore = current_app.config[CONFIG_THOUGHT_STORE]
+    owner = context.get("auth_claims", {}).get("oid")
+    if isinstance(result, dict):
+        choice = result["choices"][0]
+        choice["context"] = thought_store.defer(choice["context"], owner)
+        return result
+    return thought_store.defer_stream(result, owner)
+
+
+def get_approach(key: str) -> Optional[Approach]:
+    """Returns the approach stored under the key, constructing it on first use if it was registered lazily."""
+    if key not in current_app.config:
+        factory = current_app.config[CONFIG_APPROACH_FACTORIES].pop(key, None)
+        if factory is None:
+            return None
+        current_app.config[key] = factory()
+    return cast(Approach, current_app.config[key])
+
+
+async def run_approach_with_cache(
+    approach: Approach, messages: list[dict], stream: bool, context: dict[str, Any], session_state: Any
+) -> Union[dict[str, Any], AsyncGenerator[dict[str, Any], None]]:
+    # Drop cached answers and search results if prepdocs has re-ingested the index since the last check
+    await current_app.config[CONFIG_INDEX_VERSION_MONITOR].refresh()
+    answer_cache: Optional[AnswerCache] = current_app.config[CONFIG_ANSWER_CACHE]
+    if answer_cache is None:
+        return await approach.run(messages, stream=stream, context=context, session_state=session_state)
+
+    overrides = context.get("overrides", {})
+    auth_helper = current_app.config[CONFIG_AUTH_CLIENT]
+    # The security filter is part of the key so that access-controlled answers are never shared across users
+    security_filter = auth_helper.build_security_filters(overrides, context.get("auth_claims", {}))
+    key = answer_cache.build_key(type(approach).__name__, messages, overrides, security_filter)
+    lookup_started = time.perf_counter()
+    if cached_response := answer_cache.get(key, session_state):
+        # The answer is served without running any stage of the approach, and its timings say so
+        observe_stage(type(approach).__name__, "answer_cache", time.perf_counter() - lookup_started)
+        cached_response["choices"][0]["context"]["timings"] = request_timings_ms()
+        return answer_cache.replay_stream(cached_response) if stream else cached_response
+
+    result = await approach.run(messages, stream=stream, context=context, session_state=session_state)
+    if isinstance(result, dict):
+        answer_cache.set(key, result)
+        return result
+    return answer_cache.cache_stream(key, result)
+
+
 @bp.route("/ask", methods=["POST"])
 async def ask():
     if not request.is_json:
@@ -134,14 +362,29 @@ async def ask():
         context["auth_claims"] = await auth_helper.get_auth_claims_if_enabled(request.headers)
         use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
         approach: Approach
-        if use_gpt4v and CONFIG_ASK_VISION_APPROACH in current_app.config:
-            approach = cast(Approach, current_app.config[CONFIG_ASK_VISION_APPROACH])
+        if use_gpt4v and (vision_approach := get_approach(CONFIG_ASK_VISION_APPROACH)):
+            approach = vision_approach
         else:
             approach = cast(Approach, current_app.config[CONFIG_ASK_APPROACH])
-        r = await approach.run(
-            request_json["messages"], context=context, session_state=request_json.get("session_state")
+        timings = start_request_timings()
+        result = await run_approach(
+            approach,
+            request_json["messages"],
+            stream=request_json.get("stream", False),
+            context=context,
+            session_state=request_json.get("session_state"),
         )
-        return jsonify(r)
+        if isinstance(result, dict):
+            response = jsonify(result)
+            if timings:
+                response.headers["Server-Timing"] = format_server_timing(timings)
+            return response
+        else:
+            # The headers are sent before the stages run, their timings are in the context of the chunks instead
+            response = await make_response(make_ndjson_response_body(result))
+            response.timeout = None  # type: ignore
+            response.mimetype = "application/json-lines"
+            return response
     except Exception as error:
         return error_response(error, "/ask")
 
@@ -153,13 +396,109 @@ class JSONEncoder(json.JSONEncoder):
         return super().default(o)
 
 
-async def format_as_ndjson(r: AsyncGenerator[dict, None]) -> AsyncGenerator[str, None]:
+# Encoders are built once, json.dumps would create a new one for every chunk
+NDJSON_ENCODER = JSONEncoder(ensure_ascii=False)
+COMPACT_NDJSON_ENCODER = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def compact_chunk(event: dict) -> dict:
+    """
+    Strips a streamed chunk down to what the client reads: the role and content of the delta, the context,
+    the session state and the finish reason. Everything else (ids, model, indexes, null fields) is dropped.
+    """
+    if not event.get("choices"):
+        return event
+    choice = event["choices"][0]
+    compact_choice: dict[str, Any] = {
+        "delta": {key: value for key, value in choice["delta"].items() if key in ("role", "content") and value}
+    }
+    for key in ("context", "session_state"):
+        if key in choice:
+            compact_choice[key] = choice[key]
+    if choice.get("finish_reason"):
+        compact_choice["finish_reason"] = choice["finish_reason"]
+    return {"choices": [compact_choice]}
+
+
+def merge_content_chunks(chunk: dict, next_chunk: dict) -> bool:
+    """Appends the content of next_chunk to chunk if both are compact chunks that only carry content."""
+    if not (chunk.get("choices") and next_chunk.get("choices")):
+        return False
+    choice, next_choice = chunk["choices"][0], next_chunk["choices"][0]
+    if choice.keys() != {"delta"} or next_choice.keys() != {"delta"}:
+        return False
+    if choice["delta"].keys() != {"content"} or next_choice["delta"].keys() != {"content"}:
+        return False
+    choice["delta"]["content"] += next_choice["delta"]["content"]
+    return True
+
+
+async def format_as_ndjson(
+    r: AsyncGenerator[dict, None], compact: bool = False, coalesce_window: float = 0
+) -> AsyncGenerator[str, None]:
+    """
+    Serializes a stream of chunks as newline-delimited JSON.
+    Args:
+        r: The chunks to send.
+        compact (bool): Whether to send the compact chunks built by compact_chunk.
+        coalesce_window (float): Seconds during which chunks are held back to be sent in a single write,
+            with consecutive content-only compact chunks merged into one. 0 writes every chunk as it arrives.
+    """
+    encoder = COMPACT_NDJSON_ENCODER if compact else NDJSON_ENCODER
+    buffer: list[dict] = []
+
+    def flush() -> str:
+        lines = "".join(encoder.encode(event) + "\n" for event in buffer)
+        buffer.clear()
+        return lines
+
+    iterator = r.__aiter__()
+    next_event: Optional[asyncio.Future] = None
     try:
-        async for event in r:
-            yield json.dumps(event, ensure_ascii=False, cls=JSONEncoder) + "\n"
+        if coalesce_window <= 0:
+            async for event in iterator:
+                yield encoder.encode(compact_chunk(event) if compact else event) + "\n"
+            return
+
+        loop = asyncio.get_running_loop()
+        flush_at = 0.0
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(flush_at - loop.time(), 0) if buffer else None
+            done, _ = await asyncio.wait({next_event}, timeout=timeout)
+            if not done:
+                yield flush()
+                continue
+            finished_event, next_event = next_event, None
+            try:
+                event = finished_event.result()
+            except StopAsyncIteration:
+                break
+            event = compact_chunk(event) if compact else event
+            if not buffer:
+                flush_at = loop.time() + coalesce_window
+            if not (compact and buffer and merge_content_chunks(buffer[-1], event)):
+                buffer.append(event)
+        if buffer:
+            yield flush()
     except Exception as error:
         logging.exception("Exception while generating response stream: %s", error)
+        if buffer:
+            yield flush()
         yield json.dumps(error_dict(error))
+    finally:
+        # The client went away while the next chunk was being generated
+        if next_event is not None:
+            next_event.cancel()
+
+
+def make_ndjson_response_body(result: AsyncGenerator[dict, None]) -> AsyncGenerator[str, None]:
+    return format_as_ndjson(
+        result,
+        compact=current_app.config[CONFIG_STREAM_COMPACT],
+        coalesce_window=current_app.config[CONFIG_STREAM_COALESCE_WINDOW],
+    )
 
 
 @bp.route("/chat", methods=["POST"])
@@ -173,21 +512,27 @@ async def chat():
         context["auth_claims"] = await auth_helper.get_auth_claims_if_enabled(request.headers)
         use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
         approach: Approach
-        if use_gpt4v and CONFIG_CHAT_VISION_APPROACH in current_app.config:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_VISION_APPROACH])
+        if use_gpt4v and (vision_approach := get_approach(CONFIG_CHAT_VISION_APPROACH)):
+            approach = vision_approach
         else:
             approach = cast(Approach, current_app.config[CONFIG_CHAT_APPROACH])
 
-        result = await approach.run(
+        timings = start_request_timings()
+        result = await run_approach(
+            approach,
             request_json["messages"],
             stream=request_json.get("stream", False),
             context=context,
             session_state=request_json.get("session_state"),
         )
         if isinstance(result, dict):
-            return jsonify(result)
+            response = jsonify(result)
+            if timings:
+                response.headers["Server-Timing"] = format_server_timing(timings)
+            return response
         else:
-            response = await make_response(format_as_ndjson(result))
+            # The headers are sent before the stages run, their timings are in the context of the chunks instead
+            response = await make_response(make_ndjson_response_body(result))
             response.timeout = None  # type: ignore
             response.mimetype = "application/json-lines"
             return response
@@ -195,6 +540,19 @@ async def chat():
         return error_response(error, "/chat")
 
 
+@bp.route("/thoughts/<thoughts_id>", methods=["GET"])
+async def thoughts(thoughts_id: str):
+    auth_helper = current_app.config[CONFIG_AUTH_CLIENT]
+    try:
+        auth_claims = await auth_helper.get_auth_claims_if_enabled(request.headers)
+    except Exception as error:
+        return error_response(error, "/thoughts")
+    data = current_app.config[CONFIG_THOUGHT_STORE].get(thoughts_id, auth_claims.get("oid"))
+    if data is None:
+        return jsonify({"error": "The thought process has expired"}), 404
+    return Response(data, mimetype="application/json")
+
+
 # Send MSAL.js settings to the client UI
 @bp.route("/auth_setup", methods=["GET"])
 def auth_setup():
@@ -207,6 +565,78 @@ def config():
     return jsonify({"showGPT4VOptions": current_app.config[CONFIG_GPT4V_DEPLOYED]})
 
 
+def collect_component_stats() -> list[str]:
+    """Renders the stats of the caches, pools and limiters of the worker as metrics."""
+    config = current_app.config
+    caches: dict[str, Optional[LRUCache]] = {
+        "content": config[CONFIG_CONTENT_CACHE],
+        "answer": config[CONFIG_ANSWER_CACHE] and config[CONFIG_ANSWER_CACHE].cache,
+        "embedding": config[CONFIG_EMBEDDING_CACHE],
+        "search": config[CONFIG_SEARCH_CACHE],
+        "image": config[CONFIG_IMAGE_CACHE].cache if CONFIG_IMAGE_CACHE in config else None,
+        "thought": config[CONFIG_THOUGHT_STORE].cache,
+        "token_count": TOKEN_COUNT_CACHE,
+    }
+    lines = [
+        *render_stats("rag_cache", (({"cache": name}, cache.stats()) for name, cache in caches.items() if cache)),
+        *render_stats("rag_http_pool", [({}, config[CONFIG_HTTP_SESSIONS].stats())]),
+        *render_stats("rag_admission", [({}, config[CONFIG_ADMISSION_CONTROLLER].stats())]),
+    ]
+    if openai_scheduler := config[CONFIG_OPENAI_SCHEDULER]:
+        scheduler_stats = openai_scheduler.stats()
+        priorities = scheduler_stats.pop("priorities")
+        lines.extend(render_stats("rag_openai_scheduler", [({}, scheduler_stats)]))
+        lines.extend(
+            render_stats("rag_openai_scheduler", (({"priority": name}, stats) for name, stats in priorities.items()))
+        )
+    if openai_backend_pool := config[CONFIG_OPENAI_BACKEND_POOL]:
+        lines.extend(
+            render_stats(
+                "rag_openai_backend",
+                (
+                    ({"endpoint": stats["endpoint"], "deployment": stats["deployment"]}, stats)
+                    for stats in openai_backend_pool.stats()["backends"]
+                ),
+            )
+        )
+    policies = {"search": config[CONFIG_SEARCH_POLICY], "embedding": config[CONFIG_EMBEDDING_POLICY]}
+    policy_stats = {dependency: policy.stats() for dependency, policy in policies.items()}
+    lines.extend(
+        render_stats("rag_dependency", (({"dependency": name}, stats) for name, stats in policy_stats.items()))
+    )
+    lines.extend(
+        render_stats(
+            "rag_circuit_breaker",
+            (
+                ({"dependency": dependency, "kind": kind}, {"open": state != "closed"})
+                for dependency, stats in policy_stats.items()
+                for kind, state in stats["breakers"].items()
+            ),
+        )
+    )
+    return lines
+
+
+@bp.route("/metrics", methods=["GET"])
+async def metrics():
+    if not current_app.config[CONFIG_METRICS_ENABLED]:
+        abort(404)
+    lines = [
+        *STAGE_SECONDS.render(),
+        *OPENAI_TOKENS.render(),
+        *REQUESTS.render(),
+        *collect_component_stats(),
+    ]
+    return Response("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@bp.after_app_request
+async def count_request(response: Response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUESTS.inc(route=route, status=str(response.status_code))
+    return response
+
+
 @bp.before_app_serving
 async def setup_clients():
     # Replace these with your own values, either in environment variables or directly here
@@ -227,6 +657,16 @@ async def setup_clients():
     AZURE_OPENAI_CHATGPT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENT") if OPENAI_HOST == "azure" else None
     AZURE_OPENAI_EMB_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT") if OPENAI_HOST == "azure" else None
     AZURE_VISION_ENDPOINT = os.getenv("AZURE_VISION_ENDPOINT", "")
+    # Comma-separated Azure OpenAI services with the same deployment names, each optionally followed by ":weight",
+    # to spread requests over several quotas, with failover on 429 and 5xx
+    AZURE_OPENAI_BACKENDS = os.getenv("AZURE_OPENAI_BACKENDS", "") if OPENAI_HOST == "azure" else ""
+    AZURE_OPENAI_EJECT_SECONDS = float(os.getenv("AZURE_OPENAI_EJECT_SECONDS", 10))
+    # OpenAI calls in flight per worker, admitted by priority (query rewrites first, speculative work last), and
+    # optionally the worker's share of the deployment quota, in tokens per minute (0 turns either limit off).
+    # Calls waiting longer than OPENAI_MAX_QUEUE_WAIT_SECONDS are admitted ahead of any priority.
+    OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 0))
+    OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 0))
+    OPENAI_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("OPENAI_MAX_QUEUE_WAIT_SECONDS", 5))
     # Used only with non-Azure OpenAI deployments
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_ORGANIZATION = os.getenv("OPENAI_ORGANIZATION")
@@ -246,6 +686,66 @@ async def setup_clients():
     AZURE_SEARCH_QUERY_SPELLER = os.getenv("AZURE_SEARCH_QUERY_SPELLER", "lexicon")
 
     USE_GPT4V = os.getenv("USE_GPT4V", "").lower() == "true"
+    # Search with the user's question while the query rewrite runs, keeping the results if the rewrite barely changes it
+    SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "").lower() == "true"
+    SPECULATIVE_RETRIEVAL_SIMILARITY = float(os.getenv("SPECULATIVE_RETRIEVAL_SIMILARITY", 0.8))
+
+    # Bounded in-process cache for the small citation files served by /content
+    CONTENT_CACHE_MAX_BYTES = int(os.getenv("CONTENT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    CONTENT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("CONTENT_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024))
+    CONTENT_REVALIDATE_SECONDS = float(os.getenv("CONTENT_REVALIDATE_SECONDS", 60))
+    # Size of the ranged requests blobs are downloaded in, the first one is buffered before anything is sent
+    # (the SDK default is 32 MiB, which covers most citation files in a single buffered request)
+    CONTENT_DOWNLOAD_CHUNK_BYTES = int(os.getenv("CONTENT_DOWNLOAD_CHUNK_BYTES", 1024 * 1024))
+    # Exact-match cache of answers, disabled unless a time-to-live is set
+    ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 0))
+    ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+    # Query vectors for repeated questions, stored as float32 so 1536 dimensions take 6 KiB
+    EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+    EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 24 * 60 * 60))
+    EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_TIMEOUT_SECONDS", 10))
+    # Deadlines for AI Search and embedding calls, which are duplicated once they get slower than the given
+    # percentile of recent calls, for at most the given share of the calls, and circuit breakers that degrade
+    # hybrid retrieval while one side is failing
+    SEARCH_TIMEOUT_SECONDS = float(os.getenv("SEARCH_TIMEOUT_SECONDS", 10))
+    SEARCH_HEDGE_PERCENTILE = float(os.getenv("SEARCH_HEDGE_PERCENTILE", 95))
+    SEARCH_HEDGE_BUDGET = float(os.getenv("SEARCH_HEDGE_BUDGET", 0.05))
+    EMBEDDING_HEDGE_PERCENTILE = float(os.getenv("EMBEDDING_HEDGE_PERCENTILE", 95))
+    EMBEDDING_HEDGE_BUDGET = float(os.getenv("EMBEDDING_HEDGE_BUDGET", 0.05))
+    CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", 5))
+    CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", 30))
+    IMAGE_FETCH_CONCURRENCY = int(os.getenv("IMAGE_FETCH_CONCURRENCY", 4))
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    IMAGE_CACHE_REVALIDATE_SECONDS = float(os.getenv("IMAGE_CACHE_REVALIDATE_SECONDS", 300))
+    # Short-lived cache of search results, disabled unless a time-to-live is set
+    SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", 0))
+    SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+    # Streamed answers: compact chunks with only the fields the client reads, and deltas held back for a few
+    # milliseconds to be sent in fewer writes
+    STREAM_COMPACT_CHUNKS = os.getenv("STREAM_COMPACT_CHUNKS", "").lower() == "true"
+    STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", 0))
+
+    # Thought processes of answers requested with minimal verbosity, until the analysis panel fetches them
+    THOUGHT_STORE_TTL_SECONDS = float(os.getenv("THOUGHT_STORE_TTL_SECONDS", 10 * 60))
+    THOUGHT_STORE_MAX_BYTES = int(os.getenv("THOUGHT_STORE_MAX_BYTES", 64 * 1024 * 1024))
+
+    # Approach runs in flight per worker, with a bounded queue of waiting requests, the rest get a 503
+    ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", 32))
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 64))
+    ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", 10))
+
+    # Connection pool shared by every outbound HTTP call
+    HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", 100))
+    HTTP_POOL_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS_PER_HOST", 0))
+    HTTP_POOL_KEEPALIVE_SECONDS = float(os.getenv("HTTP_POOL_KEEPALIVE_SECONDS", 30))
+
+    # Prometheus metrics of this worker at /metrics. Off by default, as the endpoint has no authentication
+    # and names the Azure OpenAI services and deployments in use
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+
+    startup_started = time.monotonic()
+    startup_timings: dict[str, float] = {}
 
     # Use the current user identity to authenticate with Azure OpenAI, AI Search and Blob Storage (no secrets needed,
     # just use 'az login' locally, and managed identity when deployed on Azure). If you need to use keys, use separate AzureKeyCredential instances with the
@@ -253,64 +753,193 @@ async def setup_clients():
     # If you encounter a blocking error during a DefaultAzureCredential resolution, you can exclude the problematic credential by using a parameter (ex. exclude_shared_token_cache_credential=True)
     azure_credential = DefaultAzureCredential(exclude_shared_token_cache_credential=True)
 
+    http_sessions = SharedHttpSessions(
+        limit=HTTP_POOL_MAX_CONNECTIONS,
+        limit_per_host=HTTP_POOL_MAX_CONNECTIONS_PER_HOST,
+        keepalive_timeout=HTTP_POOL_KEEPALIVE_SECONDS,
+    )
+    current_app.config[CONFIG_HTTP_SESSIONS] = http_sessions
+
     # Set up clients for AI Search and Storage
     search_client = SearchClient(
         endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
         index_name=AZURE_SEARCH_INDEX,
         credential=azure_credential,
+        transport=http_sessions.azure_transport(),
     )
     search_index_client = SearchIndexClient(
         endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
         credential=azure_credential,
+        transport=http_sessions.azure_transport(),
     )
     blob_client = BlobServiceClient(
-        account_url=f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net", credential=azure_credential
+        account_url=f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net",
+        credential=azure_credential,
+        transport=http_sessions.azure_transport(),
+        max_single_get_size=CONTENT_DOWNLOAD_CHUNK_BYTES,
+        max_chunk_get_size=CONTENT_DOWNLOAD_CHUNK_BYTES,
     )
     blob_container_client = blob_client.get_container_client(AZURE_STORAGE_CONTAINER)
+    startup_timings["clients"] = time.monotonic() - startup_started
+
+    # The index schema and the vision key don't depend on each other, so they are fetched concurrently
+    async def get_search_index():
+        if not AZURE_USE_AUTHENTICATION:
+            return None
+        started = time.monotonic()
+        search_index = await search_index_client.get_index(AZURE_SEARCH_INDEX)
+        startup_timings["search_index"] = time.monotonic() - started
+        return search_index
+
+    async def get_vision_key() -> Optional[str]:
+        if not (VISION_SECRET_NAME and AZURE_KEY_VAULT_NAME):  # Cognitive vision keys are stored in keyvault
+            return None
+        started = time.monotonic()
+        key_vault_client = SecretClient(
+            vault_url=f"https://{AZURE_KEY_VAULT_NAME}.vault.azure.net",
+            credential=azure_credential,
+            transport=http_sessions.azure_transport(),
+        )
+        async with key_vault_client:
+            vision_secret = await key_vault_client.get_secret(VISION_SECRET_NAME)
+        startup_timings["vision_key"] = time.monotonic() - started
+        return vision_secret.value
+
+    search_index, vision_key = await asyncio.gather(get_search_index(), get_vision_key())
 
     # Set up authentication helper
     auth_helper = AuthenticationHelper(
-        search_index=(await search_index_client.get_index(AZURE_SEARCH_INDEX)) if AZURE_USE_AUTHENTICATION else None,
+        search_index=search_index,
         use_authentication=AZURE_USE_AUTHENTICATION,
         server_app_id=AZURE_SERVER_APP_ID,
         server_app_secret=AZURE_SERVER_APP_SECRET,
         client_app_id=AZURE_CLIENT_APP_ID,
         tenant_id=AZURE_AUTH_TENANT_ID,
         require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
+        http_session=http_sessions.session,
     )
 
-    vision_key = None
-    if VISION_SECRET_NAME and AZURE_KEY_VAULT_NAME:  # Cognitive vision keys are stored in keyvault
-        key_vault_client = SecretClient(
-            vault_url=f"https://{AZURE_KEY_VAULT_NAME}.vault.azure.net", credential=azure_credential
-        )
-        vision_secret = await key_vault_client.get_secret(VISION_SECRET_NAME)
-        vision_key = vision_secret.value
-        await key_vault_client.close()
-
     # Used by the OpenAI SDK
     openai_client: AsyncOpenAI
+    openai_backend_pool: Optional[OpenAIBackendPool] = None
 
     if OPENAI_HOST == "azure":
         token_provider = get_bearer_token_provider(azure_credential, "https://cognitiveservices.azure.com/.default")
+        openai_http_client = http_sessions.openai_http_client
+        if backends := parse_backends(AZURE_OPENAI_BACKENDS):
+            # The Entra ID token is valid for every service, so only the host of the requests needs to change
+            openai_backend_pool = OpenAIBackendPool(
+                backends, transport=http_sessions.openai_transport, eject_seconds=AZURE_OPENAI_EJECT_SECONDS
+            )
+            openai_http_client = httpx.AsyncClient(transport=openai_backend_pool, follow_redirects=True)
         # Store on app.config for later use inside requests
         openai_client = AsyncAzureOpenAI(
             api_version="2023-07-01-preview",
             azure_endpoint=f"https://{AZURE_OPENAI_SERVICE}.openai.azure.com",
             azure_ad_token_provider=token_provider,
+            http_client=openai_http_client,
         )
     else:
         openai_client = AsyncOpenAI(
             api_key=OPENAI_API_KEY,
             organization=OPENAI_ORGANIZATION,
+            http_client=http_sessions.openai_http_client,
         )
 
     current_app.config[CONFIG_OPENAI_CLIENT] = openai_client
+    current_app.config[CONFIG_OPENAI_BACKEND_POOL] = openai_backend_pool
+    openai_scheduler = (
+        OpenAIScheduler(
+            max_concurrency=OPENAI_MAX_CONCURRENCY,
+            tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+            max_queue_wait=OPENAI_MAX_QUEUE_WAIT_SECONDS,
+        )
+        if OPENAI_MAX_CONCURRENCY > 0
+        else None
+    )
+    current_app.config[CONFIG_OPENAI_SCHEDULER] = openai_scheduler
+    search_policy = ResiliencePolicy(
+        "Search",
+        timeout=SEARCH_TIMEOUT_SECONDS,
+        hedge_percentile=SEARCH_HEDGE_PERCENTILE,
+        hedge_budget=SEARCH_HEDGE_BUDGET,
+        failure_threshold=CIRCUIT_BREAKER_FAILURES,
+        reset_timeout=CIRCUIT_BREAKER_RESET_SECONDS,
+    )
+    current_app.config[CONFIG_SEARCH_POLICY] = search_policy
+    embedding_policy = ResiliencePolicy(
+        "Embedding",
+        timeout=EMBEDDING_TIMEOUT_SECONDS,
+        hedge_percentile=EMBEDDING_HEDGE_PERCENTILE,
+        hedge_budget=EMBEDDING_HEDGE_BUDGET,
+        failure_threshold=CIRCUIT_BREAKER_FAILURES,
+        reset_timeout=CIRCUIT_BREAKER_RESET_SECONDS,
+    )
+    current_app.config[CONFIG_EMBEDDING_POLICY] = embedding_policy
     current_app.config[CONFIG_SEARCH_CLIENT] = search_client
     current_app.config[CONFIG_BLOB_CONTAINER_CLIENT] = blob_container_client
     current_app.config[CONFIG_AUTH_CLIENT] = auth_helper
+    current_app.config[CONFIG_CONTENT_CACHE] = LRUCache[CachedContent](
+        max_size=CONTENT_CACHE_MAX_BYTES, sizeof=lambda content: len(content.data)
+    )
+    current_app.config[CONFIG_CONTENT_CACHE_MAX_ENTRY_BYTES] = CONTENT_CACHE_MAX_ENTRY_BYTES
+    current_app.config[CONFIG_CONTENT_REVALIDATE] = CONTENT_REVALIDATE_SECONDS
+    current_app.config[CONFIG_STREAM_COMPACT] = STREAM_COMPACT_CHUNKS
+    current_app.config[CONFIG_METRICS_ENABLED] = METRICS_ENABLED
+    current_app.config[CONFIG_STREAM_COALESCE_WINDOW] = STREAM_COALESCE_MS / 1000
+    current_app.config[CONFIG_ADMISSION_CONTROLLER] = AdmissionController(
+        max_concurrency=ADMISSION_MAX_CONCURRENCY,
+        max_queue=ADMISSION_MAX_QUEUE,
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    )
+    current_app.config[CONFIG_THOUGHT_STORE] = ThoughtStore(
+        max_size=THOUGHT_STORE_MAX_BYTES, ttl=THOUGHT_STORE_TTL_SECONDS
+    )
+    answer_cache = (
+        AnswerCache(
+            max_size=ANSWER_CACHE_MAX_BYTES,
+            ttl=ANSWER_CACHE_TTL_SECONDS,
+            namespace=":".join(
+                str(name)
+                for name in (
+                    OPENAI_CHATGPT_MODEL,
+                    AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+                    AZURE_OPENAI_GPT4V_MODEL,
+                    AZURE_OPENAI_GPT4V_DEPLOYMENT,
+                    OPENAI_EMB_MODEL,
+                    AZURE_OPENAI_EMB_DEPLOYMENT,
+                )
+            ),
+        )
+        if ANSWER_CACHE_TTL_SECONDS > 0
+        else None
+    )
+    current_app.config[CONFIG_ANSWER_CACHE] = answer_cache
+
+    embedding_cache = LRUCache[array](
+        max_size=EMBEDDING_CACHE_MAX_BYTES,
+        ttl=EMBEDDING_CACHE_TTL_SECONDS,
+        sizeof=lambda vector: vector.itemsize * len(vector),
+    )
+    current_app.config[CONFIG_EMBEDDING_CACHE] = embedding_cache
+    search_cache = (
+        LRUCache[list[Document]](
+            max_size=SEARCH_CACHE_MAX_BYTES,
+            ttl=SEARCH_CACHE_TTL_SECONDS,
+            sizeof=lambda documents: sum(document.approximate_size() for document in documents),
+        )
+        if SEARCH_CACHE_TTL_SECONDS > 0
+        else None
+    )
+    current_app.config[CONFIG_SEARCH_CACHE] = search_cache
+    current_app.config[CONFIG_INDEX_VERSION_MONITOR] = IndexVersionMonitor(
+        blob_container_client,
+        caches=[cache for cache in (answer_cache and answer_cache.cache, search_cache) if cache is not None],
+    )
 
     current_app.config[CONFIG_GPT4V_DEPLOYED] = bool(USE_GPT4V)
+    current_app.config[CONFIG_APPROACH_FACTORIES] = {}
+    approaches_started = time.monotonic()
 
     # Various approaches to integrate GPT and external knowledge, most applications will use a single one of these patterns
     # or some derivative, here we include several for exploration purposes
@@ -326,30 +955,21 @@ async def setup_clients():
         content_field=KB_FIELDS_CONTENT,
         query_language=AZURE_SEARCH_QUERY_LANGUAGE,
         query_speller=AZURE_SEARCH_QUERY_SPELLER,
+        embedding_cache=embedding_cache,
+        search_cache=search_cache,
+        openai_scheduler=openai_scheduler,
+        search_policy=search_policy,
+        embedding_policy=embedding_policy,
     )
 
     if USE_GPT4V:
         if vision_key is None:
             raise ValueError("Vision key must be set (in Key Vault) to use the vision approach.")
 
-        current_app.config[CONFIG_ASK_VISION_APPROACH] = RetrieveThenReadVisionApproach(
-            search_client=search_client,
-            openai_client=openai_client,
-            blob_container_client=blob_container_client,
-            auth_helper=auth_helper,
-            vision_endpoint=AZURE_VISION_ENDPOINT,
-            vision_key=vision_key,
-            gpt4v_deployment=AZURE_OPENAI_GPT4V_DEPLOYMENT,
-            gpt4v_model=AZURE_OPENAI_GPT4V_MODEL,
-            embedding_model=OPENAI_EMB_MODEL,
-            embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-            sourcepage_field=KB_FIELDS_SOURCEPAGE,
-            content_field=KB_FIELDS_CONTENT,
-            query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-            query_speller=AZURE_SEARCH_QUERY_SPELLER,
-        )
+        image_cache = ImageCache(max_size=IMAGE_CACHE_MAX_BYTES, revalidate_interval=IMAGE_CACHE_REVALIDATE_SECONDS)
+        current_app.config[CONFIG_IMAGE_CACHE] = image_cache
 
-        current_app.config[CONFIG_CHAT_VISION_APPROACH] = ChatReadRetrieveReadVisionApproach(
+        vision_approach_kwargs: dict[str, Any] = dict(
             search_client=search_client,
             openai_client=openai_client,
             blob_container_client=blob_container_client,
@@ -364,8 +984,34 @@ async def setup_clients():
             content_field=KB_FIELDS_CONTENT,
             query_language=AZURE_SEARCH_QUERY_LANGUAGE,
             query_speller=AZURE_SEARCH_QUERY_SPELLER,
+            embedding_cache=embedding_cache,
+            search_cache=search_cache,
+            openai_scheduler=openai_scheduler,
+            search_policy=search_policy,
+            embedding_policy=embedding_policy,
+            http_session=http_sessions.session,
+            embedding_timeout=EMBEDDING_TIMEOUT_SECONDS,
+            image_fetch_concurrency=IMAGE_FETCH_CONCURRENCY,
+            image_cache=image_cache,
         )
 
+        # The vision approaches are only used when a user turns on GPT-4V, so they are built on first use
+        def create_ask_vision_approach() -> Approach:
+            from approaches.retrievethenreadvision import RetrieveThenReadVisionApproach
+
+            return RetrieveThenReadVisionApproach(**vision_approach_kwargs)
+
+        def create_chat_vision_approach() -> Approach:
+            from approaches.chatreadretrievereadvision import (
+                ChatReadRetrieveReadVisionApproach,
+            )
+
+            return ChatReadRetrieveReadVisionApproach(**vision_approach_kwargs)
+
+        approach_factories: dict[str, Callable[[], Approach]] = current_app.config[CONFIG_APPROACH_FACTORIES]
+        approach_factories[CONFIG_ASK_VISION_APPROACH] = create_ask_vision_approach
+        approach_factories[CONFIG_CHAT_VISION_APPROACH] = create_chat_vision_approach
+
     current_app.config[CONFIG_CHAT_APPROACH] = ChatReadRetrieveReadApproach(
         search_client=search_client,
         openai_client=openai_client,
@@ -378,6 +1024,20 @@ async def setup_clients():
         content_field=KB_FIELDS_CONTENT,
         query_language=AZURE_SEARCH_QUERY_LANGUAGE,
         query_speller=AZURE_SEARCH_QUERY_SPELLER,
+        embedding_cache=embedding_cache,
+        search_cache=search_cache,
+        openai_scheduler=openai_scheduler,
+        search_policy=search_policy,
+        embedding_policy=embedding_policy,
+        speculative_retrieval=SPECULATIVE_RETRIEVAL,
+        speculative_similarity=SPECULATIVE_RETRIEVAL_SIMILARITY,
+    )
+    startup_timings["approaches"] = time.monotonic() - approaches_started
+
+    current_app.logger.info(
+        "Clients set up in %.3fs (%s)",
+        time.monotonic() - startup_started,
+        ", ".join(f"{stage}: {duration:.3f}s" for stage, duration in startup_timings.items()),
     )
 
 
@@ -385,6 +1045,8 @@ async def setup_clients():
 async def close_clients():
     await current_app.config[CONFIG_SEARCH_CLIENT].close()
     await current_app.config[CONFIG_BLOB_CONTAINER_CLIENT].close()
+    current_app.config[CONFIG_AUTH_CLIENT].close()
+    await current_app.config[CONFIG_HTTP_SESSIONS].close()
 
 
 def create_app():
@@ -392,6 +1054,14 @@ def create_app():
     app.register_blueprint(bp)
 
     if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+        # Imported here as they take a while to load, and most of it is unused without Application Insights
+        from azure.monitor.opentelemetry import configure_azure_monitor
+        from opentelemetry.instrumentation.aiohttp_client import (
+            AioHttpClientInstrumentor,
+        )
+        from opentelemetry.instrumentation.asgi import OpenTelemetryMiddleware
+        from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+
         configure_azure_monitor()
         # This tracks HTTP requests made by aiohttp:
         AioHttpClientInstrumentor().instrument()
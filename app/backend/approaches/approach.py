@@ -1,6 +1,20 @@
+import asyncio
+import hashlib
+import logging
 import os
+from array import array
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
 from dataclasses import dataclass
-from typing import Any, AsyncGenerator, List, Optional, Union, cast
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    List,
+    Optional,
+    Union,
+    cast,
+)
 
 import aiohttp
 from azure.search.documents.aio import SearchClient
@@ -11,13 +25,32 @@ from azure.search.documents.models import (
     VectorQuery,
 )
 from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
 
 from core.authentication import AuthenticationHelper
+from core.cache import LRUCache
+from core.metrics import measure_stage, record_usage
+from core.openaischeduler import PRIORITY_INTERACTIVE, OpenAIScheduler, estimate_tokens
+from core.resilience import CircuitOpenError, ResiliencePolicy
 from text import nonewlines
 
 
 @dataclass
 class Document:
+    # Slotted, search results are created for every query and cached, so they shouldn't carry a __dict__ each
+    __slots__ = (
+        "id",
+        "content",
+        "embedding",
+        "image_embedding",
+        "category",
+        "sourcepage",
+        "sourcefile",
+        "oids",
+        "groups",
+        "captions",
+    )
+
     id: Optional[str]
     content: Optional[str]
     embedding: Optional[List[float]]
@@ -52,6 +85,12 @@ class Document:
             else [],
         }
 
+    def approximate_size(self) -> int:
+        """Returns a rough number of bytes held by the document, dominated by its text and embeddings."""
+        # A float in a Python list costs a pointer plus the float object itself
+        embedding_size = 32 * (len(self.embedding or []) + len(self.image_embedding or []))
+        return len(self.content or "") + embedding_size
+
     @classmethod
     def trim_embedding(cls, embedding: Optional[List[float]]) -> Optional[str]:
         """Returns a trimmed list of floats from the vector embedding."""
@@ -73,6 +112,28 @@ class ThoughtStep:
 
 
 class Approach:
+    # Only present in indexes built with access control
+    AUTH_FIELDS = ["oids", "groups"]
+
+    # Index fields holding the text and the citation of each document, set from KB_FIELDS_CONTENT
+    # and KB_FIELDS_SOURCEPAGE by the approaches that take them
+    content_field: str = "content"
+    sourcepage_field: str = "sourcepage"
+
+    # Shared cache of query vectors, stored as float32 arrays, see compute_text_embedding
+    embedding_cache: Optional[LRUCache[array]] = None
+    # Short-lived cache of search results, cleared when the index is re-ingested, see search
+    search_cache: Optional[LRUCache[List[Document]]] = None
+    # Pooled session shared by the whole app, a new session is opened per call when it isn't set
+    http_session: Optional[aiohttp.ClientSession] = None
+    # Seconds allowed for each embedding call made by compute_vectors
+    embedding_timeout: float = 10
+    # Admits the OpenAI calls of all approaches by priority, calls are made right away when it isn't set
+    openai_scheduler: Optional[OpenAIScheduler] = None
+    # Deadlines, hedging and circuit breaking for the calls to AI Search and to the embeddings model
+    search_policy: Optional[ResiliencePolicy] = None
+    embedding_policy: Optional[ResiliencePolicy] = None
+
     def __init__(
         self,
         search_client: SearchClient,
@@ -83,6 +144,12 @@ class Approach:
         embedding_deployment: Optional[str],  # Not needed for non-Azure OpenAI or for retrieval_mode="text"
         embedding_model: str,
         openai_host: str,
+        embedding_cache: Optional[LRUCache[array]] = None,
+        search_cache: Optional[LRUCache[List[Document]]] = None,
+        http_session: Optional[aiohttp.ClientSession] = None,
+        openai_scheduler: Optional[OpenAIScheduler] = None,
+        search_policy: Optional[ResiliencePolicy] = None,
+        embedding_policy: Optional[ResiliencePolicy] = None,
     ):
         self.search_client = search_client
         self.openai_client = openai_client
@@ -92,6 +159,12 @@ class Approach:
         self.embedding_deployment = embedding_deployment
         self.embedding_model = embedding_model
         self.openai_host = openai_host
+        self.embedding_cache = embedding_cache
+        self.search_cache = search_cache
+        self.http_session = http_session
+        self.openai_scheduler = openai_scheduler
+        self.search_policy = search_policy
+        self.embedding_policy = embedding_policy
 
     def build_filter(self, overrides: dict[str, Any], auth_claims: dict[str, Any]) -> Optional[str]:
         exclude_category = overrides.get("exclude_category") or None
@@ -111,43 +184,118 @@ class Approach:
         vectors: List[VectorQuery],
         use_semantic_ranker: bool,
         use_semantic_captions: bool,
+        select_vectors: List[str] = [],
     ) -> List[Document]:
-        # Use semantic ranker if requested and if retrieval mode is text or hybrid (vectors + text)
-        if use_semantic_ranker and query_text:
-            results = await self.search_client.search(
-                search_text=query_text,
-                filter=filter,
-                query_type=QueryType.SEMANTIC,
-                query_language=self.query_language,
-                query_speller=self.query_speller,
-                semantic_configuration_name="default",
-                top=top,
-                query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                vector_queries=vectors,
-            )
-        else:
-            results = await self.search_client.search(
-                search_text=query_text or "", filter=filter, top=top, vector_queries=vectors
+        """
+        Searches the index and returns the results as Documents. Only the fields read by the approaches
+        are fetched, vector fields (e.g. "embedding") are left out unless listed in select_vectors.
+        """
+        select = ["id", self.content_field, "category", self.sourcepage_field, "sourcefile"] + select_vectors
+        if self.auth_helper and self.auth_helper.has_auth_fields:
+            select = select + self.AUTH_FIELDS
+        # The filter carries the security filter, so cached results are only shared by users with the same access
+        cache_key = (
+            query_text,
+            filter,
+            top,
+            use_semantic_ranker,
+            use_semantic_captions,
+            tuple(select),
+            tuple(
+                (
+                    vector.fields,
+                    vector.k,
+                    hashlib.sha256(array("f", vector.vector or []).tobytes()).hexdigest()
+                    if isinstance(vector, RawVectorQuery)
+                    else repr(vector),
+                )
+                for vector in vectors
+            ),
+        )
+        if self.search_cache is not None and (cached_documents := self.search_cache.get(cache_key)) is not None:
+            return list(cached_documents)
+
+        with measure_stage(type(self).__name__, "search"):
+            documents, degraded = await self.run_search(
+                top, query_text, filter, vectors, use_semantic_ranker, use_semantic_captions, select
             )
+        # Degraded results are only good while the dependency is failing, so they are not cached
+        if self.search_cache is not None and not degraded:
+            self.search_cache.set(cache_key, documents)
+        return list(documents)
+
+    async def run_search(
+        self,
+        top: int,
+        query_text: Optional[str],
+        filter: Optional[str],
+        vectors: List[VectorQuery],
+        use_semantic_ranker: bool,
+        use_semantic_captions: bool,
+        select: List[str],
+    ) -> tuple[List[Document], bool]:
+        """
+        Runs the search through the search policy, and returns the documents and whether the retrieval was degraded.
+        While the breaker of hybrid searches is open, the search falls back to text-only retrieval, or to vector-only
+        retrieval if text searches are failing too, the same as with the "text" and "vectors" retrieval modes.
+        """
+
+        async def fetch_documents(query_text: Optional[str], vectors: List[VectorQuery]) -> List[Document]:
+            # Use semantic ranker if requested and if retrieval mode is text or hybrid (vectors + text)
+            if use_semantic_ranker and query_text:
+                results = await self.search_client.search(
+                    search_text=query_text,
+                    filter=filter,
+                    query_type=QueryType.SEMANTIC,
+                    query_language=self.query_language,
+                    query_speller=self.query_speller,
+                    semantic_configuration_name="default",
+                    top=top,
+                    query_caption="extractive|highlight-false" if use_semantic_captions else None,
+                    vector_queries=vectors,
+                    select=select,
+                )
+            else:
+                results = await self.search_client.search(
+                    search_text=query_text or "", filter=filter, top=top, vector_queries=vectors, select=select
+                )
 
-        documents = []
-        async for page in results.by_page():
-            async for document in page:
-                documents.append(
-                    Document(
-                        id=document.get("id"),
-                        content=document.get("content"),
-                        embedding=document.get("embedding"),
-                        image_embedding=document.get("imageEmbedding"),
-                        category=document.get("category"),
-                        sourcepage=document.get("sourcepage"),
-                        sourcefile=document.get("sourcefile"),
-                        oids=document.get("oids"),
-                        groups=document.get("groups"),
-                        captions=cast(List[CaptionResult], document.get("@search.captions")),
+            documents = []
+            async for page in results.by_page():
+                async for document in page:
+                    documents.append(
+                        Document(
+                            id=document.get("id"),
+                            content=document.get(self.content_field),
+                            embedding=document.get("embedding"),
+                            image_embedding=document.get("imageEmbedding"),
+                            category=document.get("category"),
+                            sourcepage=document.get(self.sourcepage_field),
+                            sourcefile=document.get("sourcefile"),
+                            oids=document.get("oids"),
+                            groups=document.get("groups"),
+                            captions=cast(List[CaptionResult], document.get("@search.captions")),
+                        )
                     )
+            return documents
+
+        if self.search_policy is None:
+            return await fetch_documents(query_text, vectors), False
+
+        search_policy = self.search_policy
+        if query_text and vectors:
+            attempts = [("hybrid", query_text, vectors), ("text", query_text, []), ("vectors", None, vectors)]
+        else:
+            attempts = [("text" if query_text else "vectors", query_text, vectors)]
+        for kind, attempt_query_text, attempt_vectors in attempts:
+            if search_policy.allows(kind):
+                if kind != attempts[0][0]:
+                    logging.warning("Hybrid search is failing, falling back to %s retrieval", kind)
+                documents = await search_policy.call(
+                    lambda: fetch_documents(attempt_query_text, attempt_vectors), kind=kind
                 )
-        return documents
+                return documents, kind != attempts[0][0]
+        raise CircuitOpenError("Search is unavailable")
 
     def get_sources_content(
         self, results: List[Document], use_semantic_captions: bool, use_image_citation: bool
@@ -177,29 +325,103 @@ class Approach:
 
             return sourcepage
 
-    async def compute_text_embedding(self, q: str):
-        embedding = await self.openai_client.embeddings.create(
-            # Azure Open AI takes the deployment name as the model name
-            model=self.embedding_deployment if self.embedding_deployment else self.embedding_model,
-            input=q,
-        )
-        query_vector = embedding.data[0].embedding
+    @asynccontextmanager
+    async def openai_slot(self, priority: int, tokens: int) -> AsyncIterator[None]:
+        if self.openai_scheduler is None:
+            yield
+            return
+        async with self.openai_scheduler.slot(priority, tokens):
+            yield
+
+    async def create_chat_completion(self, priority: int, stage: Optional[str] = None, **kwargs) -> Any:
+        """
+        Calls chat.completions.create with the given arguments once the OpenAI scheduler admits it,
+        timing the call as the given stage of the approach.
+        """
+        async with self.openai_slot(priority, estimate_tokens(kwargs["messages"], kwargs.get("max_tokens") or 0)):
+            with measure_stage(type(self).__name__, stage) if stage else nullcontext():
+                chat_completion = await self.openai_client.chat.completions.create(**kwargs)
+        # Streamed completions don't report their usage
+        if isinstance(chat_completion, ChatCompletion):
+            record_usage(type(self).__name__, chat_completion.usage)
+        return chat_completion
+
+    async def compute_text_embedding(self, q: str, priority: int = PRIORITY_INTERACTIVE):
+        # Azure Open AI takes the deployment name as the model name
+        model = self.embedding_deployment if self.embedding_deployment else self.embedding_model
+        cache_key = ("text", model, q)
+        cached_vector = self.embedding_cache.get(cache_key) if self.embedding_cache is not None else None
+        if cached_vector is not None:
+            query_vector = cached_vector.tolist()
+        else:
+            async with self.openai_slot(priority, estimate_tokens([q])):
+                with measure_stage(type(self).__name__, "embedding"):
+                    if self.embedding_policy is None:
+                        embedding = await self.openai_client.embeddings.create(model=model, input=q)
+                    else:
+                        embedding = await self.embedding_policy.call(
+                            lambda: self.openai_client.embeddings.create(model=model, input=q)
+                        )
+            record_usage(type(self).__name__, embedding.usage, prompt_type="embedding")
+            query_vector = embedding.data[0].embedding
+            if self.embedding_cache is not None:
+                self.embedding_cache.set(cache_key, array("f", query_vector))
         return RawVectorQuery(vector=query_vector, k=50, fields="embedding")
 
+    def can_compute_text_embedding(self, has_text: bool) -> bool:
+        """
+        Whether to compute a query embedding for a retrieval mode using vectors. While the breaker of the embeddings
+        model is open, hybrid retrieval degrades to text-only retrieval, and vector-only retrieval fails right away.
+        """
+        return self.embedding_policy is None or self.embedding_policy.allows() or not has_text
+
     async def compute_image_embedding(self, q: str, vision_endpoint: str, vision_key: str):
         endpoint = f"{vision_endpoint}computervision/retrieval:vectorizeText"
         params = {"api-version": "2023-02-01-preview", "modelVersion": "latest"}
+        cache_key = ("image", vision_endpoint, params["modelVersion"], q)
+        cached_vector = self.embedding_cache.get(cache_key) if self.embedding_cache is not None else None
+        if cached_vector is not None:
+            return RawVectorQuery(vector=cached_vector.tolist(), k=50, fields="imageEmbedding")
+
         headers = {"Content-Type": "application/json", "Ocp-Apim-Subscription-Key": vision_key}
         data = {"text": q}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url=endpoint, params=params, headers=headers, json=data, raise_for_status=True
-            ) as response:
-                json = await response.json()
-                image_query_vector = json["vector"]
+        async with AsyncExitStack() as stack:
+            session = self.http_session
+            if session is None:
+                session = await stack.enter_async_context(aiohttp.ClientSession())
+            with measure_stage(type(self).__name__, "image_embedding"):
+                async with session.post(
+                    url=endpoint, params=params, headers=headers, json=data, raise_for_status=True
+                ) as response:
+                    json = await response.json()
+                    image_query_vector = json["vector"]
+        if self.embedding_cache is not None:
+            self.embedding_cache.set(cache_key, array("f", image_query_vector))
         return RawVectorQuery(vector=image_query_vector, k=50, fields="imageEmbedding")
 
+    async def compute_vectors(
+        self, q: str, vector_fields: list[str], vision_endpoint: str, vision_key: str
+    ) -> list[VectorQuery]:
+        """
+        Computes the query vector for every requested field concurrently, so that hybrid text and image retrieval
+        waits for the slowest embedding service rather than for all of them in turn.
+        Each call is bounded by embedding_timeout and raises asyncio.TimeoutError once it runs out. The deadline
+        of text embeddings is left to embedding_policy when there is one, so that timeouts count against its breaker.
+        The vectors are returned in the order of vector_fields.
+        """
+
+        def compute_vector(field: str) -> Awaitable[VectorQuery]:
+            if field == "embedding":
+                if self.embedding_policy is not None:
+                    return self.compute_text_embedding(q)
+                return asyncio.wait_for(self.compute_text_embedding(q), timeout=self.embedding_timeout)
+            return asyncio.wait_for(
+                self.compute_image_embedding(q, vision_endpoint, vision_key), timeout=self.embedding_timeout
+            )
+
+        return list(await asyncio.gather(*(compute_vector(field) for field in vector_fields)))
+
     async def run(
         self, messages: list[dict], stream: bool = False, session_state: Any = None, context: dict[str, Any] = {}
     ) -> Union[dict[str, Any], AsyncGenerator[dict[str, Any], None]]:
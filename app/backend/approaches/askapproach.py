@@ -0,0 +1,104 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Any, AsyncGenerator, Union
+
+from openai.types.chat import ChatCompletion
+
+from approaches.approach import Approach
+from core.metrics import measure_stage, observe_stage, request_timings_ms
+
+
+class AskApproach(Approach, ABC):
+    """
+    Base class for one-shot question answering approaches. Subclasses retrieve the sources and build the prompt
+    in run_until_final_call, and this class either waits for the completion or streams it back in the same
+    chunk format as ChatApproach, starting with a chunk that carries the context.
+    """
+
+    ASSISTANT = "assistant"
+
+    @abstractmethod
+    async def run_until_final_call(
+        self, messages: list[dict], overrides: dict[str, Any], auth_claims: dict[str, Any], should_stream: bool
+    ) -> tuple:
+        pass
+
+    async def run_without_streaming(
+        self,
+        messages: list[dict],
+        overrides: dict[str, Any],
+        auth_claims: dict[str, Any],
+        session_state: Any = None,
+    ) -> dict[str, Any]:
+        extra_info, chat_coroutine = await self.run_until_final_call(
+            messages, overrides, auth_claims, should_stream=False
+        )
+        with measure_stage(type(self).__name__, "completion"):
+            chat_completion_response: ChatCompletion = await chat_coroutine
+        chat_resp = chat_completion_response.model_dump()  # Convert to dict to make it JSON serializable
+        chat_resp["choices"][0]["context"] = extra_info
+        if timings := request_timings_ms():
+            extra_info["timings"] = timings
+        chat_resp["choices"][0]["session_state"] = session_state
+        return chat_resp
+
+    async def run_with_streaming(
+        self,
+        messages: list[dict],
+        overrides: dict[str, Any],
+        auth_claims: dict[str, Any],
+        session_state: Any = None,
+    ) -> AsyncGenerator[dict, None]:
+        extra_info, chat_coroutine = await self.run_until_final_call(
+            messages, overrides, auth_claims, should_stream=True
+        )
+        if timings := request_timings_ms():
+            extra_info["timings"] = timings
+        yield {
+            "choices": [
+                {
+                    "delta": {"role": self.ASSISTANT},
+                    "context": extra_info,
+                    "session_state": session_state,
+                    "finish_reason": None,
+                    "index": 0,
+                }
+            ],
+            "object": "chat.completion.chunk",
+        }
+
+        completion_started = time.perf_counter()
+        first_token_received = False
+        async for event_chunk in await chat_coroutine:
+            # "2023-07-01-preview" API version has a bug where first response has empty choices
+            event = event_chunk.model_dump()  # Convert pydantic model to dict
+            if event["choices"]:
+                if event["choices"][0]["delta"].get("content") and not first_token_received:
+                    first_token_received = True
+                    observe_stage(type(self).__name__, "first_token", time.perf_counter() - completion_started)
+                yield event
+        observe_stage(type(self).__name__, "completion", time.perf_counter() - completion_started)
+        # The timings of the completion are only known once it has been streamed
+        if timings := request_timings_ms():
+            yield {
+                "choices": [
+                    {
+                        "delta": {"role": self.ASSISTANT},
+                        "context": {"timings": timings},
+                        "finish_reason": None,
+                        "index": 0,
+                    }
+                ],
+                "object": "chat.completion.chunk",
+            }
+
+    async def run(
+        self, messages: list[dict], stream: bool = False, session_state: Any = None, context: dict[str, Any] = {}
+    ) -> Union[dict[str, Any], AsyncGenerator[dict[str, Any], None]]:
+        overrides = context.get("overrides", {})
+        auth_claims = context.get("auth_claims", {})
+
+        if stream is False:
+            return await self.run_without_streaming(messages, overrides, auth_claims, session_state)
+        else:
+            return self.run_with_streaming(messages, overrides, auth_claims, session_state)
@@ -1,6 +1,7 @@
 import json
 import logging
 import re
+import time
 from abc import ABC, abstractmethod
 from typing import Any, AsyncGenerator, Optional, Union
 
@@ -12,6 +13,8 @@ from openai.types.chat import (
 
 from approaches.approach import Approach
 from core.messagebuilder import MessageBuilder
+from core.metrics import measure_stage, observe_stage, request_timings_ms
+from core.modelhelper import prime_token_counts
 
 
 class ChatApproach(Approach, ABC):
@@ -56,6 +59,18 @@ class ChatApproach(Approach, ABC):
     async def run_until_final_call(self, history, overrides, auth_claims, should_stream) -> tuple:
         pass
 
+    def prime_prompt_token_counts(self, model_id: str):
+        """Tokenizes the query prompt, the few-shots and the default system prompts once, when the approach is created."""
+        prime_token_counts(
+            [
+                self.query_prompt_template,
+                *(shot["content"] for shot in self.query_prompt_few_shots),
+                self.get_system_prompt(None, ""),
+                self.get_system_prompt(None, self.follow_up_questions_prompt_content),
+            ],
+            model_id,
+        )
+
     def get_system_prompt(self, override_prompt: Optional[str], follow_up_questions_prompt: str) -> str:
         if override_prompt is None:
             return self.system_message_chat_conversation.format(
@@ -104,16 +119,28 @@ class ChatApproach(Approach, ABC):
         message_builder.insert_message(self.USER, user_content, index=append_index)
         total_token_count = message_builder.count_tokens_for_message(dict(message_builder.messages[-1]))  # type: ignore
 
-        newest_to_oldest = list(reversed(history[:-1]))
-        for message in newest_to_oldest:
+        # Pick the newest messages that fit in the budget, then insert them all at once in chronological order
+        kept_history: list[dict[str, str]] = []
+        for message in reversed(history[:-1]):
             potential_message_count = message_builder.count_tokens_for_message(message)
             if (total_token_count + potential_message_count) > max_tokens:
                 logging.debug("Reached max tokens of %d, history will be truncated", max_tokens)
                 break
-            message_builder.insert_message(message["role"], message["content"], index=append_index)
+            kept_history.append(message)
             total_token_count += potential_message_count
+        message_builder.insert_messages(kept_history[::-1], index=append_index)
         return message_builder.messages
 
+    def get_prompt_token_count(self, system_prompt: str, model_id: str, few_shots=[]) -> int:
+        """
+        Counts the tokens of the system prompt and the few-shots, which are sent on top of the budget
+        that get_messages_from_history fills with the history and the user content.
+        """
+        message_builder = MessageBuilder(system_prompt, model_id)
+        for shot in reversed(few_shots):
+            message_builder.insert_message(shot.get("role"), shot.get("content"))
+        return message_builder.token_count
+
     async def run_without_streaming(
         self,
         history: list[dict[str, str]],
@@ -124,9 +151,12 @@ class ChatApproach(Approach, ABC):
         extra_info, chat_coroutine = await self.run_until_final_call(
             history, overrides, auth_claims, should_stream=False
         )
-        chat_completion_response: ChatCompletion = await chat_coroutine
+        with measure_stage(type(self).__name__, "completion"):
+            chat_completion_response: ChatCompletion = await chat_coroutine
         chat_resp = chat_completion_response.model_dump()  # Convert to dict to make it JSON serializable
         chat_resp["choices"][0]["context"] = extra_info
+        if timings := request_timings_ms():
+            extra_info["timings"] = timings
         if overrides.get("suggest_followup_questions"):
             content, followup_questions = self.extract_followup_questions(chat_resp["choices"][0]["message"]["content"])
             chat_resp["choices"][0]["message"]["content"] = content
@@ -144,6 +174,8 @@ class ChatApproach(Approach, ABC):
         extra_info, chat_coroutine = await self.run_until_final_call(
             history, overrides, auth_claims, should_stream=True
         )
+        if timings := request_timings_ms():
+            extra_info["timings"] = timings
         yield {
             "choices": [
                 {
@@ -159,6 +191,8 @@ class ChatApproach(Approach, ABC):
 
         followup_questions_started = False
         followup_content = ""
+        completion_started = time.perf_counter()
+        first_token_received = False
         async for event_chunk in await chat_coroutine:
             # "2023-07-01-preview" API version has a bug where first response has empty choices
             event = event_chunk.model_dump()  # Convert pydantic model to dict
@@ -166,6 +200,9 @@ class ChatApproach(Approach, ABC):
                 # if event contains << and not >>, it is start of follow-up question, truncate
                 content = event["choices"][0]["delta"].get("content")
                 content = content or ""  # content may either not exist in delta, or explicitly be None
+                if content and not first_token_received:
+                    first_token_received = True
+                    observe_stage(type(self).__name__, "first_token", time.perf_counter() - completion_started)
                 if overrides.get("suggest_followup_questions") and "<<" in content:
                     followup_questions_started = True
                     earlier_content = content[: content.index("<<")]
@@ -177,6 +214,7 @@ class ChatApproach(Approach, ABC):
                     followup_content += content
                 else:
                     yield event
+        observe_stage(type(self).__name__, "completion", time.perf_counter() - completion_started)
         if followup_content:
             _, followup_questions = self.extract_followup_questions(followup_content)
             yield {
@@ -190,6 +228,19 @@ class ChatApproach(Approach, ABC):
                 ],
                 "object": "chat.completion.chunk",
             }
+        # The timings of the completion are only known once it has been streamed
+        if timings := request_timings_ms():
+            yield {
+                "choices": [
+                    {
+                        "delta": {"role": self.ASSISTANT},
+                        "context": {"timings": timings},
+                        "finish_reason": None,
+                        "index": 0,
+                    }
+                ],
+                "object": "chat.completion.chunk",
+            }
 
     async def run(
         self, messages: list[dict], stream: bool = False, session_state: Any = None, context: dict[str, Any] = {}
@@ -1,3 +1,7 @@
+import asyncio
+import logging
+import re
+from array import array
 from typing import Any, Coroutine, Literal, Optional, Union, overload
 
 from azure.search.documents.aio import SearchClient
@@ -8,10 +12,23 @@ from openai.types.chat import (
     ChatCompletionChunk,
 )
 
-from approaches.approach import ThoughtStep
+from approaches.approach import Document, ThoughtStep
 from approaches.chatapproach import ChatApproach
 from core.authentication import AuthenticationHelper
+from core.cache import LRUCache
+from core.metrics import (
+    add_request_timings,
+    request_timings_ms,
+    start_request_timings,
+)
 from core.modelhelper import get_token_limit
+from core.openaischeduler import (
+    PRIORITY_ANSWER,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    OpenAIScheduler,
+)
+from core.resilience import ResiliencePolicy
 
 
 class ChatReadRetrieveReadApproach(ChatApproach):
@@ -36,6 +53,13 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         content_field: str,
         query_language: str,
         query_speller: str,
+        embedding_cache: Optional[LRUCache[array]] = None,
+        search_cache: Optional[LRUCache[list[Document]]] = None,
+        openai_scheduler: Optional[OpenAIScheduler] = None,
+        search_policy: Optional[ResiliencePolicy] = None,
+        embedding_policy: Optional[ResiliencePolicy] = None,
+        speculative_retrieval: bool = False,
+        speculative_similarity: float = 0.8,
     ):
         self.search_client = search_client
         self.openai_client = openai_client
@@ -49,6 +73,14 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         self.query_language = query_language
         self.query_speller = query_speller
         self.chatgpt_token_limit = get_token_limit(chatgpt_model)
+        self.embedding_cache = embedding_cache
+        self.search_cache = search_cache
+        self.openai_scheduler = openai_scheduler
+        self.search_policy = search_policy
+        self.embedding_policy = embedding_policy
+        self.speculative_retrieval = speculative_retrieval
+        self.speculative_similarity = speculative_similarity
+        self.prime_prompt_token_counts(chatgpt_model)
 
     @property
     def system_message_chat_conversation(self):
@@ -115,41 +147,83 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         ]
 
         # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
+        # Setting too low risks malformed JSON, setting too high may affect performance
+        query_response_token_limit = 100
+        query_messages_token_limit = (
+            self.chatgpt_token_limit
+            - query_response_token_limit
+            - self.get_prompt_token_count(self.query_prompt_template, self.chatgpt_model, self.query_prompt_few_shots)
+        )
         messages = self.get_messages_from_history(
             system_prompt=self.query_prompt_template,
             model_id=self.chatgpt_model,
             history=history,
             user_content=user_query_request,
-            max_tokens=self.chatgpt_token_limit - len(user_query_request),
+            max_tokens=query_messages_token_limit,
             few_shots=self.query_prompt_few_shots,
         )
 
-        chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
-            messages=messages,  # type: ignore
-            # Azure Open AI takes the deployment name as the model name
-            model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
-            temperature=0.0,
-            max_tokens=100,  # Setting too low risks malformed JSON, setting too high may affect performance
-            n=1,
-            functions=functions,
-            function_call="auto",
-        )
+        async def retrieve(query: str, priority: int = PRIORITY_INTERACTIVE) -> list[Document]:
+            # If retrieval mode includes vectors, compute an embedding for the query
+            vectors: list[VectorQuery] = []
+            if has_vector and self.can_compute_text_embedding(has_text):
+                vectors.append(await self.compute_text_embedding(query, priority))
+            # Only keep the text query if the retrieval mode uses text, otherwise drop it
+            return await self.search(
+                top, query if has_text else None, filter, vectors, use_semantic_ranker, use_semantic_captions
+            )
+
+        # Speculatively retrieve with the user's own question while the search query is generated,
+        # most first questions are already good search queries
+        async def speculate() -> tuple[list[Document], dict[str, float]]:
+            # Its stage durations are kept apart, they only count for the request if its results are used
+            timings = start_request_timings()
+            return await retrieve(original_user_query, PRIORITY_BACKGROUND), timings
+
+        # Requests can turn it off, but only the server setting turns it on, as it adds searches and embeddings
+        speculative = self.speculative_retrieval and overrides.get("speculative_retrieval", True)
+        speculative_results = asyncio.create_task(speculate()) if speculative else None
+
+        try:
+            chat_completion: ChatCompletion = await self.create_chat_completion(
+                PRIORITY_INTERACTIVE,
+                stage="rewrite",
+                messages=messages,
+                # Azure Open AI takes the deployment name as the model name
+                model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
+                temperature=0.0,
+                max_tokens=query_response_token_limit,
+                n=1,
+                functions=functions,
+                function_call="auto",
+            )
+        except BaseException:
+            if speculative_results:
+                self.discard(speculative_results)
+            raise
 
         query_text = self.get_search_query(chat_completion, original_user_query)
 
         # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
+        used_speculative_results = False
+        if speculative_results:
+            if self.is_similar_query(query_text, original_user_query):
+                try:
+                    results, speculative_timings = await speculative_results
+                    add_request_timings(speculative_timings)
+                    query_text = original_user_query
+                    used_speculative_results = True
+                except Exception as error:
+                    logging.warning("Speculative retrieval failed, retrieving with the search query: %s", error)
+            else:
+                self.discard(speculative_results)
+        if not used_speculative_results:
+            results = await retrieve(query_text)
 
-        # If retrieval mode includes vectors, compute an embedding for the query
-        vectors: list[VectorQuery] = []
-        if has_vector:
-            vectors.append(await self.compute_text_embedding(query_text))
-
-        # Only keep the text query if the retrieval mode uses text, otherwise drop it
+        # The search query is only shown in the thought process if the retrieval mode uses text
         if not has_text:
             query_text = None
 
-        results = await self.search(top, query_text, filter, vectors, use_semantic_ranker, use_semantic_captions)
-
         sources_content = self.get_sources_content(results, use_semantic_captions, use_image_citation=False)
         content = "\n".join(sources_content)
 
@@ -162,7 +236,11 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         )
 
         response_token_limit = 1024
-        messages_token_limit = self.chatgpt_token_limit - response_token_limit
+        messages_token_limit = (
+            self.chatgpt_token_limit
+            - response_token_limit
+            - self.get_prompt_token_count(system_message, self.chatgpt_model)
+        )
         messages = self.get_messages_from_history(
             system_prompt=system_message,
             model_id=self.chatgpt_model,
@@ -184,14 +262,20 @@ class ChatReadRetrieveReadApproach(ChatApproach):
                 ThoughtStep(
                     "Generated search query",
                     query_text,
-                    {"use_semantic_captions": use_semantic_captions, "has_vector": has_vector},
+                    {
+                        "use_semantic_captions": use_semantic_captions,
+                        "has_vector": has_vector,
+                        **({"speculative_retrieval": used_speculative_results} if speculative else {}),
+                        **request_timings_ms("rewrite", "embedding", "search"),
+                    },
                 ),
                 ThoughtStep("Results", [result.serialize_for_results() for result in results]),
                 ThoughtStep("Prompt", [str(message) for message in messages]),
             ],
         }
 
-        chat_coroutine = self.openai_client.chat.completions.create(
+        chat_coroutine = self.create_chat_completion(
+            PRIORITY_ANSWER,
             # Azure Open AI takes the deployment name as the model name
             model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
             messages=messages,
@@ -201,3 +285,21 @@ class ChatReadRetrieveReadApproach(ChatApproach):
             stream=should_stream,
         )
         return (extra_info, chat_coroutine)
+
+    def is_similar_query(self, query: str, user_query: str) -> bool:
+        """
+        Whether the generated search query is close enough to the user's question to reuse its results,
+        measured as the share of the words of the search query that also appear in the question.
+        Rewrites that only drop filler words from the question keep all of their words.
+        """
+        words = set(re.findall(r"\w+", query.lower()))
+        if not words:
+            return False
+        user_words = set(re.findall(r"\w+", user_query.lower()))
+        return len(words & user_words) / len(words) >= self.speculative_similarity
+
+    @staticmethod
+    def discard(task: asyncio.Task):
+        task.cancel()
+        # Retrieve the exception of a task that already failed, so it isn't logged as never retrieved
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
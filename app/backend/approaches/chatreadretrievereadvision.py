@@ -1,6 +1,9 @@
+from array import array
 from typing import Any, Coroutine, Optional, Union
 
+import aiohttp
 from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorQuery
 from azure.storage.blob.aio import ContainerClient
 from openai import AsyncOpenAI, AsyncStream
 from openai.types.chat import (
@@ -10,11 +13,15 @@ from openai.types.chat import (
     ChatCompletionContentPartParam,
 )
 
-from approaches.approach import ThoughtStep
+from approaches.approach import Document, ThoughtStep
 from approaches.chatapproach import ChatApproach
 from core.authentication import AuthenticationHelper
-from core.imageshelper import fetch_image
+from core.cache import LRUCache
+from core.imageshelper import ImageCache, fetch_images
+from core.metrics import measure_stage, request_timings_ms
 from core.modelhelper import get_token_limit
+from core.openaischeduler import PRIORITY_ANSWER, PRIORITY_INTERACTIVE, OpenAIScheduler
+from core.resilience import ResiliencePolicy
 
 
 class ChatReadRetrieveReadVisionApproach(ChatApproach):
@@ -42,6 +49,15 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         query_speller: str,
         vision_endpoint: str,
         vision_key: str,
+        embedding_cache: Optional[LRUCache[array]] = None,
+        search_cache: Optional[LRUCache[list[Document]]] = None,
+        http_session: Optional[aiohttp.ClientSession] = None,
+        openai_scheduler: Optional[OpenAIScheduler] = None,
+        search_policy: Optional[ResiliencePolicy] = None,
+        embedding_policy: Optional[ResiliencePolicy] = None,
+        embedding_timeout: float = 10,
+        image_fetch_concurrency: int = 4,
+        image_cache: Optional[ImageCache] = None,
     ):
         self.search_client = search_client
         self.blob_container_client = blob_container_client
@@ -58,6 +74,16 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         self.vision_endpoint = vision_endpoint
         self.vision_key = vision_key
         self.chatgpt_token_limit = get_token_limit(gpt4v_model)
+        self.embedding_cache = embedding_cache
+        self.search_cache = search_cache
+        self.http_session = http_session
+        self.openai_scheduler = openai_scheduler
+        self.search_policy = search_policy
+        self.embedding_policy = embedding_policy
+        self.embedding_timeout = embedding_timeout
+        self.image_fetch_concurrency = image_fetch_concurrency
+        self.image_cache = image_cache
+        self.prime_prompt_token_counts(gpt4v_model)
 
     @property
     def system_message_chat_conversation(self):
@@ -99,20 +125,28 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
         user_query_request = "Generate search query for: " + original_user_query
 
+        query_response_token_limit = 100
+        query_messages_token_limit = (
+            self.chatgpt_token_limit
+            - query_response_token_limit
+            - self.get_prompt_token_count(self.query_prompt_template, self.gpt4v_model, self.query_prompt_few_shots)
+        )
         messages = self.get_messages_from_history(
             system_prompt=self.query_prompt_template,
             model_id=self.gpt4v_model,
             history=history,
             user_content=user_query_request,
-            max_tokens=self.chatgpt_token_limit - len(" ".join(user_query_request)),
+            max_tokens=query_messages_token_limit,
             few_shots=self.query_prompt_few_shots,
         )
 
-        chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
+        chat_completion: ChatCompletion = await self.create_chat_completion(
+            PRIORITY_INTERACTIVE,
+            stage="rewrite",
             model=self.gpt4v_deployment if self.gpt4v_deployment else self.gpt4v_model,
             messages=messages,
             temperature=overrides.get("temperature") or 0.0,
-            max_tokens=100,
+            max_tokens=query_response_token_limit,
             n=1,
         )
 
@@ -121,15 +155,15 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
 
         # If retrieval mode includes vectors, compute an embedding for the query
-        vectors = []
+        vectors: list[VectorQuery] = []
         if has_vector:
-            for field in vector_fields:
-                vector = (
-                    await self.compute_text_embedding(query_text)
-                    if field == "embedding"
-                    else await self.compute_image_embedding(query_text, self.vision_endpoint, self.vision_key)
-                )
-                vectors.append(vector)
+            # The text embedding is left out while the embeddings model is unavailable, see can_compute_text_embedding
+            available_vector_fields = [
+                field for field in vector_fields if field != "embedding" or self.can_compute_text_embedding(has_text)
+            ]
+            vectors = await self.compute_vectors(
+                query_text, available_vector_fields, self.vision_endpoint, self.vision_key
+            )
 
         # Only keep the text query if the retrieval mode uses text, otherwise drop it
         if not has_text:
@@ -148,7 +182,11 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         )
 
         response_token_limit = 1024
-        messages_token_limit = self.chatgpt_token_limit - response_token_limit
+        messages_token_limit = (
+            self.chatgpt_token_limit
+            - response_token_limit
+            - self.get_prompt_token_count(system_message, self.gpt4v_model)
+        )
 
         user_content: list[ChatCompletionContentPartParam] = [{"text": original_user_query, "type": "text"}]
         image_list: list[ChatCompletionContentPartImageParam] = []
@@ -156,8 +194,11 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         if include_gtpV_text:
             user_content.append({"text": "\n\nSources:\n" + content, "type": "text"})
         if include_gtpV_images:
-            for result in results:
-                url = await fetch_image(self.blob_container_client, result)
+            with measure_stage(type(self).__name__, "image_fetch"):
+                image_urls = await fetch_images(
+                    self.blob_container_client, results, self.image_fetch_concurrency, self.image_cache
+                )
+            for url in image_urls:
                 if url:
                     image_list.append({"image_url": url, "type": "image_url"})
             user_content.extend(image_list)
@@ -185,14 +226,19 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
                 ThoughtStep(
                     "Generated search query",
                     query_text,
-                    {"use_semantic_captions": use_semantic_captions, "vector_fields": vector_fields},
+                    {
+                        "use_semantic_captions": use_semantic_captions,
+                        "vector_fields": vector_fields,
+                        **request_timings_ms("rewrite", "embedding", "image_embedding", "search", "image_fetch"),
+                    },
                 ),
                 ThoughtStep("Results", [result.serialize_for_results() for result in results]),
                 ThoughtStep("Prompt", [str(message) for message in messages]),
             ],
         }
 
-        chat_coroutine = self.openai_client.chat.completions.create(
+        chat_coroutine = self.create_chat_completion(
+            PRIORITY_ANSWER,
             model=self.gpt4v_deployment if self.gpt4v_deployment else self.gpt4v_model,
             messages=messages,
             temperature=overrides.get("temperature") or 0.7,
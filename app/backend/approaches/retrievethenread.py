@@ -1,20 +1,31 @@
 import os
-from typing import Any, AsyncGenerator, Optional, Union
+from array import array
+from typing import Any, Coroutine, Optional, Union
 
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.models import VectorQuery
-from openai import AsyncOpenAI
-
-from approaches.approach import Approach, ThoughtStep
+from openai import AsyncOpenAI, AsyncStream
+from openai.types.chat import (
+    ChatCompletion,
+    ChatCompletionChunk,
+)
+
+from approaches.approach import Document, ThoughtStep
+from approaches.askapproach import AskApproach
 from core.authentication import AuthenticationHelper
+from core.cache import LRUCache
 from core.messagebuilder import MessageBuilder
+from core.metrics import request_timings_ms
+from core.modelhelper import prime_token_counts
+from core.openaischeduler import PRIORITY_ANSWER, OpenAIScheduler
+from core.resilience import ResiliencePolicy
 
 # Replace these with your own values, either in environment variables or directly here
 AZURE_STORAGE_ACCOUNT = os.getenv("AZURE_STORAGE_ACCOUNT")
 AZURE_STORAGE_CONTAINER = os.getenv("AZURE_STORAGE_CONTAINER")
 
 
-class RetrieveThenReadApproach(Approach):
+class RetrieveThenReadApproach(AskApproach):
     """
     Simple retrieve-then-read implementation, using the AI Search and OpenAI APIs directly. It first retrieves
     top documents from search, then constructs a prompt with them, and then uses OpenAI to generate an completion
@@ -56,6 +67,11 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
         content_field: str,
         query_language: str,
         query_speller: str,
+        embedding_cache: Optional[LRUCache[array]] = None,
+        search_cache: Optional[LRUCache[list[Document]]] = None,
+        openai_scheduler: Optional[OpenAIScheduler] = None,
+        search_policy: Optional[ResiliencePolicy] = None,
+        embedding_policy: Optional[ResiliencePolicy] = None,
     ):
         self.search_client = search_client
         self.chatgpt_deployment = chatgpt_deployment
@@ -69,27 +85,32 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
         self.content_field = content_field
         self.query_language = query_language
         self.query_speller = query_speller
-
-    async def run(
+        self.embedding_cache = embedding_cache
+        self.search_cache = search_cache
+        self.openai_scheduler = openai_scheduler
+        self.search_policy = search_policy
+        self.embedding_policy = embedding_policy
+        # The instructions and the example Q&A are part of every prompt
+        prime_token_counts([self.system_chat_template, self.question, self.answer], chatgpt_model)
+
+    async def run_until_final_call(
         self,
         messages: list[dict],
-        stream: bool = False,  # Stream is not used in this approach
-        session_state: Any = None,
-        context: dict[str, Any] = {},
-    ) -> Union[dict[str, Any], AsyncGenerator[dict[str, Any], None]]:
+        overrides: dict[str, Any],
+        auth_claims: dict[str, Any],
+        should_stream: bool = False,
+    ) -> tuple[dict[str, Any], Coroutine[Any, Any, Union[ChatCompletion, AsyncStream[ChatCompletionChunk]]]]:
         q = messages[-1]["content"]
-        overrides = context.get("overrides", {})
-        auth_claims = context.get("auth_claims", {})
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
         has_vector = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
-        use_semantic_ranker = overrides.get("semantic_ranker") and has_text
+        use_semantic_ranker = True if overrides.get("semantic_ranker") and has_text else False
 
         use_semantic_captions = True if overrides.get("semantic_captions") and has_text else False
         top = overrides.get("top", 3)
         filter = self.build_filter(overrides, auth_claims)
         # If retrieval mode includes vectors, compute an embedding for the query
         vectors: list[VectorQuery] = []
-        if has_vector:
+        if has_vector and self.can_compute_text_embedding(has_text):
             vectors.append(await self.compute_text_embedding(q))
 
         # Only keep the text query if the retrieval mode uses text, otherwise drop it
@@ -113,17 +134,6 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
         message_builder.insert_message("assistant", self.answer)
         message_builder.insert_message("user", self.question)
 
-        chat_completion = (
-            await self.openai_client.chat.completions.create(
-                # Azure Open AI takes the deployment name as the model name
-                model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
-                messages=message_builder.messages,
-                temperature=overrides.get("temperature") or 0.3,
-                max_tokens=1024,
-                n=1,
-            )
-        ).model_dump()
-
         data_points = {"text": sources_content}
         extra_info = {
             "data_points": data_points,
@@ -133,6 +143,7 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
                     query_text,
                     {
                         "use_semantic_captions": use_semantic_captions,
+                        **request_timings_ms("embedding", "search"),
                     },
                 ),
                 ThoughtStep("Results", [result.serialize_for_results() for result in results]),
@@ -140,6 +151,14 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
             ],
         }
 
-        chat_completion["choices"][0]["context"] = extra_info
-        chat_completion["choices"][0]["session_state"] = session_state
-        return chat_completion
+        chat_coroutine = self.create_chat_completion(
+            PRIORITY_ANSWER,
+            # Azure Open AI takes the deployment name as the model name
+            model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
+            messages=message_builder.messages,
+            temperature=overrides.get("temperature") or 0.3,
+            max_tokens=1024,
+            n=1,
+            stream=should_stream,
+        )
+        return (extra_info, chat_coroutine)
@@ -1,25 +1,36 @@
 import os
-from typing import Any, AsyncGenerator, Optional, Union
+from array import array
+from typing import Any, Coroutine, Optional, Union
 
+import aiohttp
 from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorQuery
 from azure.storage.blob.aio import ContainerClient
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, AsyncStream
 from openai.types.chat import (
+    ChatCompletion,
+    ChatCompletionChunk,
     ChatCompletionContentPartImageParam,
     ChatCompletionContentPartParam,
 )
 
-from approaches.approach import Approach, ThoughtStep
+from approaches.approach import Document, ThoughtStep
+from approaches.askapproach import AskApproach
 from core.authentication import AuthenticationHelper
-from core.imageshelper import fetch_image
+from core.cache import LRUCache
+from core.imageshelper import ImageCache, fetch_images
 from core.messagebuilder import MessageBuilder
+from core.metrics import measure_stage, request_timings_ms
+from core.modelhelper import prime_token_counts
+from core.openaischeduler import PRIORITY_ANSWER, OpenAIScheduler
+from core.resilience import ResiliencePolicy
 
 # Replace these with your own values, either in environment variables or directly here
 AZURE_STORAGE_ACCOUNT = os.getenv("AZURE_STORAGE_ACCOUNT")
 AZURE_STORAGE_CONTAINER = os.getenv("AZURE_STORAGE_CONTAINER")
 
 
-class RetrieveThenReadVisionApproach(Approach):
+class RetrieveThenReadVisionApproach(AskApproach):
     """
     Simple retrieve-then-read implementation, using the AI Search and OpenAI APIs directly. It first retrieves
     top documents including images from search, then constructs a prompt with them, and then uses OpenAI to generate an completion
@@ -54,6 +65,15 @@ class RetrieveThenReadVisionApproach(Approach):
         query_speller: str,
         vision_endpoint: str,
         vision_key: str,
+        embedding_cache: Optional[LRUCache[array]] = None,
+        search_cache: Optional[LRUCache[list[Document]]] = None,
+        http_session: Optional[aiohttp.ClientSession] = None,
+        openai_scheduler: Optional[OpenAIScheduler] = None,
+        search_policy: Optional[ResiliencePolicy] = None,
+        embedding_policy: Optional[ResiliencePolicy] = None,
+        embedding_timeout: float = 10,
+        image_fetch_concurrency: int = 4,
+        image_cache: Optional[ImageCache] = None,
     ):
         self.search_client = search_client
         self.blob_container_client = blob_container_client
@@ -69,17 +89,25 @@ class RetrieveThenReadVisionApproach(Approach):
         self.query_speller = query_speller
         self.vision_endpoint = vision_endpoint
         self.vision_key = vision_key
-
-    async def run(
+        self.embedding_cache = embedding_cache
+        self.search_cache = search_cache
+        self.http_session = http_session
+        self.openai_scheduler = openai_scheduler
+        self.search_policy = search_policy
+        self.embedding_policy = embedding_policy
+        self.embedding_timeout = embedding_timeout
+        self.image_fetch_concurrency = image_fetch_concurrency
+        self.image_cache = image_cache
+        prime_token_counts([self.system_chat_template_gpt4v], gpt4v_model)
+
+    async def run_until_final_call(
         self,
         messages: list[dict],
-        stream: bool = False,  # Stream is not used in this approach
-        session_state: Any = None,
-        context: dict[str, Any] = {},
-    ) -> Union[dict[str, Any], AsyncGenerator[dict[str, Any], None]]:
+        overrides: dict[str, Any],
+        auth_claims: dict[str, Any],
+        should_stream: bool = False,
+    ) -> tuple[dict[str, Any], Coroutine[Any, Any, Union[ChatCompletion, AsyncStream[ChatCompletionChunk]]]]:
         q = messages[-1]["content"]
-        overrides = context.get("overrides", {})
-        auth_claims = context.get("auth_claims", {})
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
         has_vector = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         vector_fields = overrides.get("vector_fields", ["embedding"])
@@ -90,19 +118,17 @@ class RetrieveThenReadVisionApproach(Approach):
         use_semantic_captions = True if overrides.get("semantic_captions") and has_text else False
         top = overrides.get("top", 3)
         filter = self.build_filter(overrides, auth_claims)
-        use_semantic_ranker = overrides.get("semantic_ranker") and has_text
+        use_semantic_ranker = True if overrides.get("semantic_ranker") and has_text else False
 
         # If retrieval mode includes vectors, compute an embedding for the query
 
-        vectors = []
+        vectors: list[VectorQuery] = []
         if has_vector:
-            for field in vector_fields:
-                vector = (
-                    await self.compute_text_embedding(q)
-                    if field == "embedding"
-                    else await self.compute_image_embedding(q, self.vision_endpoint, self.vision_key)
-                )
-                vectors.append(vector)
+            # The text embedding is left out while the embeddings model is unavailable, see can_compute_text_embedding
+            available_vector_fields = [
+                field for field in vector_fields if field != "embedding" or self.can_compute_text_embedding(has_text)
+            ]
+            vectors = await self.compute_vectors(q, available_vector_fields, self.vision_endpoint, self.vision_key)
 
         # Only keep the text query if the retrieval mode uses text, otherwise drop it
         query_text = q if has_text else None
@@ -124,8 +150,11 @@ class RetrieveThenReadVisionApproach(Approach):
             content = "\n".join(sources_content)
             user_content.append({"text": content, "type": "text"})
         if include_gtpV_images:
-            for result in results:
-                url = await fetch_image(self.blob_container_client, result)
+            with measure_stage(type(self).__name__, "image_fetch"):
+                image_urls = await fetch_images(
+                    self.blob_container_client, results, self.image_fetch_concurrency, self.image_cache
+                )
+            for url in image_urls:
                 if url:
                     image_list.append({"image_url": url, "type": "image_url"})
             user_content.extend(image_list)
@@ -133,16 +162,6 @@ class RetrieveThenReadVisionApproach(Approach):
         # Append user message
         message_builder.insert_message("user", user_content)
 
-        chat_completion = (
-            await self.openai_client.chat.completions.create(
-                model=self.gpt4v_deployment if self.gpt4v_deployment else self.gpt4v_model,
-                messages=message_builder.messages,
-                temperature=overrides.get("temperature") or 0.3,
-                max_tokens=1024,
-                n=1,
-            )
-        ).model_dump()
-
         data_points = {
             "text": sources_content,
             "images": [d["image_url"] for d in image_list],
@@ -154,12 +173,23 @@ class RetrieveThenReadVisionApproach(Approach):
                 ThoughtStep(
                     "Search Query",
                     query_text,
-                    {"use_semantic_captions": use_semantic_captions, "vector_fields": vector_fields},
+                    {
+                        "use_semantic_captions": use_semantic_captions,
+                        "vector_fields": vector_fields,
+                        **request_timings_ms("embedding", "image_embedding", "search", "image_fetch"),
+                    },
                 ),
                 ThoughtStep("Results", [result.serialize_for_results() for result in results]),
                 ThoughtStep("Prompt", [str(message) for message in message_builder.messages]),
             ],
         }
-        chat_completion["choices"][0]["context"] = extra_info
-        chat_completion["choices"][0]["session_state"] = session_state
-        return chat_completion
+        chat_coroutine = self.create_chat_completion(
+            PRIORITY_ANSWER,
+            model=self.gpt4v_deployment if self.gpt4v_deployment else self.gpt4v_model,
+            messages=message_builder.messages,
+            temperature=overrides.get("temperature") or 0.3,
+            max_tokens=1024,
+            n=1,
+            stream=should_stream,
+        )
+        return (extra_info, chat_coroutine)
@@ -0,0 +1,134 @@
+import asyncio
+import math
+import time
+from collections.abc import AsyncGenerator
+from typing import Any
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't be admitted, either because the wait queue is full or it waited too long."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Request rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the number of approach runs in flight in a worker, with a bounded queue of requests waiting for a slot.
+    Requests that find the queue full, or that wait longer than queue_timeout, are rejected right away so that
+    clients can retry later, instead of every request in the worker slowing down together.
+    Attributes:
+        max_concurrency (int): The maximum number of approach runs in flight.
+        max_queue (int): The maximum number of requests waiting for a slot.
+        queue_timeout (float): How many seconds a request waits for a slot before being rejected.
+        admitted, rejected (int): Counters of the requests that ran and that were turned away.
+        queue_wait_seconds (float): Total time spent by admitted requests waiting for a slot.
+    """
+
+    # Weight of the latest run in the moving average used to estimate Retry-After
+    RUN_SECONDS_SMOOTHING = 0.2
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.queue_wait_seconds = 0.0
+        self.average_run_seconds = 1.0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def retry_after(self) -> int:
+        # Roughly the time needed to work through the requests already waiting
+        return max(1, math.ceil(self.average_run_seconds * (self.queued + 1) / self.max_concurrency))
+
+    async def acquire(self) -> float:
+        """Waits for a slot and returns the time at which it was acquired, or raises AdmissionRejected."""
+        started = time.monotonic()
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected("queue full", self.retry_after())
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise AdmissionRejected("queue timeout", self.retry_after())
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        admitted_at = time.monotonic()
+        self.queue_wait_seconds += admitted_at - started
+        self.admitted += 1
+        self.in_flight += 1
+        return admitted_at
+
+    def release(self, admitted_at: float):
+        self.in_flight -= 1
+        self._semaphore.release()
+        run_seconds = time.monotonic() - admitted_at
+        self.average_run_seconds += self.RUN_SECONDS_SMOOTHING * (run_seconds - self.average_run_seconds)
+
+    def release_after_stream(self, result: AsyncGenerator[dict, None], admitted_at: float) -> "AdmittedStream":
+        """Holds the slot until a streamed response has been sent, or the client went away."""
+        return AdmittedStream(self, result, admitted_at)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "queue_wait_seconds": self.queue_wait_seconds,
+            "average_run_seconds": self.average_run_seconds,
+        }
+
+
+class AdmittedStream(AsyncGenerator[dict, None]):
+    """
+    A streamed response that holds an admission slot, released once when the stream ends, fails or is closed.
+    The slot is also released when the stream is dropped without ever being iterated, which an async generator
+    can't do: its finally block never runs if the client went away before the response started.
+    """
+
+    def __init__(self, controller: AdmissionController, result: AsyncGenerator[dict, None], admitted_at: float):
+        self.controller = controller
+        self.result = result
+        self.admitted_at = admitted_at
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self.admitted_at)
+
+    async def asend(self, value: None) -> dict:
+        try:
+            return await self.result.asend(value)
+        except BaseException:
+            self.release()
+            raise
+
+    async def athrow(self, *args: Any) -> dict:
+        try:
+            return await self.result.athrow(*args)
+        except BaseException:
+            self.release()
+            raise
+
+    async def aclose(self):
+        try:
+            await self.result.aclose()
+        finally:
+            self.release()
+
+    def __del__(self):
+        self.release()
@@ -0,0 +1,134 @@
+import dataclasses
+import hashlib
+import json
+from typing import Any, AsyncGenerator, Optional
+
+from core.cache import LRUCache
+from core.metrics import without_timings
+
+
+class AnswerCache:
+    """
+    Exact-match cache of approach responses, keyed by the normalized conversation, the overrides,
+    the models and deployments in use, and the security filter of the user, so that answers built from
+    access-controlled documents are only ever returned to users with the same access.
+    Answers are stored serialized, without the session state and the stage timings of the request that
+    produced them, since a cache hit doesn't run those stages. The cache is cleared by IndexVersionMonitor
+    whenever prepdocs re-ingests the index.
+    Attributes:
+        cache (LRUCache[str]): The serialized responses, bounded by their size in characters.
+        namespace (str): Identifies the models and deployments that produced the answers.
+    """
+
+    def __init__(self, max_size: int, ttl: float, namespace: str):
+        self.cache = LRUCache[str](max_size=max_size, ttl=ttl, sizeof=len)
+        self.namespace = namespace
+
+    def build_key(
+        self, scope: str, messages: list[dict], overrides: dict[str, Any], security_filter: Optional[str]
+    ) -> str:
+        # Whitespace differences don't change the question, so they shouldn't cause a miss
+        normalized_messages = [
+            {
+                "role": message.get("role"),
+                "content": " ".join(message["content"].split())
+                if isinstance(message.get("content"), str)
+                else message.get("content"),
+            }
+            for message in messages
+        ]
+        key = json.dumps(
+            [self.namespace, scope, normalized_messages, overrides, security_filter],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key: str, session_state: Any = None) -> Optional[dict[str, Any]]:
+        serialized = self.cache.get(key)
+        if serialized is None:
+            return None
+        response = json.loads(serialized)
+        response["choices"][0]["session_state"] = session_state
+        return response
+
+    def set(self, key: str, response: dict[str, Any]):
+        choice = {k: v for k, v in response["choices"][0].items() if k != "session_state"}
+        if context := choice.get("context"):
+            choice["context"] = self.without_timings(context)
+        serialized = json.dumps({**response, "choices": [choice]}, ensure_ascii=False, default=dataclasses.asdict)
+        self.cache.set(key, serialized)
+
+    def without_timings(self, context: dict[str, Any]) -> dict[str, Any]:
+        context = {key: value for key, value in context.items() if key != "timings"}
+        if thoughts := context.get("thoughts"):
+            context["thoughts"] = [
+                dataclasses.replace(thought, props=without_timings(thought.props)) if thought.props else thought
+                for thought in thoughts
+            ]
+        return context
+
+    async def replay_stream(self, response: dict[str, Any]) -> AsyncGenerator[dict, None]:
+        """Replays a cached response as the same chunks that ChatApproach.run_with_streaming produces."""
+        choice = response["choices"][0]
+        context = dict(choice["context"])
+        followup_questions = context.pop("followup_questions", None)
+        yield {
+            "choices": [
+                {
+                    "delta": {"role": "assistant"},
+                    "context": context,
+                    "session_state": choice.get("session_state"),
+                    "finish_reason": None,
+                    "index": 0,
+                }
+            ],
+            "object": "chat.completion.chunk",
+        }
+        yield {
+            "choices": [
+                {
+                    "delta": {"role": "assistant", "content": choice["message"]["content"]},
+                    "finish_reason": "stop",
+                    "index": 0,
+                }
+            ],
+            "object": "chat.completion.chunk",
+        }
+        if followup_questions is not None:
+            yield {
+                "choices": [
+                    {
+                        "delta": {"role": "assistant"},
+                        "context": {"followup_questions": followup_questions},
+                        "finish_reason": None,
+                        "index": 0,
+                    }
+                ],
+                "object": "chat.completion.chunk",
+            }
+
+    async def cache_stream(self, key: str, result: AsyncGenerator[dict, None]) -> AsyncGenerator[dict, None]:
+        """Passes a streamed response through and caches it once the stream has completed."""
+        context: dict[str, Any] = {}
+        content = ""
+        async for event in result:
+            choice = event["choices"][0]
+            context.update(choice.get("context") or {})
+            content += choice["delta"].get("content") or ""
+            yield event
+        self.set(
+            key,
+            {
+                "choices": [
+                    {
+                        "finish_reason": "stop",
+                        "index": 0,
+                        "message": {"content": content, "role": "assistant"},
+                        "context": context,
+                    }
+                ],
+                "object": "chat.completion",
+            },
+        )
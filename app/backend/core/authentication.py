@@ -1,7 +1,14 @@
 # Refactored from https://github.com/Azure-Samples/ms-identity-python-on-behalf-of
 
+import asyncio
+import base64
+import functools
+import hashlib
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
 from typing import Any, Optional
 
 import aiohttp
@@ -9,6 +16,8 @@ from azure.search.documents.indexes.models import SearchIndex
 from msal import ConfidentialClientApplication
 from msal.token_cache import TokenCache
 
+from core.cache import LRUCache
+
 
 # AuthError is raised when the authentication token sent by the client UI cannot be parsed or there is an authentication error accessing the graph API
 class AuthError(Exception):
@@ -32,6 +41,11 @@ class AuthenticationHelper:
         client_app_id: Optional[str],
         tenant_id: Optional[str],
         require_access_control: bool = False,
+        obo_max_workers: int = 4,
+        obo_timeout: float = 10,
+        claims_cache_size: int = 1024,
+        groups_cache_ttl: float = 300,
+        http_session: Optional[aiohttp.ClientSession] = None,
     ):
         self.use_authentication = use_authentication
         self.server_app_id = server_app_id
@@ -39,6 +53,7 @@ class AuthenticationHelper:
         self.client_app_id = client_app_id
         self.tenant_id = tenant_id
         self.authority = f"https://login.microsoftonline.com/{tenant_id}"
+        self.http_session = http_session
 
         if self.use_authentication:
             field_names = [field.name for field in search_index.fields] if search_index else []
@@ -47,6 +62,14 @@ class AuthenticationHelper:
             self.confidential_client = ConfidentialClientApplication(
                 server_app_id, authority=self.authority, client_credential=server_app_secret, token_cache=TokenCache()
             )
+            # MSAL only has a blocking API, so the On Behalf Of exchange runs on a small dedicated pool
+            # instead of stalling every other request and stream on the event loop
+            self.obo_executor = ThreadPoolExecutor(max_workers=obo_max_workers, thread_name_prefix="msal-obo")
+            self.obo_timeout = obo_timeout
+            # Resolved claims keyed by a hash of the user's token, kept until that token expires
+            self.claims_cache = LRUCache[dict[str, Any]](max_size=claims_cache_size)
+            # Group memberships read from Microsoft Graph for users with a groups overage claim, keyed by oid
+            self.groups_cache = LRUCache[list[str]](max_size=claims_cache_size, ttl=groups_cache_ttl)
         else:
             self.has_auth_fields = False
             self.require_access_control = False
@@ -145,13 +168,20 @@ class AuthenticationHelper:
             return None
 
     @staticmethod
-    async def list_groups(graph_resource_access_token: dict) -> list[str]:
+    async def list_groups(
+        graph_resource_access_token: dict, http_session: Optional[aiohttp.ClientSession] = None
+    ) -> list[str]:
         headers = {"Authorization": "Bearer " + graph_resource_access_token["access_token"]}
         groups = []
-        async with aiohttp.ClientSession(headers=headers) as session:
+        async with AsyncExitStack() as stack:
+            session = http_session
+            if session is None:
+                session = await stack.enter_async_context(aiohttp.ClientSession())
             resp_json = None
             resp_status = None
-            async with session.get(url="https://graph.microsoft.com/v1.0/me/transitiveMemberOf?$select=id") as resp:
+            async with session.get(
+                url="https://graph.microsoft.com/v1.0/me/transitiveMemberOf?$select=id", headers=headers
+            ) as resp:
                 resp_json = await resp.json()
                 resp_status = resp.status
                 if resp_status != 200:
@@ -163,7 +193,7 @@ class AuthenticationHelper:
                     groups.append(group["id"])
                 next_link = resp_json.get("@odata.nextLink")
                 if next_link:
-                    async with session.get(url=next_link) as resp:
+                    async with session.get(url=next_link, headers=headers) as resp:
                         resp_json = await resp.json()
                         resp_status = resp.status
                 else:
@@ -173,6 +203,33 @@ class AuthenticationHelper:
 
         return groups
 
+    async def acquire_token_on_behalf_of(self, auth_token: str) -> dict[str, Any]:
+        acquire_token = functools.partial(
+            self.confidential_client.acquire_token_on_behalf_of,
+            user_assertion=auth_token,
+            scopes=["https://graph.microsoft.com/.default"],
+        )
+        try:
+            return await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(self.obo_executor, acquire_token), timeout=self.obo_timeout
+            )
+        except asyncio.TimeoutError:
+            raise AuthError(error="Timed out exchanging the token with the On Behalf Of flow", status_code=504)
+
+    @staticmethod
+    def get_token_expiration(auth_token: str) -> Optional[float]:
+        # Only used to bound how long claims are cached, the token itself has already been validated by the OBO exchange
+        try:
+            payload = auth_token.split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return float(claims["exp"])
+        except Exception:
+            return None
+
+    def close(self):
+        if self.use_authentication:
+            self.obo_executor.shutdown(wait=False)
+
     async def get_auth_claims_if_enabled(self, headers: dict) -> dict[str, Any]:
         if not self.use_authentication:
             return {}
@@ -181,9 +238,11 @@ class AuthenticationHelper:
             # The scope is set to the Microsoft Graph API, which may need to be called for more authorization information
             # https://learn.microsoft.com/en-us/azure/active-directory/develop/v2-oauth2-on-behalf-of-flow
             auth_token = AuthenticationHelper.get_token_auth_header(headers)
-            graph_resource_access_token = self.confidential_client.acquire_token_on_behalf_of(
-                user_assertion=auth_token, scopes=["https://graph.microsoft.com/.default"]
-            )
+            token_hash = hashlib.sha256(auth_token.encode()).hexdigest()
+            cached_claims = self.claims_cache.get(token_hash)
+            if cached_claims is not None:
+                return {"oid": cached_claims["oid"], "groups": list(cached_claims["groups"])}
+            graph_resource_access_token = await self.acquire_token_on_behalf_of(auth_token)
             if "error" in graph_resource_access_token:
                 raise AuthError(error=str(graph_resource_access_token), status_code=401)
 
@@ -202,8 +261,22 @@ class AuthenticationHelper:
                 and "groups" in id_token_claims["_claim_names"]
             )
             if missing_groups_claim or has_group_overage_claim:
-                # Read the user's groups from Microsoft Graph
-                auth_claims["groups"] = await AuthenticationHelper.list_groups(graph_resource_access_token)
+                # Read the user's groups from Microsoft Graph, paging through them is slow for users in many groups
+                groups = self.groups_cache.get(auth_claims["oid"])
+                if groups is None:
+                    groups = await AuthenticationHelper.list_groups(graph_resource_access_token, self.http_session)
+                    self.groups_cache.set(auth_claims["oid"], groups)
+                auth_claims["groups"] = list(groups)
+
+            expiration = AuthenticationHelper.get_token_expiration(auth_token)
+            if expiration is not None and expiration > time.time():
+                ttl = expiration - time.time()
+                if missing_groups_claim or has_group_overage_claim:
+                    # Groups read from Graph may change before the token expires
+                    ttl = min(ttl, self.groups_cache.ttl or ttl)
+                self.claims_cache.set(
+                    token_hash, {"oid": auth_claims["oid"], "groups": list(auth_claims["groups"])}, ttl=ttl
+                )
             return auth_claims
         except AuthError as e:
             print(e.error)
@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    A bounded in-process cache with least-recently-used eviction and an optional time-to-live.
+    The bound is expressed in the units returned by sizeof: by default every entry counts as 1,
+    so max_size is a number of entries, but sizeof can also return a byte count to get a byte budget.
+    Attributes:
+        max_size (int): The maximum total size of the cached values.
+        ttl (float | None): The default number of seconds an entry stays valid, or None to never expire.
+        size (int): The current total size of the cached values.
+        hits, misses, evictions (int): Counters describing the effectiveness of the cache.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None, sizeof: Callable[[V], int] = lambda value: 1):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Maps each key to its value, its size and the monotonic time at which it expires
+        self._entries: OrderedDict[Hashable, tuple[V, int, Optional[float]]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, _, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.pop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None):
+        """
+        Stores a value, evicting the least recently used entries until it fits.
+        Values that are larger than the whole cache are not stored.
+        Args:
+            key (Hashable): The key of the entry.
+            value (V): The value to store.
+            ttl (float | None): Overrides the default time-to-live of the cache for this entry.
+        """
+        self.pop(key)
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        while self._entries and self.size + size > self.max_size:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+        self._entries[key] = (value, size, expires_at)
+        self.size += size
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.size -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and (entry[2] is None or entry[2] > time.monotonic())
@@ -0,0 +1,106 @@
+import time
+from types import SimpleNamespace
+from typing import Any
+
+import aiohttp
+import httpx
+from azure.core.pipeline.transport import AioHttpTransport
+
+
+class SharedHttpSessions:
+    """
+    App-lifetime outbound HTTP layer, so that calls to Microsoft Graph, AI Vision, AI Search, Blob Storage
+    and Key Vault reuse kept-alive connections instead of paying a TCP and TLS handshake on every request.
+    All aiohttp traffic goes through a single bounded TCPConnector. The Azure SDK clients get their own session
+    on that connector because they handle content decoding themselves. The OpenAI SDK only supports httpx,
+    so it gets an httpx client with the same limits.
+    Attributes:
+        connector (aiohttp.TCPConnector): The connection pool shared by all aiohttp sessions.
+        session (aiohttp.ClientSession): Session for direct REST calls (Graph, AI Vision).
+        azure_session (aiohttp.ClientSession): Session used by the transports of the Azure SDK clients.
+        openai_transport (httpx.AsyncHTTPTransport): Connection pool of the OpenAI SDK.
+        openai_http_client (httpx.AsyncClient): Pooled client for the OpenAI SDK.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 0, keepalive_timeout: float = 30):
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.requests_queued = 0
+        self.queue_wait_seconds = 0.0
+        self.requests_in_flight = 0
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_connection_queued_start.append(self._on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_connection_queued_end)
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_request_exception.append(self._on_request_end)
+
+        self.connector = aiohttp.TCPConnector(
+            limit=limit, limit_per_host=limit_per_host, keepalive_timeout=keepalive_timeout
+        )
+        self.session = aiohttp.ClientSession(
+            connector=self.connector, connector_owner=False, trace_configs=[trace_config]
+        )
+        # Same settings as the sessions that AioHttpTransport creates for itself
+        self.azure_session = aiohttp.ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            auto_decompress=False,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            trust_env=True,
+            trace_configs=[trace_config],
+        )
+        self.openai_transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=limit or None,
+                max_keepalive_connections=limit or None,
+                keepalive_expiry=keepalive_timeout,
+            )
+        )
+        self.openai_http_client = httpx.AsyncClient(transport=self.openai_transport, follow_redirects=True)
+
+    def azure_transport(self) -> AioHttpTransport:
+        # Each SDK client gets its own transport, closing a client then leaves the shared session open
+        return AioHttpTransport(session=self.azure_session, session_owner=False)
+
+    async def _on_connection_create_end(self, session, context: SimpleNamespace, params: Any):
+        self.connections_created += 1
+
+    async def _on_connection_reuseconn(self, session, context: SimpleNamespace, params: Any):
+        self.connections_reused += 1
+
+    async def _on_connection_queued_start(self, session, context: SimpleNamespace, params: Any):
+        self.requests_queued += 1
+        context.queued_at = time.monotonic()
+
+    async def _on_connection_queued_end(self, session, context: SimpleNamespace, params: Any):
+        self.queue_wait_seconds += time.monotonic() - context.queued_at
+
+    async def _on_request_start(self, session, context: SimpleNamespace, params: Any):
+        self.requests_in_flight += 1
+
+    async def _on_request_end(self, session, context: SimpleNamespace, params: Any):
+        self.requests_in_flight -= 1
+
+    def stats(self) -> dict[str, Any]:
+        connections = self.connections_created + self.connections_reused
+        return {
+            "limit": self.connector.limit,
+            "limit_per_host": self.connector.limit_per_host,
+            "requests_in_flight": self.requests_in_flight,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "reuse_ratio": self.connections_reused / connections if connections else 0.0,
+            # Requests that had to wait for a free connection because the pool was saturated
+            "requests_queued": self.requests_queued,
+            "queue_wait_seconds": self.queue_wait_seconds,
+        }
+
+    async def close(self):
+        await self.session.close()
+        await self.azure_session.close()
+        await self.connector.close()
+        await self.openai_http_client.aclose()
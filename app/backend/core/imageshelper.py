@@ -1,11 +1,17 @@
+import asyncio
 import base64
 import os
+import time
+from dataclasses import dataclass
 from typing import Optional
 
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError
 from azure.storage.blob.aio import ContainerClient
 from typing_extensions import Literal, Required, TypedDict
 
 from approaches.approach import Document
+from core.cache import LRUCache
 
 
 class ImageURL(TypedDict, total=False):
@@ -16,21 +22,94 @@ class ImageURL(TypedDict, total=False):
     """Specifies the detail level of the image."""
 
 
-async def download_blob_as_base64(blob_container_client: ContainerClient, file_path: str) -> Optional[str]:
+def encode_base64(data: bytes) -> str:
+    return base64.b64encode(data).decode("utf-8")
+
+
+@dataclass
+class CachedImage:
+    etag: str
+    url: str
+    validated_at: float
+
+
+class ImageCache:
+    """
+    Byte-budgeted LRU cache of the data URLs of page images, so that pages that keep showing up in results
+    are not downloaded and base64 encoded again for every prompt.
+    Entries are stored per blob along with the ETag they were downloaded with. Once an entry is older than
+    revalidate_interval, the blob is downloaded again only if its ETag changed, i.e. the page was re-ingested.
+    Attributes:
+        cache (LRUCache[CachedImage]): The cached images, bounded by the size of their data URLs.
+        revalidate_interval (float): How many seconds an entry is trusted before its ETag is checked again.
+    """
+
+    def __init__(self, max_size: int, revalidate_interval: float = 60):
+        self.cache = LRUCache[CachedImage](max_size=max_size, sizeof=lambda image: len(image.url))
+        self.revalidate_interval = revalidate_interval
+
+
+async def download_blob_as_base64(
+    blob_container_client: ContainerClient, file_path: str, image_cache: Optional[ImageCache] = None
+) -> Optional[str]:
     base_name, _ = os.path.splitext(file_path)
-    blob = await blob_container_client.get_blob_client(base_name + ".png").download_blob()
+    blob_name = base_name + ".png"
+    blob_client = blob_container_client.get_blob_client(blob_name)
+
+    cached_image = None
+    if image_cache:
+        cached_image = image_cache.cache.get(blob_name)
+        if cached_image and time.monotonic() - cached_image.validated_at <= image_cache.revalidate_interval:
+            return cached_image.url
+    try:
+        if cached_image:
+            blob = await blob_client.download_blob(etag=cached_image.etag, match_condition=MatchConditions.IfModified)
+        else:
+            blob = await blob_client.download_blob()
+    except HttpResponseError as error:
+        # Storage reports an unchanged blob as an error rather than an empty 304 response
+        if cached_image and error.status_code == 304:
+            cached_image.validated_at = time.monotonic()
+            return cached_image.url
+        raise
 
     if not blob.properties:
         return None
-    img = base64.b64encode(await blob.readall()).decode("utf-8")
-    return f"data:image/png;base64,{img}"
+    # Encoding a full page image takes long enough to stall other requests, so it runs on a worker thread
+    img = await asyncio.to_thread(encode_base64, await blob.readall())
+    url = f"data:image/png;base64,{img}"
+    etag = blob.properties.get("etag")
+    if image_cache and etag:
+        image_cache.cache.set(blob_name, CachedImage(etag=etag, url=url, validated_at=time.monotonic()))
+    return url
 
 
-async def fetch_image(blob_container_client: ContainerClient, result: Document) -> Optional[ImageURL]:
+async def fetch_image(
+    blob_container_client: ContainerClient, result: Document, image_cache: Optional[ImageCache] = None
+) -> Optional[ImageURL]:
     if result.sourcepage:
-        img = await download_blob_as_base64(blob_container_client, result.sourcepage)
+        img = await download_blob_as_base64(blob_container_client, result.sourcepage, image_cache)
         if img:
             return {"url": img, "detail": "auto"}
         else:
             return None
     return None
+
+
+async def fetch_images(
+    blob_container_client: ContainerClient,
+    results: list[Document],
+    max_concurrency: int = 4,
+    image_cache: Optional[ImageCache] = None,
+) -> list[Optional[ImageURL]]:
+    """
+    Fetches the page images of the results concurrently, with at most max_concurrency downloads in flight.
+    The images are returned in the same order as the results, with None for results that have no image.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_with_limit(result: Document) -> Optional[ImageURL]:
+        async with semaphore:
+            return await fetch_image(blob_container_client, result, image_cache)
+
+    return list(await asyncio.gather(*(fetch_with_limit(result) for result in results)))
@@ -0,0 +1,48 @@
+import logging
+import time
+from typing import Any, Optional
+
+from azure.storage.blob.aio import ContainerClient
+
+from core.cache import LRUCache
+
+# Container metadata key that prepdocs updates after every ingestion run
+INDEX_VERSION_METADATA = "index_version"
+
+
+class IndexVersionMonitor:
+    """
+    Watches the index version that prepdocs stamps on the content container, and clears the caches
+    holding data derived from the index (answers, search results) as soon as it changes.
+    Attributes:
+        caches (list[LRUCache]): The caches to clear when the index is re-ingested.
+        index_version (str | None): The last index version read from the blob container.
+        refresh_interval (float): How many seconds the index version is trusted before being read again.
+    """
+
+    def __init__(
+        self, blob_container_client: ContainerClient, caches: list[LRUCache[Any]], refresh_interval: float = 60
+    ):
+        self.blob_container_client = blob_container_client
+        self.caches = caches
+        self.index_version: Optional[str] = None
+        self.refresh_interval = refresh_interval
+        self.checked_at = float("-inf")
+
+    async def refresh(self):
+        if not self.caches or time.monotonic() - self.checked_at < self.refresh_interval:
+            return
+        # Mark the check first so concurrent requests don't all go to storage
+        self.checked_at = time.monotonic()
+        try:
+            container_properties = await self.blob_container_client.get_container_properties()
+        except Exception as error:
+            logging.warning("Unable to read the index version, keeping cached data: %s", error)
+            return
+        index_version = (container_properties.metadata or {}).get(INDEX_VERSION_METADATA)
+        if index_version != self.index_version:
+            if self.index_version is not None:
+                logging.info("Index version changed to %s, clearing cached answers and search results", index_version)
+            for cache in self.caches:
+                cache.clear()
+            self.index_version = index_version
@@ -22,6 +22,7 @@ class MessageBuilder:
     Methods:
         __init__(self, system_content: str, chatgpt_model: str): Initializes the MessageBuilder instance.
         insert_message(self, role: str, content: str, index: int = 1): Inserts a new message to the conversation.
+        insert_messages(self, messages: list, index: int = 1): Inserts several messages to the conversation at once.
     """
 
     def __init__(self, system_content: str, chatgpt_model: str):
@@ -39,6 +40,20 @@ class MessageBuilder:
             content (str | List[ChatCompletionContentPartParam]): The content of the message.
             index (int): The index at which to insert the message.
         """
+        self.messages.insert(index, self.create_message(role, content))
+
+    def insert_messages(self, messages: List[dict[str, str]], index: int = 1):
+        """
+        Inserts several messages at once, in the given order, at the specified index.
+        Args:
+            messages (list): The messages to insert, as dictionaries with "role" and "content" keys.
+            index (int): The index at which to insert the first message.
+        """
+        self.messages[index:index] = [self.create_message(message["role"], message["content"]) for message in messages]
+
+    def create_message(
+        self, role: str, content: Union[str, List[ChatCompletionContentPartParam]]
+    ) -> ChatCompletionMessageParam:
         message: ChatCompletionMessageParam
         if role == "user":
             message = ChatCompletionUserMessageParam(role="user", content=self.normalize_content(content))
@@ -50,11 +65,15 @@ class MessageBuilder:
             )
         else:
             raise ValueError(f"Invalid role: {role}")
-        self.messages.insert(index, message)
+        return message
 
     def count_tokens_for_message(self, message: dict[str, str]):
         return num_tokens_from_messages(message, self.model)
 
+    @property
+    def token_count(self) -> int:
+        return sum(self.count_tokens_for_message(dict(message)) for message in self.messages)  # type: ignore
+
     def normalize_content(self, content: Union[str, List[ChatCompletionContentPartParam]]):
         if isinstance(content, str):
             return unicodedata.normalize("NFC", content)
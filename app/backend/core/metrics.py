@@ -0,0 +1,218 @@
+import bisect
+import math
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterable, Iterator, Optional
+
+# Counters reported by the stats() of the app's components, the other values are gauges
+COUNTER_STATS = {
+    "hits",
+    "misses",
+    "evictions",
+    "admitted",
+    "rejected",
+    "requests",
+    "failures",
+    "calls",
+    "hedged",
+    "hedges_won",
+    "hedges_over_budget",
+    "timeouts",
+    "connections_created",
+    "connections_reused",
+    "requests_queued",
+    "queue_wait_seconds",
+}
+
+# Stages of the approaches, in the order they run
+STAGES = (
+    "answer_cache",
+    "rewrite",
+    "embedding",
+    "image_embedding",
+    "search",
+    "image_fetch",
+    "first_token",
+    "completion",
+)
+
+# Latencies of pipeline stages range from cache hits to long generations
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+def worker_labels() -> Labels:
+    """
+    Identifies the worker process in every sample. Each worker keeps its own metrics, and scrapes reach any of
+    them, so the series of the workers have to be told apart to be summed or to detect a restarted worker.
+    """
+    return (("pid", str(os.getpid())),)
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """
+    A Prometheus counter, rendered in the text exposition format. Metrics are kept per worker process and
+    labelled with its pid, the few metric types the app needs don't warrant a dependency on prometheus_client.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple((name, str(labels[name])) for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name}_total {self.documentation}"
+        yield f"# TYPE {self.name}_total counter"
+        worker = worker_labels()
+        for labels, value in self.values.items():
+            yield f"{self.name}_total{format_labels(worker + labels)} {format_value(value)}"
+
+
+class Histogram:
+    """A Prometheus histogram with fixed buckets, rendered in the text exposition format."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = STAGE_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label set: the count of observations in each bucket (the last one is +Inf), and their sum
+        self.values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple((name, str(labels[name])) for name in self.labelnames)
+        if key not in self.values:
+            self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = self.values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        worker = worker_labels()
+        for sample_labels, (counts, total) in self.values.items():
+            labels = worker + sample_labels
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                bucket_labels = format_labels(labels + (("le", format_value(bound)),))
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(labels)} {format_value(total[0])}"
+            yield f"{self.name}_count{format_labels(labels)} {cumulative}"
+
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds", "Duration of each stage of the approaches.", labelnames=("approach", "stage")
+)
+OPENAI_TOKENS = Counter("rag_openai_tokens", "Tokens used by OpenAI calls.", labelnames=("approach", "type"))
+REQUESTS = Counter("rag_http_requests", "HTTP requests handled, by route and status.", labelnames=("route", "status"))
+
+# Stage durations of the request being handled, reported back in its response, see start_request_timings
+REQUEST_STAGE_SECONDS: ContextVar[Optional[dict[str, float]]] = ContextVar("request_stage_seconds", default=None)
+
+
+def start_request_timings() -> dict[str, float]:
+    """
+    Starts collecting the stage durations of the current request, and returns the dict they are added to.
+    Tasks started by the request share it, unless they start their own to add later with add_request_timings.
+    Stages that run several times in a request, like the embeddings of a vision query, are summed.
+    """
+    timings: dict[str, float] = {}
+    REQUEST_STAGE_SECONDS.set(timings)
+    return timings
+
+
+def add_request_timings(timings: dict[str, float]):
+    """Adds stage durations collected apart, like those of a speculative task, to the current request."""
+    if (request_timings := REQUEST_STAGE_SECONDS.get()) is not None:
+        for stage, seconds in timings.items():
+            request_timings[stage] = request_timings.get(stage, 0) + seconds
+
+
+def request_timings_ms(*stages: str) -> dict[str, float]:
+    """The durations of the stages of the current request in milliseconds, all of them if no stage is given."""
+    timings = REQUEST_STAGE_SECONDS.get() or {}
+    return {f"{stage}_ms": round(timings[stage] * 1000, 1) for stage in stages or STAGES if stage in timings}
+
+
+def without_timings(props: dict[str, Any]) -> dict[str, Any]:
+    """Drops the stage durations added by request_timings_ms, for data that outlives the request."""
+    timing_keys = {f"{stage}_ms" for stage in STAGES}
+    return {key: value for key, value in props.items() if key not in timing_keys}
+
+
+def format_server_timing(timings: dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+def observe_stage(approach: str, stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, approach=approach, stage=stage)
+    if (timings := REQUEST_STAGE_SECONDS.get()) is not None:
+        timings[stage] = timings.get(stage, 0) + seconds
+
+
+@contextmanager
+def measure_stage(approach: str, stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(approach, stage, time.perf_counter() - started)
+
+
+def record_usage(approach: str, usage: Optional[Any], prompt_type: str = "prompt"):
+    """Counts the tokens reported in the usage of a completion or embeddings response, when there is one."""
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(usage.prompt_tokens, approach=approach, type=prompt_type)
+    if completion_tokens := getattr(usage, "completion_tokens", None):
+        OPENAI_TOKENS.inc(completion_tokens, approach=approach, type="completion")
+
+
+def render_stats(prefix: str, stats: Iterable[tuple[dict[str, str], dict[str, Any]]]) -> Iterator[str]:
+    """
+    Renders the numeric values of the stats() of components as metrics named prefix_key, one sample per
+    label set. Values listed in COUNTER_STATS are rendered as counters, the others as gauges.
+    """
+    worker = worker_labels()
+    samples: dict[str, list[tuple[Labels, float]]] = {}
+    for labels, values in stats:
+        for key, value in values.items():
+            if isinstance(value, (bool, int, float)):
+                samples.setdefault(key, []).append((worker + tuple(labels.items()), float(value)))
+    for key, key_samples in samples.items():
+        name = f"{prefix}_{key}_total" if key in COUNTER_STATS else f"{prefix}_{key}"
+        yield f"# TYPE {name} {'counter' if key in COUNTER_STATS else 'gauge'}"
+        for sample_labels, value in key_samples:
+            yield f"{name}{format_labels(sample_labels)} {format_value(value)}"
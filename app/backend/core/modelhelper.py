@@ -1,7 +1,13 @@
 from __future__ import annotations
 
+import functools
+import hashlib
+from typing import Iterable
+
 import tiktoken
 
+from core.cache import LRUCache
+
 MODELS_2_TOKEN_LIMITS = {
     "gpt-35-turbo": 4000,
     "gpt-3.5-turbo": 4000,
@@ -15,6 +21,10 @@ MODELS_2_TOKEN_LIMITS = {
 
 AOAI_2_OAI = {"gpt-35-turbo": "gpt-3.5-turbo", "gpt-35-turbo-16k": "gpt-3.5-turbo-16k", "gpt-4v": "gpt-4-turbo-vision"}
 
+# Token counts of recently seen strings, keyed by encoding and content hash, so that a conversation
+# history is not tokenized again for every prompt of every turn
+TOKEN_COUNT_CACHE = LRUCache[int](max_size=16384)
+
 
 def get_token_limit(model_id: str) -> int:
     if model_id not in MODELS_2_TOKEN_LIMITS:
@@ -37,19 +47,54 @@ def num_tokens_from_messages(message: dict[str, str], model: str) -> int:
         output: 11
     """
 
-    encoding = tiktoken.encoding_for_model(get_oai_chatmodel_tiktok(model))
     num_tokens = 2  # For "role" and "content" keys
     for key, value in message.items():
         if isinstance(value, list):
             for v in value:
                 # TODO: Update token count for images https://github.com/openai/openai-cookbook/pull/881/files
                 if isinstance(v, str):
-                    num_tokens += len(encoding.encode(v))
+                    num_tokens += num_tokens_from_string(v, model)
+                elif isinstance(v, dict) and v.get("type") == "text":
+                    num_tokens += num_tokens_from_string(v["text"], model)
         else:
-            num_tokens += len(encoding.encode(value))
+            num_tokens += num_tokens_from_string(value, model)
     return num_tokens
 
 
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Returns the tokenizer of a model. Encodings are looked up once and shared by the whole process.
+    """
+    return tiktoken.encoding_for_model(get_oai_chatmodel_tiktok(model))
+
+
+def num_tokens_from_string(text: str, model: str) -> int:
+    """
+    Calculate the number of tokens in a string, memoized by the hash of its content.
+    Args:
+        text (str): The string to encode.
+        model (str): The name of the model to use for encoding.
+    Returns:
+        int: The number of tokens in the string.
+    """
+    encoding = get_encoding(model)
+    key = (encoding.name, hashlib.blake2b(text.encode(), digest_size=16).digest())
+    num_tokens = TOKEN_COUNT_CACHE.get(key)
+    if num_tokens is None:
+        num_tokens = len(encoding.encode(text))
+        TOKEN_COUNT_CACHE.set(key, num_tokens)
+    return num_tokens
+
+
+def prime_token_counts(texts: Iterable[str], model: str):
+    """
+    Tokenizes the prompts that are sent with every request up front, so that requests only find them in the cache.
+    """
+    for text in texts:
+        num_tokens_from_string(text, model)
+
+
 def get_oai_chatmodel_tiktok(aoaimodel: str) -> str:
     message = "Expected Azure OpenAI ChatGPT model name"
     if aoaimodel == "" or aoaimodel is None:
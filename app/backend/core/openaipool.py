@@ -0,0 +1,169 @@
+import dataclasses
+import logging
+import random
+import re
+import time
+from typing import Any, Optional
+
+import httpx
+
+# Azure OpenAI quotas are per deployment, so the health of a backend is tracked for each deployment it serves
+DEPLOYMENT_PATTERN = re.compile(r"/openai/deployments/([^/]+)/")
+
+
+@dataclasses.dataclass
+class OpenAIBackend:
+    """An Azure OpenAI service that hosts the same deployment names as the others in the pool."""
+
+    endpoint: str
+    weight: float = 1
+
+
+@dataclasses.dataclass
+class BackendState:
+    requests: int = 0
+    failures: int = 0
+    ejected_until: float = float("-inf")
+    remaining_tokens: Optional[int] = None
+    remaining_requests: Optional[int] = None
+    limits_read_at: float = float("-inf")
+
+
+def parse_backends(value: str) -> list[OpenAIBackend]:
+    """Parses a comma-separated list of Azure OpenAI service names, each optionally followed by ":weight"."""
+    backends = []
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        service, _, weight = entry.strip().partition(":")
+        backends.append(OpenAIBackend(endpoint=f"https://{service}.openai.azure.com", weight=float(weight or 1)))
+    return backends
+
+
+class OpenAIBackendPool(httpx.AsyncBaseTransport):
+    """
+    httpx transport that spreads the requests of the OpenAI SDK over several Azure OpenAI services, so that throughput
+    isn't capped by the quota of a single regional deployment. Requests are routed by weight, scaled down for backends
+    whose rate-limit headers report few remaining tokens. A backend answering with a 429 or a 5xx, or failing to
+    connect, is ejected for the time given by its Retry-After header (or eject_seconds) and the request fails over to
+    the next one. The response of the last backend is returned when all of them failed, so the SDK can still retry.
+    The approaches keep using a single OpenAI client, the pool only rewrites the host of each request.
+    Attributes:
+        backends (list[OpenAIBackend]): The services in the pool.
+        transport (httpx.AsyncBaseTransport): The transport that sends the requests, it is not closed by the pool.
+        eject_seconds (float): How long a failing backend is skipped when it doesn't say when to retry.
+    """
+
+    # Below this many remaining tokens, a backend gets proportionally less traffic
+    TOKENS_HEADROOM = 10000
+    # Quotas are per minute, so an older reading says nothing about the tokens left now. Without this, a backend
+    # that reported an empty quota would hardly get any request, and its reading would never be refreshed.
+    LIMITS_TTL_SECONDS = 60
+
+    def __init__(self, backends: list[OpenAIBackend], transport: httpx.AsyncBaseTransport, eject_seconds: float = 10):
+        if not backends:
+            raise ValueError("The OpenAI backend pool needs at least one backend")
+        self.backends = backends
+        self.transport = transport
+        self.eject_seconds = eject_seconds
+        self.states: dict[tuple[str, str], BackendState] = {}
+
+    def state(self, backend: OpenAIBackend, deployment: str) -> BackendState:
+        return self.states.setdefault((backend.endpoint, deployment), BackendState())
+
+    def effective_weight(self, backend: OpenAIBackend, deployment: str) -> float:
+        state = self.state(backend, deployment)
+        remaining_tokens = state.remaining_tokens
+        if remaining_tokens is None or time.monotonic() - state.limits_read_at > self.LIMITS_TTL_SECONDS:
+            return backend.weight
+        return backend.weight * min(1.0, max(remaining_tokens, 1) / self.TOKENS_HEADROOM)
+
+    def choose(self, candidates: list[OpenAIBackend], deployment: str) -> OpenAIBackend:
+        now = time.monotonic()
+        healthy = [backend for backend in candidates if self.state(backend, deployment).ejected_until <= now]
+        if not healthy:
+            # Everything is ejected, try the backend that comes back first rather than failing outright
+            return min(candidates, key=lambda backend: self.state(backend, deployment).ejected_until)
+        weights = [self.effective_weight(backend, deployment) for backend in healthy]
+        return random.choices(healthy, weights=weights)[0]
+
+    def retry_after(self, response: httpx.Response) -> float:
+        if retry_after_ms := response.headers.get("retry-after-ms"):
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+        if retry_after := response.headers.get("retry-after"):
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.eject_seconds
+
+    def record_limits(self, state: BackendState, response: httpx.Response):
+        try:
+            if (remaining_tokens := response.headers.get("x-ratelimit-remaining-tokens")) is not None:
+                state.remaining_tokens = int(remaining_tokens)
+                state.limits_read_at = time.monotonic()
+            if (remaining_requests := response.headers.get("x-ratelimit-remaining-requests")) is not None:
+                state.remaining_requests = int(remaining_requests)
+        except ValueError as error:
+            # The limits only steer the routing, a malformed header mustn't fail the request
+            logging.warning("Ignoring malformed rate-limit header: %s", error)
+
+    def eject(self, backend: OpenAIBackend, deployment: str, seconds: float, reason: str):
+        state = self.state(backend, deployment)
+        state.failures += 1
+        state.ejected_until = time.monotonic() + seconds
+        logging.warning("Ejecting OpenAI backend %s (%s) for %.1fs: %s", backend.endpoint, deployment, seconds, reason)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        match = DEPLOYMENT_PATTERN.search(request.url.path)
+        deployment = match.group(1) if match else request.url.path
+        # The body is replayed on failover, so it has to be read up front (the SDK sends JSON, so it already is)
+        content = await request.aread()
+        candidates = list(self.backends)
+        while True:
+            backend = self.choose(candidates, deployment)
+            candidates.remove(backend)
+            state = self.state(backend, deployment)
+            state.requests += 1
+            backend_url = httpx.URL(backend.endpoint)
+            backend_request = httpx.Request(
+                request.method,
+                request.url.copy_with(scheme=backend_url.scheme, host=backend_url.host, port=backend_url.port),
+                headers=[(name, value) for name, value in request.headers.raw if name.lower() != b"host"],
+                content=content,
+                extensions=request.extensions,
+            )
+            try:
+                response = await self.transport.handle_async_request(backend_request)
+            except httpx.TransportError as error:
+                self.eject(backend, deployment, self.eject_seconds, repr(error))
+                if not candidates:
+                    raise
+                continue
+            self.record_limits(state, response)
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            self.eject(backend, deployment, self.retry_after(response), f"status {response.status_code}")
+            if not candidates:
+                return response
+            await response.aclose()
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "backends": [
+                {
+                    "endpoint": endpoint,
+                    "deployment": deployment,
+                    "requests": state.requests,
+                    "failures": state.failures,
+                    "ejected": state.ejected_until > now,
+                    "remaining_tokens": state.remaining_tokens,
+                    "remaining_requests": state.remaining_requests,
+                }
+                for (endpoint, deployment), state in self.states.items()
+            ]
+        }
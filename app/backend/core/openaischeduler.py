@@ -0,0 +1,153 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+# Priority classes, lower values are admitted first
+PRIORITY_INTERACTIVE = 0  # Query rewrites and the embeddings the user is waiting on
+PRIORITY_ANSWER = 1  # Final answers
+PRIORITY_BACKGROUND = 2  # Speculative work whose result may be thrown away
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_ANSWER: "answer", PRIORITY_BACKGROUND: "background"}
+
+
+def estimate_tokens(messages: list[Any], max_tokens: int = 0) -> int:
+    """
+    Estimates the tokens a call counts against the quota the way Azure OpenAI does, from the characters
+    of the prompt plus the completion tokens requested. Images are not counted.
+    """
+    characters = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else message
+        if isinstance(content, str):
+            characters += len(content)
+        elif isinstance(content, list):
+            characters += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return characters // 4 + max_tokens
+
+
+class OpenAIScheduler:
+    """
+    Admits the OpenAI calls of a worker by priority, so that short query rewrites don't queue behind long answers
+    and speculative work only uses spare capacity. At most max_concurrency calls are in flight. When
+    tokens_per_minute is set, calls also take their estimated tokens from a bucket refilled at that rate, so the
+    worker stays under its share of the deployment quota instead of running into 429s.
+    For streamed answers, the slot is held until the stream starts, the tokens cover the whole generation.
+    Calls that waited longer than max_queue_wait go ahead of any priority, oldest first, so that a steady flow
+    of interactive calls can't hold back answers and speculative work indefinitely.
+    Attributes:
+        max_concurrency (int): The maximum number of calls in flight.
+        tokens_per_minute (int): The token rate allowed to the worker, or 0 to not limit tokens.
+        max_queue_wait (float): Seconds after which a waiting call is admitted regardless of its priority.
+        available_tokens (float): The tokens left in the bucket at the last refill.
+    """
+
+    def __init__(self, max_concurrency: int, tokens_per_minute: int = 0, max_queue_wait: float = 5):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue_wait = max_queue_wait
+        self.available_tokens = float(tokens_per_minute)
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.admitted = {priority: 0 for priority in PRIORITY_NAMES}
+        self.queue_wait_seconds = {priority: 0.0 for priority in PRIORITY_NAMES}
+        # Heap of (priority, arrival order, tokens, future) for the calls waiting to be admitted
+        self._waiters: list[tuple[int, int, int, asyncio.Future]] = []
+        # The same calls in arrival order, with the time they arrived, to find those that waited too long
+        self._arrived: deque[tuple[float, int, asyncio.Future]] = deque()
+        self._arrivals = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            refilled = self.available_tokens + (now - self.refilled_at) * self.tokens_per_minute / 60
+            self.available_tokens = min(float(self.tokens_per_minute), refilled)
+        self.refilled_at = now
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _next_waiter(self) -> Optional[tuple[int, asyncio.Future]]:
+        """The tokens and future of the call to admit next, dropping the calls cancelled while waiting."""
+        while self._arrived and self._arrived[0][2].done():
+            self._arrived.popleft()
+        while self._waiters and self._waiters[0][3].done():
+            heapq.heappop(self._waiters)
+        if self._arrived and time.monotonic() - self._arrived[0][0] >= self.max_queue_wait:
+            _, tokens, future = self._arrived[0]
+            return tokens, future
+        if self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            return tokens, future
+        return None
+
+    def _dispatch(self):
+        self._refill()
+        while self.in_flight < self.max_concurrency and (waiter := self._next_waiter()):
+            tokens, future = waiter
+            if self.tokens_per_minute:
+                # Calls larger than the bucket only need a full bucket, so they can still go through
+                tokens = min(tokens, self.tokens_per_minute)
+                if self.available_tokens < tokens:
+                    # Nothing else is admitted until the call at the head of the queue fits
+                    if self._wakeup is None:
+                        delay = (tokens - self.available_tokens) * 60 / self.tokens_per_minute
+                        self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+                    return
+                self.available_tokens -= tokens
+            # Its entries in the heap and in the arrival queue are dropped once they reach the front
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def acquire(self, priority: int, tokens: int):
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), tokens, future))
+        self._arrived.append((started, tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Admitted right as the caller was cancelled, the slot has to be given back
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self.admitted[priority] += 1
+        self.queue_wait_seconds[priority] += time.monotonic() - started
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int, tokens: int) -> AsyncIterator[None]:
+        await self.acquire(priority, tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict[str, Any]:
+        self._refill()
+        queued = {priority: 0 for priority in PRIORITY_NAMES}
+        for priority, _, _, future in self._waiters:
+            if not future.done():
+                queued[priority] += 1
+        return {
+            "max_concurrency": self.max_concurrency,
+            "tokens_per_minute": self.tokens_per_minute,
+            "in_flight": self.in_flight,
+            "available_tokens": self.available_tokens,
+            "priorities": {
+                name: {
+                    "queued": queued[priority],
+                    "admitted": self.admitted[priority],
+                    "queue_wait_seconds": self.queue_wait_seconds[priority],
+                }
+                for priority, name in PRIORITY_NAMES.items()
+            },
+        }
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency after failure_threshold consecutive failures. Once reset_timeout has passed,
+    a single trial call is let through: the breaker closes again if it succeeds, and stays open otherwise.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allows(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self.trial_in_flight)
+
+    def before_call(self):
+        if not self.allows():
+            raise CircuitOpenError("Circuit breaker is open")
+        if self.opened_at is not None:
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+
+
+class ResiliencePolicy:
+    """
+    Wraps the calls to a dependency with a deadline, a hedged duplicate call and circuit breakers.
+    When a call is still running after the hedge_percentile latency of the recent successful calls, the same call is
+    fired again and whichever finishes first wins, so a single slow replica doesn't stall the answer.
+    Calls are grouped by kind (e.g. text or vector searches): each kind has its own latency history and breaker,
+    so that callers can fall back to another kind of call while one is failing.
+    Hedges add load on the dependency outside of any other limit (a hedged embedding shares the scheduler slot of
+    the call it duplicates), so they are capped at hedge_budget of the calls: when the dependency slows down across
+    the board, most calls just wait instead of doubling its load.
+    Attributes:
+        timeout (float): Seconds allowed for a call, hedges included, before raising asyncio.TimeoutError.
+        hedge_percentile (float): Latency percentile after which the call is hedged, or 0 to never hedge.
+        hedge_budget (float): The largest share of calls that may be hedged.
+        min_samples (int): Successful calls needed before the latency percentile is trusted for hedging.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        hedge_percentile: float = 95,
+        hedge_budget: float = 0.05,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        min_samples: int = 20,
+        history_size: int = 200,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.min_samples = min_samples
+        self.history_size = history_size
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.latencies: dict[str, deque[float]] = {}
+        self.calls = 0
+        self.hedged = 0
+        self.hedges_won = 0
+        self.hedges_over_budget = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def breaker(self, kind: str) -> CircuitBreaker:
+        if kind not in self.breakers:
+            self.breakers[kind] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return self.breakers[kind]
+
+    def allows(self, kind: str = "default") -> bool:
+        return self.breaker(kind).allows()
+
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        latencies = self.latencies.get(kind)
+        if not self.hedge_percentile or not latencies or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(len(ordered) * self.hedge_percentile / 100) - 1)]
+
+    async def call(self, make_call: Callable[[], Awaitable[T]], kind: str = "default") -> T:
+        breaker = self.breaker(kind)
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            self.rejected += 1
+            raise
+        self.calls += 1
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self._hedged_call(make_call, kind), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            breaker.record_failure()
+            logging.warning("%s call (%s) timed out after %.1fs", self.name, kind, self.timeout)
+            raise
+        except asyncio.CancelledError:
+            # The caller gave up, that says nothing about the health of the dependency
+            breaker.trial_in_flight = False
+            raise
+        except Exception:
+            self.failures += 1
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        latencies = self.latencies.setdefault(kind, deque(maxlen=self.history_size))
+        latencies.append(time.monotonic() - started)
+        return result
+
+    async def _hedged_call(self, make_call: Callable[[], Awaitable[T]], kind: str) -> T:
+        primary = asyncio.ensure_future(make_call())
+        attempts = {primary}
+        try:
+            hedge_delay = self.hedge_delay(kind)
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=hedge_delay)
+                if not done:
+                    if self.hedged < self.hedge_budget * self.calls:
+                        self.hedged += 1
+                        attempts.add(asyncio.ensure_future(make_call()))
+                    else:
+                        self.hedges_over_budget += 1
+            error: Optional[BaseException] = None
+            while attempts:
+                done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is not primary:
+                            self.hedges_won += 1
+                        return attempt.result()
+                    error = attempt.exception()
+            # Every attempt failed, report the last error
+            assert error is not None
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedges_won": self.hedges_won,
+            "hedges_over_budget": self.hedges_over_budget,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "breakers": {kind: breaker.state for kind, breaker in self.breakers.items()},
+        }
@@ -0,0 +1,63 @@
+import dataclasses
+import json
+import secrets
+from typing import Any, AsyncGenerator, Optional
+
+from core.cache import LRUCache
+
+# Sent by clients in the overrides to get only the citations with the answer
+MINIMAL_VERBOSITY = "minimal"
+
+
+@dataclasses.dataclass
+class StoredThoughts:
+    owner: Optional[str]
+    data: str
+
+
+class ThoughtStore:
+    """
+    Keeps the thought process and the full supporting content of answers server-side for a short time,
+    so that responses requested with minimal verbosity only carry the citations, and the analysis panel
+    fetches the rest when it is opened. Thoughts embed the prompt and the retrieved content, so they are
+    only handed back to the user they were produced for.
+    The store is in the memory of the worker that answered, so a later request for the thoughts that lands on
+    another worker, or on a restarted one, finds nothing. That is why the frontend only asks for minimal
+    verbosity when the user opts in.
+    Attributes:
+        cache (LRUCache[StoredThoughts]): The serialized thoughts, bounded by their size in characters.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.cache = LRUCache[StoredThoughts](max_size=max_size, ttl=ttl, sizeof=lambda thoughts: len(thoughts.data))
+
+    def defer(self, context: dict[str, Any], owner: Optional[str]) -> dict[str, Any]:
+        """Stores the thoughts and data points of a context, and returns the context to send instead."""
+        thoughts_id = secrets.token_urlsafe(16)
+        data = json.dumps(
+            {"thoughts": context.get("thoughts"), "data_points": context.get("data_points")},
+            ensure_ascii=False,
+            default=dataclasses.asdict,
+        )
+        self.cache.set(thoughts_id, StoredThoughts(owner=owner, data=data))
+        minimal_context = {key: value for key, value in context.items() if key not in ("thoughts", "data_points")}
+        # Only the names of the text sources are sent, they are what the citations of the answer point to
+        data_points = context.get("data_points") or {}
+        minimal_context["data_points"] = {"text": [source.split(": ", 1)[0] for source in data_points.get("text", [])]}
+        minimal_context["thoughts_id"] = thoughts_id
+        return minimal_context
+
+    async def defer_stream(
+        self, result: AsyncGenerator[dict, None], owner: Optional[str]
+    ) -> AsyncGenerator[dict, None]:
+        async for event in result:
+            choice = (event.get("choices") or [{}])[0]
+            if "thoughts" in (choice.get("context") or {}):
+                event = {**event, "choices": [{**choice, "context": self.defer(choice["context"], owner)}]}
+            yield event
+
+    def get(self, thoughts_id: str, owner: Optional[str]) -> Optional[str]:
+        stored_thoughts = self.cache.get(thoughts_id)
+        if stored_thoughts is None or stored_thoughts.owner != owner:
+            return None
+        return stored_thoughts.data
@@ -1,6 +1,6 @@
 const BACKEND_URI = "";
 
-import { ChatAppResponse, ChatAppResponseOrError, ChatAppRequest, Config } from "./models";
+import { ChatAppResponse, ChatAppResponseOrError, ChatAppRequest, Config, ThoughtsResponse } from "./models";
 import { useLogin, appServicesToken } from "../authConfig";
 
 function getHeaders(idToken: string | undefined): Record<string, string> {
@@ -49,6 +49,20 @@ export async function chatApi(request: ChatAppRequest, idToken: string | undefin
     });
 }
 
+export async function thoughtsApi(thoughtsId: string, idToken: string | undefined): Promise<ThoughtsResponse> {
+    const response = await fetch(`${BACKEND_URI}/thoughts/${thoughtsId}`, {
+        method: "GET",
+        headers: getHeaders(idToken)
+    });
+
+    const parsedResponse = await response.json();
+    if (response.status > 299 || !response.ok) {
+        throw Error(parsedResponse.error || "Unknown error");
+    }
+
+    return parsedResponse as ThoughtsResponse;
+}
+
 export function getCitationFilePath(citation: string): string {
     return `${BACKEND_URI}/content/${citation}`;
 }
@@ -16,6 +16,11 @@ export const enum VectorFieldOptions {
     Both = "both"
 }
 
+export const enum ThoughtVerbosity {
+    Full = "full",
+    Minimal = "minimal"
+}
+
 export type ChatAppRequestOverrides = {
     retrieval_mode?: RetrievalMode;
     semantic_ranker?: boolean;
@@ -32,6 +37,7 @@ export type ChatAppRequestOverrides = {
     use_gpt4v?: boolean;
     gpt4v_input?: GPT4VInput;
     vector_fields: VectorFieldOptions[];
+    thought_verbosity?: ThoughtVerbosity;
 };
 
 export type ResponseMessage = {
@@ -49,6 +55,12 @@ export type ResponseContext = {
     data_points: string[];
     followup_questions: string[] | null;
     thoughts: Thoughts[];
+    thoughts_id?: string;
+};
+
+export type ThoughtsResponse = {
+    data_points: string[];
+    thoughts: Thoughts[];
 };
 
 export type ResponseChoice = {
@@ -1,10 +1,13 @@
+import { useEffect, useState } from "react";
 import { Stack, Pivot, PivotItem } from "@fluentui/react";
 import SyntaxHighlighter from "react-syntax-highlighter";
+import { useMsal } from "@azure/msal-react";
 
 import styles from "./AnalysisPanel.module.css";
 
 import { SupportingContent } from "../SupportingContent";
-import { ChatAppResponse } from "../../api";
+import { ChatAppResponse, ThoughtsResponse, thoughtsApi } from "../../api";
+import { useLogin, getToken } from "../../authConfig";
 import { AnalysisPanelTabs } from "./AnalysisPanelTabs";
 import { ThoughtProcess } from "./ThoughtProcess";
 
@@ -20,8 +23,34 @@ interface Props {
 const pivotItemDisabledStyle = { disabled: true, style: { color: "grey" } };
 
 export const AnalysisPanel = ({ answer, activeTab, activeCitation, citationHeight, className, onActiveTabChanged }: Props) => {
-    const isDisabledThoughtProcessTab: boolean = !answer.choices[0].context.thoughts;
-    const isDisabledSupportingContentTab: boolean = !answer.choices[0].context.data_points;
+    const context = answer.choices[0].context;
+    const client = useLogin ? useMsal().instance : undefined;
+    // Answers requested with minimal verbosity only carry an id, the thought process is fetched when the panel opens
+    const [fetchedThoughts, setFetchedThoughts] = useState<ThoughtsResponse | undefined>(undefined);
+    const [fetchThoughtsError, setFetchThoughtsError] = useState<string | undefined>(undefined);
+    const thoughts = context.thoughts || fetchedThoughts?.thoughts;
+    const dataPoints = fetchedThoughts?.data_points || context.data_points;
+
+    useEffect(() => {
+        setFetchedThoughts(undefined);
+        setFetchThoughtsError(undefined);
+        if (context.thoughts || !context.thoughts_id) {
+            return;
+        }
+        const fetchThoughts = async () => {
+            const token = client ? await getToken(client) : undefined;
+            try {
+                setFetchedThoughts(await thoughtsApi(context.thoughts_id!, token));
+            } catch (e) {
+                console.log(e);
+                setFetchThoughtsError(e instanceof Error ? e.message : String(e));
+            }
+        };
+        fetchThoughts();
+    }, [context.thoughts_id]);
+
+    const isDisabledThoughtProcessTab: boolean = !thoughts && !context.thoughts_id;
+    const isDisabledSupportingContentTab: boolean = !dataPoints;
     const isDisabledCitationTab: boolean = !activeCitation;
 
     return (
@@ -35,14 +64,14 @@ export const AnalysisPanel = ({ answer, activeTab, activeCitation, citationHeigh
                 headerText="Thought process"
                 headerButtonProps={isDisabledThoughtProcessTab ? pivotItemDisabledStyle : undefined}
             >
-                <ThoughtProcess thoughts={answer.choices[0].context.thoughts || []} />
+                {fetchThoughtsError && !thoughts ? <p>{fetchThoughtsError}</p> : <ThoughtProcess thoughts={thoughts || []} />}
             </PivotItem>
             <PivotItem
                 itemKey={AnalysisPanelTabs.SupportingContentTab}
                 headerText="Supporting content"
                 headerButtonProps={isDisabledSupportingContentTab ? pivotItemDisabledStyle : undefined}
             >
-                <SupportingContent supportingContent={answer.choices[0].context.data_points} />
+                <SupportingContent supportingContent={dataPoints} />
             </PivotItem>
             <PivotItem
                 itemKey={AnalysisPanelTabs.CitationTab}
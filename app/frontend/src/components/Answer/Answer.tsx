@@ -47,7 +47,7 @@ export const Answer = ({
                             title="Show thought process"
                             ariaLabel="Show thought process"
                             onClick={() => onThoughtProcessClicked()}
-                            disabled={!answer.choices[0].context.thoughts?.length}
+                            disabled={!answer.choices[0].context.thoughts?.length && !answer.choices[0].context.thoughts_id}
                         />
                         <IconButton
                             style={{ color: "black" }}
@@ -14,7 +14,8 @@ import {
     ChatAppRequest,
     ResponseMessage,
     VectorFieldOptions,
-    GPT4VInput
+    GPT4VInput,
+    ThoughtVerbosity
 } from "../../api";
 import { Answer, AnswerError, AnswerLoading } from "../../components/Answer";
 import { QuestionInput } from "../../components/QuestionInput";
@@ -39,6 +40,7 @@ const Chat = () => {
     const [useSemanticCaptions, setUseSemanticCaptions] = useState<boolean>(false);
     const [excludeCategory, setExcludeCategory] = useState<string>("");
     const [useSuggestFollowupQuestions, setUseSuggestFollowupQuestions] = useState<boolean>(false);
+    const [useDeferredThoughts, setUseDeferredThoughts] = useState<boolean>(false);
     const [vectorFieldList, setVectorFieldList] = useState<VectorFieldOptions[]>([VectorFieldOptions.Embedding]);
     const [useOidSecurityFilter, setUseOidSecurityFilter] = useState<boolean>(false);
     const [useGroupsSecurityFilter, setUseGroupsSecurityFilter] = useState<boolean>(false);
@@ -145,7 +147,9 @@ const Chat = () => {
                         use_groups_security_filter: useGroupsSecurityFilter,
                         vector_fields: vectorFieldList,
                         use_gpt4v: useGPT4V,
-                        gpt4v_input: gpt4vInput
+                        gpt4v_input: gpt4vInput,
+                        // The thought process is then fetched when the analysis panel is opened
+                        thought_verbosity: useDeferredThoughts ? ThoughtVerbosity.Minimal : ThoughtVerbosity.Full
                     }
                 },
                 // ChatAppProtocol: Client must pass on any session state received from the server
@@ -218,6 +222,10 @@ const Chat = () => {
         setUseSuggestFollowupQuestions(!!checked);
     };
 
+    const onUseDeferredThoughtsChange = (_ev?: React.FormEvent<HTMLElement | HTMLInputElement>, checked?: boolean) => {
+        setUseDeferredThoughts(!!checked);
+    };
+
     const onUseOidSecurityFilterChange = (_ev?: React.FormEvent<HTMLElement | HTMLInputElement>, checked?: boolean) => {
         setUseOidSecurityFilter(!!checked);
     };
@@ -436,6 +444,12 @@ const Chat = () => {
                         label="Stream chat completion responses"
                         onChange={onShouldStreamChange}
                     />
+                    <Checkbox
+                        className={styles.chatSettingsSeparator}
+                        checked={useDeferredThoughts}
+                        label="Load the thought process when the analysis panel is opened"
+                        onChange={onUseDeferredThoughtsChange}
+                    />
                     {useLogin && <TokenClaimsDisplay />}
                 </Panel>
             </div>
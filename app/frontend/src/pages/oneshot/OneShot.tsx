@@ -3,7 +3,7 @@ import { Checkbox, Panel, DefaultButton, Spinner, TextField, SpinButton, IDropdo
 
 import styles from "./OneShot.module.css";
 
-import { askApi, configApi, ChatAppResponse, ChatAppRequest, RetrievalMode, VectorFieldOptions, GPT4VInput } from "../../api";
+import { askApi, configApi, ChatAppResponse, ChatAppRequest, RetrievalMode, VectorFieldOptions, GPT4VInput, ThoughtVerbosity } from "../../api";
 import { Answer, AnswerError } from "../../components/Answer";
 import { QuestionInput } from "../../components/QuestionInput";
 import { ExampleList } from "../../components/Example";
@@ -32,6 +32,7 @@ export function Component(): JSX.Element {
     const [vectorFieldList, setVectorFieldList] = useState<VectorFieldOptions[]>([VectorFieldOptions.Embedding, VectorFieldOptions.ImageEmbedding]);
     const [useOidSecurityFilter, setUseOidSecurityFilter] = useState<boolean>(false);
     const [useGroupsSecurityFilter, setUseGroupsSecurityFilter] = useState<boolean>(false);
+    const [useDeferredThoughts, setUseDeferredThoughts] = useState<boolean>(false);
     const [showGPT4VOptions, setShowGPT4VOptions] = useState<boolean>(false);
 
     const lastQuestionRef = useRef<string>("");
@@ -89,7 +90,9 @@ export function Component(): JSX.Element {
                         use_groups_security_filter: useGroupsSecurityFilter,
                         vector_fields: vectorFieldList,
                         use_gpt4v: useGPT4V,
-                        gpt4v_input: gpt4vInput
+                        gpt4v_input: gpt4vInput,
+                        // The thought process is then fetched when the analysis panel is opened
+                        thought_verbosity: useDeferredThoughts ? ThoughtVerbosity.Minimal : ThoughtVerbosity.Full
                     }
                 },
                 // ChatAppProtocol: Client must pass on any session state received from the server
@@ -158,6 +161,10 @@ export function Component(): JSX.Element {
         }
     };
 
+    const onUseDeferredThoughtsChange = (_ev?: React.FormEvent<HTMLElement | HTMLInputElement>, checked?: boolean) => {
+        setUseDeferredThoughts(!!checked);
+    };
+
     const onUseOidSecurityFilterChange = (_ev?: React.FormEvent<HTMLElement | HTMLInputElement>, checked?: boolean) => {
         setUseOidSecurityFilter(!!checked);
     };
@@ -250,6 +257,12 @@ export function Component(): JSX.Element {
                     onChange={onUseSemanticCaptionsChange}
                     disabled={!useSemanticRanker}
                 />
+                <Checkbox
+                    className={styles.oneshotSettingsSeparator}
+                    checked={useDeferredThoughts}
+                    label="Load the thought process when the analysis panel is opened"
+                    onChange={onUseDeferredThoughtsChange}
+                />
 
                 {showGPT4VOptions && (
                     <GPT4VSettings
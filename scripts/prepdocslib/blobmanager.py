@@ -145,6 +145,22 @@ class BlobManager:
                     print(f"\tRemoving blob {blob_path}")
                 await container_client.delete_blob(blob_path)
 
+    async def update_index_version(self):
+        """
+        Stamps the container with a new index version, so that the app drops answers it cached from the previous content
+        """
+        async with BlobServiceClient(
+            account_url=self.endpoint, credential=self.credential
+        ) as service_client, service_client.get_container_client(self.container) as container_client:
+            if not await container_client.exists():
+                return
+            # Setting metadata replaces all of it, so keep any other keys on the container
+            metadata = (await container_client.get_container_properties()).metadata or {}
+            index_version = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            if self.verbose:
+                print(f"\tUpdating index version -> {index_version}")
+            await container_client.set_container_metadata({**metadata, "index_version": index_version})
+
     @classmethod
     def sourcepage_from_file_page(cls, filename, page=0) -> str:
         if os.path.splitext(filename)[1].lower() == ".pdf":
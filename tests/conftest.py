@@ -1,6 +1,8 @@
 import argparse
+import itertools
 import json
 import os
+import time
 from unittest import mock
 
 import aiohttp
@@ -209,6 +211,19 @@ def mock_acs_search(monkeypatch):
     monkeypatch.setattr(SearchIndexClient, "get_index", mock_get_index)
 
 
+@pytest.fixture
+def search_calls(mock_acs_search, monkeypatch):
+    """The keyword arguments of every search sent to the mock search index, in order."""
+    calls = []
+
+    async def counting_search(self, *args, **kwargs):
+        calls.append(kwargs)
+        return await mock_search(self, *args, **kwargs)
+
+    monkeypatch.setattr(SearchClient, "search", counting_search)
+    return calls
+
+
 @pytest.fixture
 def mock_acs_search_filter(monkeypatch):
     monkeypatch.setattr(SearchClient, "search", mock_search)
@@ -258,6 +273,13 @@ auth_envs = [
 ]
 
 
+@pytest.fixture
+def mock_stage_clock(monkeypatch):
+    # Stage timings are part of the responses, a clock moving 1ms per reading keeps them stable in the snapshots
+    ticks = itertools.count()
+    monkeypatch.setattr(time, "perf_counter", lambda: next(ticks) / 1000)
+
+
 @pytest.fixture(params=envs, ids=["client0", "client1"])
 def mock_env(monkeypatch, request, mock_get_secret):
     with mock.patch.dict(os.environ, clear=True):
@@ -286,6 +308,7 @@ async def client(
     mock_acs_search,
     mock_blob_container_client,
     mock_compute_embeddings_call,
+    mock_stage_clock,
 ):
     quart_app = app.create_app()
 
@@ -305,6 +328,7 @@ async def auth_client(
     mock_list_groups_success,
     mock_acs_search_filter,
     mock_get_secret,
+    mock_stage_clock,
     request,
 ):
     monkeypatch.setenv("AZURE_STORAGE_ACCOUNT", "test-storage-account")
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from core.admission import AdmissionController, AdmissionRejected
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_full():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=10)
+    admitted_at = await controller.acquire()
+    waiting = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    assert controller.stats()["queue_depth"] == 1
+
+    with pytest.raises(AdmissionRejected) as exc_info:
+        await controller.acquire()
+    assert exc_info.value.reason == "queue full"
+    assert exc_info.value.retry_after >= 1
+
+    controller.release(admitted_at)
+    controller.release(await waiting)
+    assert controller.stats() | {"queue_wait_seconds": 0, "average_run_seconds": 0} == {
+        "max_concurrency": 1,
+        "max_queue": 1,
+        "in_flight": 0,
+        "queue_depth": 0,
+        "admitted": 2,
+        "rejected": 1,
+        "queue_wait_seconds": 0,
+        "average_run_seconds": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_timeout():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.01)
+    admitted_at = await controller.acquire()
+    with pytest.raises(AdmissionRejected, match="queue timeout"):
+        await controller.acquire()
+    assert controller.queued == 0
+    controller.release(admitted_at)
+    controller.release(await controller.acquire())
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_release_after_stream():
+    controller = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=10)
+
+    async def gen():
+        yield {"a": 1}
+        yield {"b": 2}
+
+    stream = controller.release_after_stream(gen(), await controller.acquire())
+    assert await stream.__anext__() == {"a": 1}
+    # The slot is held while the response is being streamed
+    with pytest.raises(AdmissionRejected):
+        await controller.acquire()
+    assert [event async for event in stream] == [{"b": 2}]
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_release_after_stream_closed_before_start():
+    controller = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=10)
+
+    async def gen():
+        yield {"a": 1}
+
+    stream = controller.release_after_stream(gen(), await controller.acquire())
+    await stream.aclose()
+    assert controller.in_flight == 0
+    # The slot is only released once
+    await stream.aclose()
+    del stream
+    assert controller.in_flight == 0
+    await controller.acquire()
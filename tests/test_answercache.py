@@ -0,0 +1,59 @@
+from approaches.approach import ThoughtStep
+from core.answercache import AnswerCache
+
+
+def test_build_key_scoped_by_security_filter():
+    answer_cache = AnswerCache(max_size=1024, ttl=60, namespace="gpt-35-turbo")
+    messages = [{"content": "What is in my plan?", "role": "user"}]
+    overrides = {"use_oid_security_filter": True}
+    key = answer_cache.build_key("RetrieveThenReadApproach", messages, overrides, "oids/any(g:search.in(g, 'OID_X'))")
+    assert key == answer_cache.build_key(
+        "RetrieveThenReadApproach", messages, overrides, "oids/any(g:search.in(g, 'OID_X'))"
+    )
+    assert key != answer_cache.build_key(
+        "RetrieveThenReadApproach", messages, overrides, "oids/any(g:search.in(g, 'OID_Y'))"
+    )
+    assert key != answer_cache.build_key("ChatReadRetrieveReadApproach", messages, overrides, None)
+    assert key != AnswerCache(max_size=1024, ttl=60, namespace="gpt-4").build_key(
+        "RetrieveThenReadApproach", messages, overrides, "oids/any(g:search.in(g, 'OID_X'))"
+    )
+
+
+def test_set_skips_session_state():
+    answer_cache = AnswerCache(max_size=1024, ttl=60, namespace="gpt-35-turbo")
+    answer_cache.set(
+        "key",
+        {
+            "choices": [
+                {
+                    "message": {"content": "Paris", "role": "assistant"},
+                    "context": {"data_points": {"text": []}},
+                    "session_state": "secret",
+                }
+            ]
+        },
+    )
+    assert "secret" not in answer_cache.cache.get("key")
+    assert answer_cache.get("key", session_state="new")["choices"][0]["session_state"] == "new"
+    assert answer_cache.get("other") is None
+
+
+def test_set_skips_timings():
+    answer_cache = AnswerCache(max_size=1024, ttl=60, namespace="gpt-35-turbo")
+    answer_cache.set(
+        "key",
+        {
+            "choices": [
+                {
+                    "message": {"content": "Paris", "role": "assistant"},
+                    "context": {
+                        "thoughts": [ThoughtStep("Search Query", "capital", {"top": 3, "search_ms": 12.5})],
+                        "timings": {"search_ms": 12.5, "completion_ms": 800.0},
+                    },
+                }
+            ]
+        },
+    )
+    assert answer_cache.get("key")["choices"][0]["context"] == {
+        "thoughts": [{"title": "Search Query", "description": "capital", "props": {"top": 3}}]
+    }
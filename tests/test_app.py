@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import os
@@ -5,10 +6,17 @@ from unittest import mock
 
 import pytest
 import quart.testing.app
+from azure.search.documents.aio import SearchClient
+from azure.storage.blob import ContainerProperties
+from azure.storage.blob.aio import ContainerClient
 from httpx import Request, Response
 from openai import BadRequestError
 
 import app
+from approaches.approach import Document
+from core.answercache import AnswerCache
+from core.cache import LRUCache
+from core.openaischeduler import OpenAIScheduler
 
 
 def fake_response(http_code):
@@ -54,6 +62,34 @@ async def test_missing_env_vars():
                 test_app.test_client()
 
 
+@pytest.mark.asyncio
+async def test_hedge_budget_from_env(monkeypatch, mock_env, mock_acs_search):
+    monkeypatch.setenv("SEARCH_HEDGE_BUDGET", "0.1")
+    monkeypatch.setenv("EMBEDDING_HEDGE_BUDGET", "0")
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        config = test_app.app.config
+        assert config[app.CONFIG_SEARCH_POLICY].hedge_budget == 0.1
+        assert config[app.CONFIG_EMBEDDING_POLICY].hedge_budget == 0
+
+
+@pytest.mark.asyncio
+async def test_vision_approaches_built_on_first_use(client, caplog):
+    config = client.app.config
+    assert app.CONFIG_ASK_VISION_APPROACH not in config
+    assert app.CONFIG_CHAT_VISION_APPROACH not in config
+    async with client.app.app_context():
+        approach = app.get_approach(app.CONFIG_CHAT_VISION_APPROACH)
+        if config[app.CONFIG_GPT4V_DEPLOYED]:
+            assert approach is config[app.CONFIG_CHAT_VISION_APPROACH]
+            assert app.get_approach(app.CONFIG_CHAT_VISION_APPROACH) is approach
+            assert approach.image_cache is config[app.CONFIG_IMAGE_CACHE]
+        else:
+            assert approach is None
+        assert app.get_approach(app.CONFIG_CHAT_APPROACH) is config[app.CONFIG_CHAT_APPROACH]
+
+
 @pytest.mark.asyncio
 async def test_index(client):
     response = await client.get("/")
@@ -98,6 +134,48 @@ async def test_ask_handle_exception(client, monkeypatch, snapshot, caplog):
     snapshot.assert_match(json.dumps(result, indent=4), "result.json")
 
 
+@pytest.mark.asyncio
+async def test_ask_rejected_when_overloaded(client, caplog):
+    admission_controller = client.app.config[app.CONFIG_ADMISSION_CONTROLLER]
+    admission_controller.max_queue = 0
+    admitted_at = [await admission_controller.acquire() for _ in range(admission_controller.max_concurrency)]
+
+    response = await client.post(
+        "/ask",
+        json={"messages": [{"content": "What is the capital of France?", "role": "user"}]},
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert (await response.get_json()) == {"error": app.ERROR_MESSAGE_OVERLOADED}
+    assert "Rejected request to /ask: queue full" in caplog.text
+
+    for started in admitted_at:
+        admission_controller.release(started)
+    response = await client.post(
+        "/ask",
+        json={"messages": [{"content": "What is the capital of France?", "role": "user"}]},
+    )
+    assert response.status_code == 200
+    assert admission_controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_dropped_before_start_releases_admission(client):
+    admission_controller = client.app.config[app.CONFIG_ADMISSION_CONTROLLER]
+    async with client.app.app_context():
+        result = await app.run_approach(
+            client.app.config[app.CONFIG_CHAT_APPROACH],
+            [{"content": "What is the capital of France?", "role": "user"}],
+            stream=True,
+            context={},
+            session_state=None,
+        )
+        assert admission_controller.in_flight == 1
+        # The client went away before the response started, so the stream is dropped without being iterated
+        del result
+    assert admission_controller.in_flight == 0
+
+
 @pytest.mark.asyncio
 async def test_ask_handle_exception_contentsafety(client, monkeypatch, snapshot, caplog):
     monkeypatch.setattr(
@@ -131,6 +209,25 @@ async def test_ask_rtr_text(client, snapshot):
     snapshot.assert_match(json.dumps(result, indent=4), "result.json")
 
 
+@pytest.mark.asyncio
+async def test_ask_rtr_text_stream(client, snapshot):
+    response = await client.post(
+        "/ask",
+        json={
+            "stream": True,
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {
+                "overrides": {"retrieval_mode": "text"},
+            },
+            "session_state": {"conversation_id": 1234},
+        },
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/json-lines"
+    result = await response.get_data()
+    snapshot.assert_match(result, "result.jsonlines")
+
+
 @pytest.mark.asyncio
 async def test_ask_rtr_text_filter(auth_client, snapshot):
     response = await auth_client.post(
@@ -645,6 +742,234 @@ async def test_ask_vision(client, snapshot):
     snapshot.assert_match(json.dumps(result, indent=4), "result.json")
 
 
+@pytest.mark.asyncio
+async def test_ask_vision_stream(client, snapshot):
+    response = await client.post(
+        "/ask",
+        json={
+            "stream": True,
+            "messages": [{"content": "Are interest rates high?", "role": "user"}],
+            "context": {
+                "overrides": {
+                    "use_gpt4v": True,
+                    "gpt4v_input": "textAndImages",
+                    "vector_fields": ["embedding", "imageEmbedding"],
+                },
+            },
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_data()
+    snapshot.assert_match(result, "result.jsonlines")
+
+
+@pytest.mark.asyncio
+async def test_ask_answer_cache(client, monkeypatch):
+    index_version = "2024-01-01T00:00:00+00:00"
+
+    async def mock_get_container_properties(*args, **kwargs):
+        return ContainerProperties(metadata={"index_version": index_version})
+
+    monkeypatch.setattr(ContainerClient, "get_container_properties", mock_get_container_properties)
+    answer_cache = AnswerCache(max_size=1024 * 1024, ttl=60, namespace="test")
+    client.app.config[app.CONFIG_ANSWER_CACHE] = answer_cache
+    index_version_monitor = client.app.config[app.CONFIG_INDEX_VERSION_MONITOR]
+    index_version_monitor.caches.append(answer_cache.cache)
+
+    request = {
+        "messages": [{"content": "What is the capital of France?", "role": "user"}],
+        "context": {"overrides": {"retrieval_mode": "text"}},
+        "session_state": {"conversation_id": 1},
+    }
+    response = await client.post("/ask", json=request)
+    assert response.status_code == 200
+    first_result = await response.get_json()
+    assert answer_cache.cache.misses == 1
+
+    # Whitespace is normalized and the session state is never cached
+    request["messages"][0]["content"] = "  What is the capital   of France? "
+    request["session_state"] = {"conversation_id": 2}
+    response = await client.post("/ask", json=request)
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert answer_cache.cache.hits == 1
+    assert result["choices"][0]["session_state"] == {"conversation_id": 2}
+    assert result["choices"][0]["message"] == first_result["choices"][0]["message"]
+    assert result["choices"][0]["context"]["data_points"] == first_result["choices"][0]["context"]["data_points"]
+    # The timings are those of the cache lookup, not of the request that produced the answer
+    assert result["choices"][0]["context"]["timings"] == {"answer_cache_ms": 1.0}
+    assert response.headers["Server-Timing"] == "answer_cache;dur=1.0"
+    assert "search_ms" not in result["choices"][0]["context"]["thoughts"][0]["props"]
+
+    # Different overrides are a different question
+    request["context"]["overrides"]["top"] = 1
+    response = await client.post("/ask", json=request)
+    assert answer_cache.cache.misses == 2
+    assert len(answer_cache.cache) == 2
+
+    # A new prepdocs run drops every cached answer
+    index_version = "2024-02-01T00:00:00+00:00"
+    index_version_monitor.refresh_interval = 0
+    response = await client.post("/ask", json=request)
+    assert response.status_code == 200
+    assert index_version_monitor.index_version == index_version
+    assert answer_cache.cache.misses == 3
+    assert len(answer_cache.cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_answer_cache(client, monkeypatch, snapshot):
+    async def mock_get_container_properties(*args, **kwargs):
+        return ContainerProperties(metadata={})
+
+    monkeypatch.setattr(ContainerClient, "get_container_properties", mock_get_container_properties)
+    answer_cache = AnswerCache(max_size=1024 * 1024, ttl=60, namespace="test")
+    client.app.config[app.CONFIG_ANSWER_CACHE] = answer_cache
+    index_version_monitor = client.app.config[app.CONFIG_INDEX_VERSION_MONITOR]
+    index_version_monitor.caches.append(answer_cache.cache)
+
+    request = {
+        "stream": True,
+        "messages": [{"content": "What is the capital of France?", "role": "user"}],
+        "context": {"overrides": {"suggest_followup_questions": True}},
+    }
+    response = await client.post("/chat", json=request)
+    assert response.status_code == 200
+    await response.get_data()
+    assert len(answer_cache.cache) == 1
+
+    # The cached answer is replayed as ndjson chunks
+    response = await client.post("/chat", json=request)
+    assert response.status_code == 200
+    assert answer_cache.cache.hits == 1
+    result = await response.get_data()
+    snapshot.assert_match(result, "result.jsonlines")
+
+    # and also answers the same question without streaming
+    request["stream"] = False
+    response = await client.post("/chat", json=request)
+    assert answer_cache.cache.hits == 2
+    result = await response.get_json()
+    assert result["choices"][0]["message"]["content"] == "The capital of France is Paris. [Benefit_Options-2.pdf]. "
+    assert result["choices"][0]["context"]["followup_questions"] == ["What is the capital of Spain?"]
+
+
+@pytest.mark.asyncio
+async def test_ask_search_cache(client, monkeypatch, search_calls):
+    index_version = "2024-01-01T00:00:00+00:00"
+
+    async def mock_get_container_properties(*args, **kwargs):
+        return ContainerProperties(metadata={"index_version": index_version})
+
+    monkeypatch.setattr(ContainerClient, "get_container_properties", mock_get_container_properties)
+    search_cache = LRUCache[list[Document]](max_size=1024 * 1024, ttl=60)
+    client.app.config[app.CONFIG_ASK_APPROACH].search_cache = search_cache
+    index_version_monitor = client.app.config[app.CONFIG_INDEX_VERSION_MONITOR]
+    index_version_monitor.caches.append(search_cache)
+
+    request = {
+        "messages": [{"content": "What is the capital of France?", "role": "user"}],
+        "context": {"overrides": {"retrieval_mode": "text"}},
+    }
+    response = await client.post("/ask", json=request)
+    assert response.status_code == 200
+    first_result = await response.get_json()
+    response = await client.post("/ask", json=request)
+    result = await response.get_json()
+    assert len(search_calls) == 1
+    assert result["choices"][0]["context"]["data_points"] == first_result["choices"][0]["context"]["data_points"]
+    # The cached results don't go through the search stage
+    assert first_result["choices"][0]["context"]["timings"]["search_ms"] == 1.0
+    assert "search_ms" not in result["choices"][0]["context"]["timings"]
+
+    # The filter is part of the key
+    request["context"]["overrides"]["exclude_category"] = "excluded"
+    response = await client.post("/ask", json=request)
+    assert response.status_code == 200
+    assert len(search_calls) == 2
+
+    # Re-ingesting the index clears the cached results
+    index_version = "2024-02-01T00:00:00+00:00"
+    index_version_monitor.refresh_interval = 0
+    response = await client.post("/ask", json=request)
+    assert response.status_code == 200
+    assert len(search_calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_ask_search_select(client, search_calls):
+    response = await client.post(
+        "/ask",
+        json={"messages": [{"content": "What is the capital of France?", "role": "user"}]},
+    )
+    assert response.status_code == 200
+    # Only the fields read by the approach are fetched, never the vectors
+    assert search_calls[0]["select"] == ["id", "content", "category", "sourcepage", "sourcefile"]
+
+
+@pytest.mark.asyncio
+async def test_ask_search_select_custom_fields(client, search_calls):
+    # Indexes configured with KB_FIELDS_CONTENT and KB_FIELDS_SOURCEPAGE are searched for those fields
+    approach = client.app.config[app.CONFIG_ASK_APPROACH]
+    approach.content_field = "chunk"
+    approach.sourcepage_field = "page"
+    response = await client.post(
+        "/ask",
+        json={"messages": [{"content": "What is the capital of France?", "role": "user"}]},
+    )
+    assert response.status_code == 200
+    assert search_calls[0]["select"] == ["id", "chunk", "category", "page", "sourcefile"]
+
+
+@pytest.mark.asyncio
+async def test_chat_openai_scheduler(client):
+    assert client.app.config[app.CONFIG_OPENAI_SCHEDULER] is None
+    scheduler = OpenAIScheduler(max_concurrency=4)
+    client.app.config[app.CONFIG_OPENAI_SCHEDULER] = scheduler
+    client.app.config[app.CONFIG_CHAT_APPROACH].openai_scheduler = scheduler
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "hybrid"}},
+        },
+    )
+    assert response.status_code == 200
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 0
+    # The query rewrite and the embedding of the generated query, then the answer
+    assert stats["priorities"]["interactive"]["admitted"] == 2
+    assert stats["priorities"]["answer"]["admitted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ask_degraded_retrieval(client, search_calls):
+    request = {
+        "messages": [{"content": "What is the capital of France?", "role": "user"}],
+        "context": {"overrides": {"retrieval_mode": "hybrid"}},
+    }
+
+    # Embeddings are failing, so hybrid retrieval degrades to text-only
+    embedding_policy = client.app.config[app.CONFIG_EMBEDDING_POLICY]
+    for _ in range(embedding_policy.failure_threshold):
+        embedding_policy.breaker("default").record_failure()
+    response = await client.post("/ask", json=request)
+    assert response.status_code == 200
+    assert search_calls[-1]["search_text"] == "What is the capital of France?"
+    assert search_calls[-1]["vector_queries"] == []
+
+    # Hybrid and text searches are failing, so retrieval degrades to vector-only
+    embedding_policy.breaker("default").record_success()
+    search_policy = client.app.config[app.CONFIG_SEARCH_POLICY]
+    for kind in ("hybrid", "text"):
+        for _ in range(search_policy.failure_threshold):
+            search_policy.breaker(kind).record_failure()
+    response = await client.post("/ask", json=request)
+    assert response.status_code == 200
+    assert search_calls[-1]["search_text"] == ""
+    assert len(search_calls[-1]["vector_queries"]) == 1
+
+
 @pytest.mark.asyncio
 async def test_format_as_ndjson():
     async def gen():
@@ -653,3 +978,247 @@ async def test_format_as_ndjson():
 
     result = [line async for line in app.format_as_ndjson(gen())]
     assert result == ['{"a": "I ❤️ 🐍"}\n', '{"b": "Newlines inside \\n strings are fine"}\n']
+
+
+@pytest.mark.asyncio
+async def test_chat_speculative_retrieval(client, search_calls):
+    request = {
+        "messages": [{"content": "What is the capital of France?", "role": "user"}],
+        "context": {"overrides": {"retrieval_mode": "text", "speculative_retrieval": True}},
+    }
+    # Requests can't turn it on when the server doesn't
+    response = await client.post("/chat", json=request)
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert [search["search_text"] for search in search_calls] == ["capital of France"]
+    assert "speculative_retrieval" not in result["choices"][0]["context"]["thoughts"][1]["props"]
+
+    search_calls.clear()
+    client.app.config[app.CONFIG_CHAT_APPROACH].speculative_retrieval = True
+    response = await client.post("/chat", json=request)
+    assert response.status_code == 200
+    result = await response.get_json()
+    # The generated query "capital of France" only drops words from the question, so its results are kept
+    assert [search["search_text"] for search in search_calls] == ["What is the capital of France?"]
+    thought = result["choices"][0]["context"]["thoughts"][1]
+    assert thought["description"] == "What is the capital of France?"
+    assert thought["props"]["speculative_retrieval"] is True
+
+    # Otherwise the speculative results are discarded and the generated query is searched
+    search_calls.clear()
+    client.app.config[app.CONFIG_CHAT_APPROACH].speculative_similarity = 1.1
+    response = await client.post("/chat", json=request)
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert search_calls[-1]["search_text"] == "capital of France"
+    thought = result["choices"][0]["context"]["thoughts"][1]
+    assert thought["description"] == "capital of France"
+    assert thought["props"]["speculative_retrieval"] is False
+
+    # But they can turn it off
+    search_calls.clear()
+    request["context"]["overrides"]["speculative_retrieval"] = False
+    response = await client.post("/chat", json=request)
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert [search["search_text"] for search in search_calls] == ["capital of France"]
+    assert "speculative_retrieval" not in result["choices"][0]["context"]["thoughts"][1]["props"]
+
+
+@pytest.mark.asyncio
+async def test_chat_speculative_retrieval_failed(client, monkeypatch):
+    searches = []
+    original_search = SearchClient.search
+
+    async def failing_search(self, *args, **kwargs):
+        searches.append(kwargs)
+        if len(searches) == 1:
+            raise ConnectionError("search unavailable")
+        return await original_search(self, *args, **kwargs)
+
+    monkeypatch.setattr(SearchClient, "search", failing_search)
+    client.app.config[app.CONFIG_CHAT_APPROACH].speculative_retrieval = True
+
+    # The speculative search failed, so the generated query is searched even though it is similar
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text"}},
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert [search["search_text"] for search in searches] == ["What is the capital of France?", "capital of France"]
+    thought = result["choices"][0]["context"]["thoughts"][1]
+    assert thought["description"] == "capital of France"
+    assert thought["props"]["speculative_retrieval"] is False
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_compact_coalesced():
+    async def gen():
+        yield {
+            "choices": [
+                {
+                    "delta": {"role": "assistant"},
+                    "context": {"data_points": []},
+                    "session_state": None,
+                    "finish_reason": None,
+                    "index": 0,
+                }
+            ],
+            "object": "chat.completion.chunk",
+        }
+        for content in ["The capital ", "of France ", "is Paris."]:
+            yield {
+                "choices": [
+                    {
+                        "delta": {"content": content, "function_call": None, "role": None, "tool_calls": None},
+                        "finish_reason": None,
+                        "index": 0,
+                        "logprobs": None,
+                    }
+                ],
+                "created": 1,
+                "id": "test-id",
+                "model": "gpt-35-turbo",
+                "object": "chat.completion.chunk",
+                "system_fingerprint": None,
+            }
+        await asyncio.sleep(0.05)
+        yield {"choices": [{"delta": {"content": None, "role": None}, "finish_reason": "stop", "index": 0}]}
+
+    result = [line async for line in app.format_as_ndjson(gen(), compact=True, coalesce_window=0.02)]
+    assert result == [
+        '{"choices":[{"delta":{"role":"assistant"},"context":{"data_points":[]},"session_state":null}]}\n'
+        '{"choices":[{"delta":{"content":"The capital of France is Paris."}}]}\n',
+        '{"choices":[{"delta":{},"finish_reason":"stop"}]}\n',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_coalesced_error(caplog):
+    async def gen():
+        yield {"a": 1}
+        raise ValueError("something bad happened")
+
+    result = [line async for line in app.format_as_ndjson(gen(), coalesce_window=1)]
+    assert result == ['{"a": 1}\n', json.dumps(app.error_dict(ValueError("something bad happened")))]
+    assert "Exception while generating response stream: something bad happened" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_compact(client, snapshot):
+    client.app.config[app.CONFIG_STREAM_COMPACT] = True
+    client.app.config[app.CONFIG_STREAM_COALESCE_WINDOW] = 0.01
+    response = await client.post(
+        "/chat",
+        json={
+            "stream": True,
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text", "suggest_followup_questions": True}},
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_data()
+    snapshot.assert_match(result, "result.jsonlines")
+
+
+@pytest.mark.asyncio
+async def test_chat_minimal_thought_verbosity(client):
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text", "thought_verbosity": "minimal"}},
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    context = result["choices"][0]["context"]
+    assert "thoughts" not in context
+    assert context["data_points"] == {"text": ["Benefit_Options-2.pdf"]}
+
+    response = await client.get(f"/thoughts/{context['thoughts_id']}")
+    assert response.status_code == 200
+    thoughts = await response.get_json()
+    assert [thought["title"] for thought in thoughts["thoughts"]] == [
+        "Original user query",
+        "Generated search query",
+        "Results",
+        "Prompt",
+    ]
+    assert thoughts["data_points"] == {"text": ["Benefit_Options-2.pdf: There is a whistleblower policy."]}
+
+    response = await client.get("/thoughts/unknown")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_minimal_thought_verbosity(client):
+    response = await client.post(
+        "/chat",
+        json={
+            "stream": True,
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text", "thought_verbosity": "minimal"}},
+        },
+    )
+    assert response.status_code == 200
+    events = [json.loads(line) for line in (await response.get_data(as_text=True)).splitlines()]
+    context = events[0]["choices"][0]["context"]
+    assert "thoughts" not in context
+    response = await client.get(f"/thoughts/{context['thoughts_id']}")
+    assert response.status_code == 200
+    assert len((await response.get_json())["thoughts"]) == 4
+
+
+@pytest.mark.asyncio
+async def test_metrics(client):
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "hybrid"}},
+        },
+    )
+    assert response.status_code == 200
+    client.app.config[app.CONFIG_METRICS_ENABLED] = True
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    metrics = await response.get_data(as_text=True)
+    pid = f'pid="{os.getpid()}"'
+    for stage in ("rewrite", "embedding", "search", "completion"):
+        assert (
+            f'rag_stage_duration_seconds_count{{{pid},approach="ChatReadRetrieveReadApproach",stage="{stage}"}}'
+            in metrics
+        )
+    assert f'rag_openai_tokens_total{{{pid},approach="ChatReadRetrieveReadApproach",type="embedding"}}' in metrics
+    assert f'rag_http_requests_total{{{pid},route="/chat",status="200"}}' in metrics
+    assert f'rag_cache_hit_ratio{{{pid},cache="embedding"}}' in metrics
+    assert f"rag_admission_in_flight{{{pid}}} 0.0" in metrics
+    assert f'rag_dependency_calls_total{{{pid},dependency="search"}}' in metrics
+
+
+@pytest.mark.asyncio
+async def test_metrics_disabled_by_default(client):
+    response = await client.get("/metrics")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_chat_server_timing(client):
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "hybrid"}},
+        },
+    )
+    assert response.status_code == 200
+    # The test clock moves 1ms per reading, and each stage reads it once when it starts and once when it ends
+    assert response.headers["Server-Timing"] == (
+        "rewrite;dur=1.0, embedding;dur=1.0, search;dur=1.0, completion;dur=1.0"
+    )
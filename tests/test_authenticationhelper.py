@@ -1,3 +1,9 @@
+import base64
+import json
+import threading
+import time
+
+import msal
 import pytest
 from azure.search.documents.indexes.models import SearchField, SearchIndex
 
@@ -184,3 +190,90 @@ def test_build_security_filters(mock_confidential_client_success):
         )
         == "oids/any(g:search.in(g, ''))"
     )
+
+
+@pytest.mark.asyncio
+async def test_get_auth_claims_off_event_loop(monkeypatch, mock_confidential_client_success):
+    threads = []
+
+    def mock_acquire_token_on_behalf_of(self, *args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return {"access_token": "MockToken", "id_token_claims": {"oid": "OID_X", "groups": ["GROUP_Y"]}}
+
+    monkeypatch.setattr(
+        msal.ConfidentialClientApplication, "acquire_token_on_behalf_of", mock_acquire_token_on_behalf_of
+    )
+    helper = create_authentication_helper()
+    auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer Token"})
+    assert auth_claims == {"oid": "OID_X", "groups": ["GROUP_Y"]}
+    assert threads[0].startswith("msal-obo")
+    helper.close()
+
+
+@pytest.mark.asyncio
+async def test_get_auth_claims_timeout(monkeypatch, mock_confidential_client_success):
+    def mock_acquire_token_on_behalf_of(self, *args, **kwargs):
+        time.sleep(0.2)
+        return {"access_token": "MockToken", "id_token_claims": {"oid": "OID_X", "groups": ["GROUP_Y"]}}
+
+    monkeypatch.setattr(
+        msal.ConfidentialClientApplication, "acquire_token_on_behalf_of", mock_acquire_token_on_behalf_of
+    )
+    helper = create_authentication_helper()
+    helper.obo_timeout = 0.01
+    assert await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer Token"}) == {}
+
+    helper = create_authentication_helper(require_access_control=True)
+    helper.obo_timeout = 0.01
+    with pytest.raises(AuthError) as exc_info:
+        await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer Token"})
+    assert exc_info.value.status_code == 504
+
+
+def create_token(claims: dict) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    return f"header.{payload}.signature"
+
+
+@pytest.mark.asyncio
+async def test_get_auth_claims_cached_until_token_expires(monkeypatch, mock_confidential_client_success):
+    calls = []
+
+    def mock_acquire_token_on_behalf_of(self, *args, **kwargs):
+        calls.append(kwargs["user_assertion"])
+        return {"access_token": "MockToken", "id_token_claims": {"oid": "OID_X", "groups": ["GROUP_Y"]}}
+
+    monkeypatch.setattr(
+        msal.ConfidentialClientApplication, "acquire_token_on_behalf_of", mock_acquire_token_on_behalf_of
+    )
+    helper = create_authentication_helper()
+    token = create_token({"oid": "OID_X", "exp": time.time() + 3600})
+    for _ in range(2):
+        auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": f"Bearer {token}"})
+        assert auth_claims == {"oid": "OID_X", "groups": ["GROUP_Y"]}
+    assert len(calls) == 1
+
+    # Expired tokens and tokens without an expiration are never cached
+    expired_token = create_token({"oid": "OID_X", "exp": time.time() - 1})
+    await helper.get_auth_claims_if_enabled(headers={"Authorization": f"Bearer {expired_token}"})
+    await helper.get_auth_claims_if_enabled(headers={"Authorization": f"Bearer {expired_token}"})
+    await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer Token"})
+    await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer Token"})
+    assert len(calls) == 5
+
+
+@pytest.mark.asyncio
+async def test_get_auth_claims_overage_groups_cached(monkeypatch, mock_confidential_client_overage):
+    list_groups_calls = []
+
+    async def mock_list_groups(graph_resource_access_token, http_session=None):
+        list_groups_calls.append(graph_resource_access_token)
+        return ["OVERAGE_GROUP_Y", "OVERAGE_GROUP_Z"]
+
+    monkeypatch.setattr(AuthenticationHelper, "list_groups", mock_list_groups)
+    helper = create_authentication_helper()
+    # Each token is a new OBO exchange, but the groups of the same user are only read once from Graph
+    for token in ["Token1", "Token2"]:
+        auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": f"Bearer {token}"})
+        assert auth_claims == {"oid": "OID_X", "groups": ["OVERAGE_GROUP_Y", "OVERAGE_GROUP_Z"]}
+    assert len(list_groups_calls) == 1
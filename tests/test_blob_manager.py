@@ -3,6 +3,7 @@ import sys
 from tempfile import NamedTemporaryFile
 
 import pytest
+from azure.storage.blob import ContainerProperties
 
 from .mocks import MockAzureCredential
 from scripts.prepdocslib.blobmanager import BlobManager
@@ -171,3 +172,30 @@ def test_sourcepage_from_file_page():
 def test_blob_name_from_file_name():
     assert BlobManager.blob_name_from_file_name("tmp/test.pdf") == "test.pdf"
     assert BlobManager.blob_name_from_file_name("tmp/test.html") == "test.html"
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(sys.version_info.minor < 10, reason="requires Python 3.10 or higher")
+async def test_update_index_version(monkeypatch, mock_env, blob_manager):
+    async def mock_exists(*args, **kwargs):
+        return True
+
+    monkeypatch.setattr("azure.storage.blob.aio.ContainerClient.exists", mock_exists)
+
+    async def mock_get_container_properties(*args, **kwargs):
+        return ContainerProperties(metadata={"owner": "prepdocs", "index_version": "old"})
+
+    monkeypatch.setattr(
+        "azure.storage.blob.aio.ContainerClient.get_container_properties", mock_get_container_properties
+    )
+
+    updated_metadata = {}
+
+    async def mock_set_container_metadata(self, metadata, *args, **kwargs):
+        updated_metadata.update(metadata)
+
+    monkeypatch.setattr("azure.storage.blob.aio.ContainerClient.set_container_metadata", mock_set_container_metadata)
+
+    await blob_manager.update_index_version()
+    assert updated_metadata["owner"] == "prepdocs"
+    assert updated_metadata["index_version"] != "old"
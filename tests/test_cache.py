@@ -0,0 +1,64 @@
+from core.cache import LRUCache
+
+
+def test_lrucache_get_set():
+    cache = LRUCache[str](max_size=2)
+    assert cache.get("a") is None
+    cache.set("a", "apple")
+    assert cache.get("a") == "apple"
+    assert "a" in cache
+    assert len(cache) == 1
+    assert cache.stats() == {
+        "entries": 1,
+        "size": 1,
+        "max_size": 2,
+        "hits": 1,
+        "misses": 1,
+        "evictions": 0,
+        "hit_ratio": 0.5,
+    }
+
+
+def test_lrucache_evicts_least_recently_used():
+    cache = LRUCache[str](max_size=2)
+    cache.set("a", "apple")
+    cache.set("b", "banana")
+    cache.get("a")
+    cache.set("c", "cherry")
+    assert cache.get("b") is None
+    assert cache.get("a") == "apple"
+    assert cache.get("c") == "cherry"
+    assert cache.evictions == 1
+
+
+def test_lrucache_byte_budget():
+    cache = LRUCache[bytes](max_size=10, sizeof=len)
+    cache.set("a", b"12345")
+    cache.set("b", b"123456")
+    assert "a" not in cache
+    assert cache.size == 6
+    # Values larger than the whole budget are never stored
+    cache.set("c", b"12345678901")
+    assert "c" not in cache
+    assert cache.get("b") == b"123456"
+    cache.set("b", b"12")
+    assert cache.size == 2
+    assert cache.pop("b") == b"12"
+    assert cache.size == 0
+
+
+def test_lrucache_ttl(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("core.cache.time.monotonic", lambda: now)
+    cache = LRUCache[str](max_size=10, ttl=60)
+    cache.set("a", "apple")
+    cache.set("b", "banana", ttl=120)
+    now = 1059.0
+    assert cache.get("a") == "apple"
+    now = 1060.0
+    assert cache.get("a") is None
+    assert "a" not in cache
+    assert cache.get("b") == "banana"
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
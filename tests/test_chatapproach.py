@@ -209,3 +209,19 @@ def test_get_messages_from_history_few_shots(chat_approach):
     assert messages[4]["role"] == "assistant"
     assert messages[5]["role"] == "user"
     assert messages[5]["content"] == user_query_request
+
+
+def test_is_similar_query(chat_approach):
+    assert chat_approach.is_similar_query("capital of France", "What is the capital of France?")
+    assert chat_approach.is_similar_query("Capital, France!", "what's the capital of france")
+    assert not chat_approach.is_similar_query("dental coverage Northwind Plus", "What about dental?")
+    assert not chat_approach.is_similar_query("0", "")
+    assert not chat_approach.is_similar_query("", "What about dental?")
+
+
+def test_get_prompt_token_count(chat_approach):
+    assert chat_approach.get_prompt_token_count("You are a bot.", "gpt-35-turbo") == 8
+    assert (
+        chat_approach.get_prompt_token_count("You are a bot.", "gpt-35-turbo", chat_approach.query_prompt_few_shots)
+        == 8 + 39
+    )
@@ -1,4 +1,6 @@
+import asyncio
 import json
+from array import array
 
 import pytest
 from azure.search.documents.indexes.models import SearchField, SearchIndex
@@ -9,6 +11,8 @@ from openai.types.chat import ChatCompletion
 
 from approaches.chatreadretrievereadvision import ChatReadRetrieveReadVisionApproach
 from core.authentication import AuthenticationHelper
+from core.cache import LRUCache
+from core.resilience import ResiliencePolicy
 
 
 class MockOpenAIClient:
@@ -85,3 +89,100 @@ async def test_compute_text_embedding(chat_approach, openai_client, mock_openai_
     assert result.vector == [0.0023064255, -0.009327292, -0.0028842222]
     assert result.k == 50
     assert result.fields == "embedding"
+
+
+@pytest.mark.asyncio
+async def test_compute_text_embedding_cached(chat_approach, openai_client, mock_openai_embedding):
+    mock_openai_embedding(openai_client)
+    chat_approach.embedding_cache = LRUCache[array](max_size=1024, sizeof=lambda vector: vector.itemsize * len(vector))
+
+    result = await chat_approach.compute_text_embedding("test query")
+    assert result.vector == [0.0023064255, -0.009327292, -0.0028842222]
+    assert chat_approach.embedding_cache.size == 12
+
+    async def mock_create_not_called(*args, **kwargs):
+        raise AssertionError("The embedding should come from the cache")
+
+    openai_client.create = mock_create_not_called
+    result = await chat_approach.compute_text_embedding("test query")
+    assert result.vector == pytest.approx([0.0023064255, -0.009327292, -0.0028842222])
+    assert result.fields == "embedding"
+    assert chat_approach.embedding_cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_compute_image_embedding_cached(chat_approach, mock_compute_embeddings_call):
+    chat_approach.embedding_cache = LRUCache[array](max_size=1024)
+
+    result = await chat_approach.compute_image_embedding("test query", "endpoint/", "key")
+    assert result.fields == "imageEmbedding"
+    assert len(result.vector) == 9
+    result = await chat_approach.compute_image_embedding("test query", "endpoint/", "key")
+    assert result.vector == pytest.approx(
+        [
+            0.011925711,
+            0.023533698,
+            0.010133852,
+            0.0063544377,
+            -0.00038590943,
+            0.0013952175,
+            0.009054946,
+            -0.033573493,
+            -0.002028305,
+        ]
+    )
+    assert chat_approach.embedding_cache.hits == 1
+    assert chat_approach.embedding_cache.misses == 1
+
+
+@pytest.mark.asyncio
+async def test_compute_vectors_concurrently(chat_approach, monkeypatch):
+    both_started = asyncio.Event()
+    started = []
+
+    async def mock_embedding(field):
+        started.append(field)
+        if len(started) == 2:
+            both_started.set()
+        # Only completes if the other embedding was started before this one finished
+        await both_started.wait()
+        return RawVectorQuery(vector=[0.1], k=50, fields=field)
+
+    monkeypatch.setattr(chat_approach, "compute_text_embedding", lambda q: mock_embedding("embedding"))
+    monkeypatch.setattr(
+        chat_approach, "compute_image_embedding", lambda q, endpoint, key: mock_embedding("imageEmbedding")
+    )
+    chat_approach.embedding_timeout = 1
+
+    vectors = await chat_approach.compute_vectors("test query", ["imageEmbedding", "embedding"], "endpoint/", "key")
+    assert [vector.fields for vector in vectors] == ["imageEmbedding", "embedding"]
+
+
+@pytest.mark.asyncio
+async def test_compute_vectors_timeout(chat_approach, monkeypatch):
+    async def mock_slow_embedding(q, endpoint, key):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(chat_approach, "compute_image_embedding", mock_slow_embedding)
+    chat_approach.embedding_timeout = 0.01
+
+    with pytest.raises(asyncio.TimeoutError):
+        await chat_approach.compute_vectors("test query", ["imageEmbedding"], "endpoint/", "key")
+
+
+@pytest.mark.asyncio
+async def test_compute_vectors_timeout_counts_against_breaker(chat_approach, openai_client, monkeypatch):
+    async def mock_slow_create(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(openai_client, "create", mock_slow_create)
+    chat_approach.embedding_timeout = 0.01
+    chat_approach.embedding_policy = ResiliencePolicy(
+        "Embedding", timeout=0.01, hedge_percentile=0, failure_threshold=1
+    )
+
+    with pytest.raises(asyncio.TimeoutError):
+        await chat_approach.compute_vectors("test query", ["embedding"], "endpoint/", "key")
+    # The policy owns the deadline of text embeddings, so the timeout opens its breaker
+    assert chat_approach.embedding_policy.stats()["timeouts"] == 1
+    assert not chat_approach.embedding_policy.allows()
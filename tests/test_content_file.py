@@ -11,68 +11,81 @@ from azure.core.pipeline.transport import (
 from azure.storage.blob.aio import BlobServiceClient
 
 import app
+from core.httpsessions import SharedHttpSessions
 
 from .mocks import MockAzureCredential
 
 
-@pytest.mark.asyncio
-async def test_content_file(monkeypatch, mock_env, mock_acs_search):
-    class MockAiohttpClientResponse404(aiohttp.ClientResponse):
-        def __init__(self, url, body_bytes, headers=None):
-            self._body = body_bytes
-            self._headers = headers
-            self._cache = {}
-            self.status = 404
-            self.reason = "Not Found"
-            self._url = url
-
-    class MockAiohttpClientResponse(aiohttp.ClientResponse):
-        def __init__(self, url, body_bytes, headers=None):
-            self._body = body_bytes
-            self._headers = headers
-            self._cache = {}
-            self.status = 200
-            self.reason = "OK"
-            self._url = url
-
-    class MockTransport(AsyncHttpTransport):
-        async def send(self, request: HttpRequest, **kwargs) -> AioHttpTransportResponse:
-            if request.url.endswith("notfound.pdf"):
-                raise ResourceNotFoundError(MockAiohttpClientResponse404(request.url, b""))
-            else:
-                return AioHttpTransportResponse(
-                    request,
-                    MockAiohttpClientResponse(
-                        request.url,
-                        b"test content",
-                        {
-                            "Content-Type": "application/octet-stream",
-                            "Content-Range": "bytes 0-27/28",
-                            "Content-Length": "28",
-                        },
-                    ),
-                )
-
-        async def __aenter__(self):
-            return self
-
-        async def __aexit__(self, *args):
-            pass
-
-        async def open(self):
-            pass
-
-        async def close(self):
-            pass
-
-    # Then we can plug this into any SDK via kwargs:
+class MockAiohttpClientResponse(aiohttp.ClientResponse):
+    def __init__(self, url, body_bytes, headers=None, status=200, reason="OK"):
+        self._body = body_bytes
+        self._headers = headers
+        self._cache = {}
+        self.status = status
+        self.reason = reason
+        self._url = url
+
+
+class MockTransport(AsyncHttpTransport):
+    def __init__(self, content=b"test content", etag='"0x8DBF0000000001"'):
+        self.content = content
+        self.etag = etag
+        self.requests = []
+
+    async def send(self, request: HttpRequest, **kwargs) -> AioHttpTransportResponse:
+        self.requests.append(request)
+        if request.url.endswith("notfound.pdf"):
+            raise ResourceNotFoundError(MockAiohttpClientResponse(request.url, b"", status=404, reason="Not Found"))
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "ETag": self.etag,
+            "Last-Modified": "Tue, 02 Jan 2024 10:00:00 GMT",
+        }
+        if request.headers.get("If-None-Match") == self.etag:
+            return AioHttpTransportResponse(
+                request, MockAiohttpClientResponse(request.url, b"", headers, status=304, reason="Not Modified")
+            )
+        # Honor the byte range requested by the blob downloader, like the real service does
+        start, end = 0, len(self.content) - 1
+        if request.headers.get("x-ms-range"):
+            start, end = (int(x) for x in request.headers["x-ms-range"].split("=")[1].split("-"))
+            end = min(end, len(self.content) - 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(self.content)}"
+        headers["Content-Length"] = str(end + 1 - start)
+        return AioHttpTransportResponse(
+            request,
+            MockAiohttpClientResponse(
+                request.url, self.content[start : end + 1] if request.method == "GET" else b"", headers
+            ),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+def create_blob_container_client(transport: MockTransport):
+    # The mock transport can be plugged into any SDK via kwargs
     blob_client = BlobServiceClient(
         f"https://{os.environ['AZURE_STORAGE_ACCOUNT']}.blob.core.windows.net",
         credential=MockAzureCredential(),
-        transport=MockTransport(),
+        transport=transport,
         retry_total=0,  # Necessary to avoid unnecessary network requests during tests
     )
-    blob_container_client = blob_client.get_container_client(os.environ["AZURE_STORAGE_CONTAINER"])
+    return blob_client.get_container_client(os.environ["AZURE_STORAGE_CONTAINER"])
+
+
+@pytest.mark.asyncio
+async def test_content_file(monkeypatch, mock_env, mock_acs_search):
+    blob_container_client = create_blob_container_client(MockTransport())
 
     quart_app = app.create_app()
     async with quart_app.test_app() as test_app:
@@ -91,3 +104,118 @@ async def test_content_file(monkeypatch, mock_env, mock_acs_search):
         assert response.status_code == 200
         assert response.headers["Content-Type"] == "application/pdf"
         assert await response.get_data() == b"test content"
+
+        response = await client.get("/content/role_library.pdf", headers={"Range": "bytes=5-11"})
+        assert response.status_code == 206
+        assert response.headers["Content-Type"] == "application/pdf"
+        assert response.headers["Content-Range"] == "bytes 5-11/12"
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert await response.get_data() == b"content"
+
+        response = await client.get("/content/role_library.pdf", headers={"Range": "bytes=5-"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "bytes 5-11/12"
+        assert await response.get_data() == b"content"
+
+        response = await client.get("/content/role_library.pdf", headers={"Range": "bytes=-7"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "bytes 5-11/12"
+        assert await response.get_data() == b"content"
+
+
+@pytest.mark.asyncio
+async def test_content_file_streamed_range(monkeypatch, mock_env, mock_acs_search):
+    monkeypatch.setenv("CONTENT_CACHE_MAX_ENTRY_BYTES", "0")
+    transport = MockTransport()
+    blob_container_client = create_blob_container_client(transport)
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        quart_app.config.update({"blob_container_client": blob_container_client})
+
+        client = test_app.test_client()
+        response = await client.get("/content/role_library.pdf", headers={"Range": "bytes=5-11"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "bytes 5-11/12"
+        assert response.headers["Content-Length"] == "7"
+        assert await response.get_data() == b"content"
+        assert transport.requests[-1].headers["x-ms-range"] == "bytes=5-11"
+
+        response = await client.get("/content/role_library.pdf", headers={"Range": "bytes=-7"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "bytes 5-11/12"
+        assert await response.get_data() == b"content"
+
+        response = await client.get("/content/role_library.pdf")
+        assert response.status_code == 200
+        assert response.headers["ETag"] == '"0x8DBF0000000001"'
+        assert await response.get_data() == b"test content"
+        assert len(quart_app.config[app.CONFIG_CONTENT_CACHE]) == 0
+
+        # Storage answers the client's ETag with 304, so nothing is downloaded again
+        response = await client.get("/content/role_library.pdf", headers={"If-None-Match": '"0x8DBF0000000001"'})
+        assert response.status_code == 304
+        assert transport.requests[-1].headers["If-None-Match"] == '"0x8DBF0000000001"'
+        assert await response.get_data() == b""
+
+
+@pytest.mark.asyncio
+async def test_content_file_cached(monkeypatch, mock_env, mock_acs_search):
+    transport = MockTransport()
+    blob_container_client = create_blob_container_client(transport)
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        quart_app.config.update({"blob_container_client": blob_container_client})
+
+        client = test_app.test_client()
+        response = await client.get("/content/role_library.pdf")
+        assert response.status_code == 200
+        assert response.headers["ETag"] == '"0x8DBF0000000001"'
+        assert response.headers["Last-Modified"] == "Tue, 02 Jan 2024 10:00:00 GMT"
+        assert await response.get_data() == b"test content"
+        assert len(transport.requests) == 1
+
+        # Served from the cache without going back to storage
+        response = await client.get("/content/role_library.pdf")
+        assert response.status_code == 200
+        assert await response.get_data() == b"test content"
+        response = await client.get("/content/role_library.pdf", headers={"If-None-Match": '"0x8DBF0000000001"'})
+        assert response.status_code == 304
+        assert await response.get_data() == b""
+        assert len(transport.requests) == 1
+
+        # Once stale, the entry is revalidated by ETag and kept if the blob did not change
+        quart_app.config[app.CONFIG_CONTENT_REVALIDATE] = 0
+        response = await client.get("/content/role_library.pdf")
+        assert await response.get_data() == b"test content"
+        assert len(transport.requests) == 2
+        assert transport.requests[-1].method == "HEAD"
+
+        # A new ETag means the blob was re-uploaded, so it is downloaded again
+        transport.content = b"new content"
+        transport.etag = '"0x8DBF0000000002"'
+        response = await client.get("/content/role_library.pdf")
+        assert response.headers["ETag"] == '"0x8DBF0000000002"'
+        assert await response.get_data() == b"new content"
+        assert len(transport.requests) == 4
+
+
+@pytest.mark.asyncio
+async def test_content_file_downloaded_in_chunks(monkeypatch, mock_env, mock_acs_search):
+    monkeypatch.setenv("CONTENT_CACHE_MAX_ENTRY_BYTES", "0")
+    monkeypatch.setenv("CONTENT_DOWNLOAD_CHUNK_BYTES", "5")
+    transport = MockTransport()
+    monkeypatch.setattr(SharedHttpSessions, "azure_transport", lambda self: transport)
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        client = test_app.test_client()
+        response = await client.get("/content/role_library.pdf")
+        assert response.status_code == 200
+        assert await response.get_data() == b"test content"
+        # The blob client of the app only buffers the first chunk before streaming starts
+        downloads = [
+            request.headers.get("x-ms-range") for request in transport.requests if "role_library" in request.url
+        ]
+        assert downloads == ["bytes=0-4", "bytes=5-9", "bytes=10-11"]
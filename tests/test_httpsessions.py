@@ -0,0 +1,43 @@
+import pytest
+
+import app
+from core.httpsessions import SharedHttpSessions
+
+
+@pytest.mark.asyncio
+async def test_shared_http_sessions_share_connector():
+    http_sessions = SharedHttpSessions(limit=10, limit_per_host=5, keepalive_timeout=15)
+    assert http_sessions.session.connector is http_sessions.connector
+    assert http_sessions.azure_session.connector is http_sessions.connector
+    assert http_sessions.azure_transport().session is http_sessions.azure_session
+    assert http_sessions.stats() == {
+        "limit": 10,
+        "limit_per_host": 5,
+        "requests_in_flight": 0,
+        "connections_created": 0,
+        "connections_reused": 0,
+        "reuse_ratio": 0.0,
+        "requests_queued": 0,
+        "queue_wait_seconds": 0.0,
+    }
+
+    await http_sessions.close()
+    assert http_sessions.session.closed
+    assert http_sessions.azure_session.closed
+    assert http_sessions.connector.closed
+    assert http_sessions.openai_http_client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_app_uses_shared_http_sessions(monkeypatch, mock_env, mock_acs_search):
+    monkeypatch.setenv("HTTP_POOL_MAX_CONNECTIONS", "20")
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        http_sessions = quart_app.config[app.CONFIG_HTTP_SESSIONS]
+        assert http_sessions.connector.limit == 20
+        assert quart_app.config[app.CONFIG_AUTH_CLIENT].http_session is http_sessions.session
+        if quart_app.config[app.CONFIG_GPT4V_DEPLOYED]:
+            async with quart_app.app_context():
+                assert app.get_approach(app.CONFIG_ASK_VISION_APPROACH).http_session is http_sessions.session
+                assert app.get_approach(app.CONFIG_CHAT_VISION_APPROACH).http_session is http_sessions.session
+    assert http_sessions.session.closed
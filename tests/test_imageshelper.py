@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError
+
+from approaches.approach import Document
+from core.imageshelper import ImageCache, download_blob_as_base64, fetch_images
+
+
+class MockImageBlob:
+    def __init__(self, name, content=None, etag=None):
+        self.name = name
+        self.content = content or name.encode()
+        self.properties = {"name": name, "etag": etag}
+
+    async def readall(self):
+        return self.content
+
+
+class MockImageBlobClient:
+    def __init__(self, container_client, name):
+        self.container_client = container_client
+        self.name = name
+
+    async def download_blob(self):
+        self.container_client.in_flight += 1
+        self.container_client.max_in_flight = max(self.container_client.max_in_flight, self.container_client.in_flight)
+        await asyncio.sleep(self.container_client.delays[self.name])
+        self.container_client.in_flight -= 1
+        return MockImageBlob(self.name)
+
+
+class MockImageContainerClient:
+    def __init__(self, delays):
+        self.delays = delays
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get_blob_client(self, name):
+        return MockImageBlobClient(self, name)
+
+
+def create_document(sourcepage):
+    return Document(
+        id=None,
+        content=None,
+        embedding=None,
+        image_embedding=None,
+        category=None,
+        sourcepage=sourcepage,
+        sourcefile=None,
+        oids=None,
+        groups=None,
+        captions=[],
+    )
+
+
+@pytest.mark.asyncio
+async def test_fetch_images_bounded_and_ordered():
+    # Later pages finish first, the images must still come back in the order of the results
+    container_client = MockImageContainerClient({"a.png": 0.03, "b.png": 0.01, "c.png": 0.02, "d.png": 0})
+    results = [create_document(page) for page in ["a.pdf#page=1", None, "b.pdf", "c.pdf", "d.pdf"]]
+
+    images = await fetch_images(container_client, results, max_concurrency=2)
+
+    assert images == [
+        {"url": "data:image/png;base64,YS5wbmc=", "detail": "auto"},
+        None,
+        {"url": "data:image/png;base64,Yi5wbmc=", "detail": "auto"},
+        {"url": "data:image/png;base64,Yy5wbmc=", "detail": "auto"},
+        {"url": "data:image/png;base64,ZC5wbmc=", "detail": "auto"},
+    ]
+    assert container_client.max_in_flight == 2
+
+
+class MockVersionedBlobClient:
+    def __init__(self):
+        self.content = b"page"
+        self.etag = '"0x1"'
+        self.downloads = []
+
+    async def download_blob(self, **kwargs):
+        self.downloads.append(kwargs)
+        if kwargs.get("match_condition") == MatchConditions.IfModified and kwargs.get("etag") == self.etag:
+            error = HttpResponseError("The condition specified using HTTP conditional header(s) is not met.")
+            error.status_code = 304
+            raise error
+        return MockImageBlob("a.png", self.content, self.etag)
+
+
+class MockVersionedContainerClient:
+    def __init__(self):
+        self.blob_client = MockVersionedBlobClient()
+
+    def get_blob_client(self, name):
+        return self.blob_client
+
+
+@pytest.mark.asyncio
+async def test_download_blob_as_base64_cached(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("core.imageshelper.time.monotonic", lambda: now)
+    container_client = MockVersionedContainerClient()
+    blob_client = container_client.blob_client
+    image_cache = ImageCache(max_size=1024, revalidate_interval=60)
+
+    assert await download_blob_as_base64(container_client, "a.pdf", image_cache) == "data:image/png;base64,cGFnZQ=="
+    assert await download_blob_as_base64(container_client, "a.pdf", image_cache) == "data:image/png;base64,cGFnZQ=="
+    assert len(blob_client.downloads) == 1
+    assert image_cache.cache.stats()["hits"] == 1
+    assert image_cache.cache.size == len("data:image/png;base64,cGFnZQ==")
+
+    # Once stale, the image is only downloaded again if its ETag changed
+    now = 1061.0
+    assert await download_blob_as_base64(container_client, "a.pdf", image_cache) == "data:image/png;base64,cGFnZQ=="
+    assert blob_client.downloads[-1] == {"etag": '"0x1"', "match_condition": MatchConditions.IfModified}
+
+    now = 1122.0
+    blob_client.content = b"new page"
+    blob_client.etag = '"0x2"'
+    assert await download_blob_as_base64(container_client, "a.pdf", image_cache) == "data:image/png;base64,bmV3IHBhZ2U="
+    assert image_cache.cache.get("a.png").etag == '"0x2"'
+    assert len(blob_client.downloads) == 3
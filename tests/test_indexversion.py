@@ -0,0 +1,54 @@
+import pytest
+from azure.storage.blob import ContainerProperties
+
+from core.cache import LRUCache
+from core.indexversion import IndexVersionMonitor
+
+
+class MockContainerClient:
+    def __init__(self):
+        self.metadata = {"index_version": "v1"}
+        self.calls = 0
+
+    async def get_container_properties(self):
+        self.calls += 1
+        if self.metadata is None:
+            raise Exception("Storage unavailable")
+        return ContainerProperties(metadata=self.metadata)
+
+
+@pytest.mark.asyncio
+async def test_index_version_monitor():
+    container_client = MockContainerClient()
+    cache = LRUCache[str](max_size=10)
+    monitor = IndexVersionMonitor(container_client, caches=[cache], refresh_interval=60)
+
+    await monitor.refresh()
+    assert monitor.index_version == "v1"
+    cache.set("answer", "Paris")
+
+    # The version is only read again once the refresh interval has passed
+    container_client.metadata = {"index_version": "v2"}
+    await monitor.refresh()
+    assert container_client.calls == 1
+    assert "answer" in cache
+
+    monitor.refresh_interval = 0
+    await monitor.refresh()
+    assert monitor.index_version == "v2"
+    assert "answer" not in cache
+
+    # Cached data is kept when the version can't be read
+    cache.set("answer", "Paris")
+    container_client.metadata = None
+    await monitor.refresh()
+    assert monitor.index_version == "v2"
+    assert "answer" in cache
+
+
+@pytest.mark.asyncio
+async def test_index_version_monitor_without_caches():
+    container_client = MockContainerClient()
+    monitor = IndexVersionMonitor(container_client, caches=[])
+    await monitor.refresh()
+    assert container_client.calls == 0
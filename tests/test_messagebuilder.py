@@ -23,6 +23,7 @@ def test_messagebuilder_append():
     assert builder.model == "gpt-35-turbo"
     assert builder.count_tokens_for_message(builder.messages[0]) == 8
     assert builder.count_tokens_for_message(builder.messages[1]) == 9
+    assert builder.token_count == 17
 
 
 def test_messagebuilder_unicode():
@@ -47,3 +48,17 @@ def test_messagebuilder_unicode_append():
     assert builder.model == "gpt-35-turbo"
     assert builder.count_tokens_for_message(builder.messages[0]) == 4
     assert builder.count_tokens_for_message(builder.messages[1]) == 4
+
+
+def test_messagebuilder_insert_messages():
+    builder = MessageBuilder("You are a bot.", "gpt-35-turbo")
+    builder.insert_message("user", "What does a Product Manager do?")
+    builder.insert_messages(
+        [{"role": "user", "content": "Is there a dress code?"}, {"role": "assistant", "content": "Yes."}]
+    )
+    assert builder.messages == [
+        {"role": "system", "content": "You are a bot."},
+        {"role": "user", "content": "Is there a dress code?"},
+        {"role": "assistant", "content": "Yes."},
+        {"role": "user", "content": "What does a Product Manager do?"},
+    ]
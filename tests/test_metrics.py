@@ -0,0 +1,124 @@
+import asyncio
+import os
+
+import pytest
+
+from core.metrics import (
+    Counter,
+    Histogram,
+    add_request_timings,
+    format_labels,
+    format_server_timing,
+    measure_stage,
+    observe_stage,
+    record_usage,
+    render_stats,
+    request_timings_ms,
+    start_request_timings,
+)
+
+# Every sample is labelled with the worker it comes from
+PID = f'pid="{os.getpid()}"'
+
+
+def test_histogram_render():
+    histogram = Histogram("stage_seconds", "Stage duration.", labelnames=("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, stage="search")
+    histogram.observe(0.5, stage="search")
+    histogram.observe(5, stage="search")
+    assert list(histogram.render()) == [
+        "# HELP stage_seconds Stage duration.",
+        "# TYPE stage_seconds histogram",
+        f'stage_seconds_bucket{{{PID},stage="search",le="0.1"}} 1',
+        f'stage_seconds_bucket{{{PID},stage="search",le="1.0"}} 2',
+        f'stage_seconds_bucket{{{PID},stage="search",le="+Inf"}} 3',
+        f'stage_seconds_sum{{{PID},stage="search"}} 5.55',
+        f'stage_seconds_count{{{PID},stage="search"}} 3',
+    ]
+
+
+def test_counter_render():
+    counter = Counter("tokens", "Tokens used.", labelnames=("type",))
+    counter.inc(3, type="prompt")
+    counter.inc(4, type="prompt")
+    assert list(counter.render()) == [
+        "# HELP tokens_total Tokens used.",
+        "# TYPE tokens_total counter",
+        f'tokens_total{{{PID},type="prompt"}} 7.0',
+    ]
+
+
+def test_format_labels_escapes_values():
+    assert format_labels((("path", 'a"b\\c\nd'),)) == '{path="a\\"b\\\\c\\nd"}'
+    assert format_labels(()) == ""
+
+
+def test_measure_stage_records_on_error():
+    from core.metrics import STAGE_SECONDS
+
+    try:
+        with measure_stage("TestApproach", "failing"):
+            raise ValueError()
+    except ValueError:
+        pass
+    counts, _ = STAGE_SECONDS.values[(("approach", "TestApproach"), ("stage", "failing"))]
+    assert sum(counts) == 1
+
+
+def test_record_usage_without_usage():
+    record_usage("TestApproach", None)
+
+
+def test_render_stats():
+    lines = list(
+        render_stats(
+            "cache",
+            [({"cache": "a"}, {"hits": 1, "hit_ratio": 0.5, "name": "ignored"}), ({"cache": "b"}, {"hits": 2})],
+        )
+    )
+    assert lines == [
+        "# TYPE cache_hits_total counter",
+        f'cache_hits_total{{{PID},cache="a"}} 1.0',
+        f'cache_hits_total{{{PID},cache="b"}} 2.0',
+        "# TYPE cache_hit_ratio gauge",
+        f'cache_hit_ratio{{{PID},cache="a"}} 0.5',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_request_timings():
+    async def observe_embedding():
+        observe_stage("TestApproach", "embedding", 0.002)
+        observe_stage("TestApproach", "embedding", 0.003)
+
+    async def handle_request(search_seconds: float):
+        timings = start_request_timings()
+        observe_stage("TestApproach", "search", search_seconds)
+        # Tasks started by the request add to its timings
+        await asyncio.create_task(observe_embedding())
+        return timings, request_timings_ms(), request_timings_ms("search")
+
+    (timings, timings_ms, search_ms), (other_timings, _, _) = await asyncio.gather(
+        handle_request(0.01), handle_request(0.02)
+    )
+    assert timings == {"search": 0.01, "embedding": 0.005}
+    assert other_timings == {"search": 0.02, "embedding": 0.005}
+    assert timings_ms == {"embedding_ms": 5.0, "search_ms": 10.0}
+    assert search_ms == {"search_ms": 10.0}
+    assert format_server_timing(timings) == "search;dur=10.0, embedding;dur=5.0"
+
+
+@pytest.mark.asyncio
+async def test_add_request_timings():
+    async def speculate():
+        # A task that starts its own timings doesn't add to the request's
+        speculative_timings = start_request_timings()
+        observe_stage("TestApproach", "search", 0.01)
+        return speculative_timings
+
+    timings = start_request_timings()
+    speculative_timings = await asyncio.create_task(speculate())
+    assert timings == {}
+    observe_stage("TestApproach", "search", 0.02)
+    add_request_timings(speculative_timings)
+    assert timings == {"search": 0.03}
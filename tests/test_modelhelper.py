@@ -1,9 +1,13 @@
 import pytest
 
 from core.modelhelper import (
+    TOKEN_COUNT_CACHE,
+    get_encoding,
     get_oai_chatmodel_tiktok,
     get_token_limit,
     num_tokens_from_messages,
+    num_tokens_from_string,
+    prime_token_counts,
 )
 
 
@@ -59,3 +63,42 @@ def test_get_oai_chatmodel_tiktok_error():
         get_oai_chatmodel_tiktok(None)
     with pytest.raises(ValueError, match="Expected Azure OpenAI ChatGPT model name"):
         get_oai_chatmodel_tiktok("gpt-3")
+
+
+def test_get_encoding_shared():
+    assert get_encoding("gpt-35-turbo") is get_encoding("gpt-35-turbo")
+    assert get_encoding("gpt-35-turbo").name == "cl100k_base"
+
+
+def test_num_tokens_from_string_memoized(monkeypatch):
+    encoding = get_encoding("gpt-4")
+    encoded = []
+    original_encode = encoding.encode
+
+    def counting_encode(text, *args, **kwargs):
+        encoded.append(text)
+        return original_encode(text, *args, **kwargs)
+
+    monkeypatch.setattr(encoding, "encode", counting_encode)
+    TOKEN_COUNT_CACHE.clear()
+
+    assert num_tokens_from_string("Hello, how are you?", "gpt-4") == 6
+    assert num_tokens_from_string("Hello, how are you?", "gpt-4") == 6
+    # Models sharing an encoding share the counts
+    assert num_tokens_from_string("Hello, how are you?", "gpt-35-turbo") == 6
+    assert encoded == ["Hello, how are you?"]
+
+    prime_token_counts(["You are a helpful assistant."], "gpt-4")
+    assert num_tokens_from_messages({"role": "system", "content": "You are a helpful assistant."}, "gpt-4") == 9
+    assert encoded == ["Hello, how are you?", "You are a helpful assistant.", "system"]
+
+
+def test_num_tokens_from_messages_content_parts():
+    message = {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "Hello, how are you?"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,iVBORw0KGgo="}},
+        ],
+    }
+    assert num_tokens_from_messages(message, "gpt-4v") == 9
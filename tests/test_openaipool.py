@@ -0,0 +1,112 @@
+import httpx
+import pytest
+
+from core.openaipool import OpenAIBackend, OpenAIBackendPool, parse_backends
+
+CHAT_URL = "https://primary.openai.azure.com/openai/deployments/chat/chat/completions?api-version=2023-07-01-preview"
+
+
+def create_pool(handler, eject_seconds=10):
+    backends = [
+        OpenAIBackend(endpoint="https://eastus.openai.azure.com", weight=1),
+        OpenAIBackend(endpoint="https://westus.openai.azure.com", weight=1),
+    ]
+    return OpenAIBackendPool(backends, transport=httpx.MockTransport(handler), eject_seconds=eject_seconds)
+
+
+def test_parse_backends():
+    assert parse_backends("eastus:3, westus,") == [
+        OpenAIBackend(endpoint="https://eastus.openai.azure.com", weight=3),
+        OpenAIBackend(endpoint="https://westus.openai.azure.com", weight=1),
+    ]
+    assert parse_backends("") == []
+
+
+@pytest.mark.asyncio
+async def test_openai_pool_fails_over_on_429():
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        if request.url.host == "eastus.openai.azure.com":
+            return httpx.Response(429, headers={"retry-after-ms": "30000"}, json={"error": "throttled"})
+        return httpx.Response(200, headers={"x-ratelimit-remaining-tokens": "5000"}, json={"ok": True})
+
+    pool = create_pool(handler)
+    async with httpx.AsyncClient(transport=pool) as client:
+        for _ in range(5):
+            response = await client.post(CHAT_URL, json={"messages": []})
+            assert response.status_code == 200
+            assert response.json() == {"ok": True}
+
+    # The throttled backend is ejected after the first 429 and not tried again
+    assert [request.url.host for request in requests].count("eastus.openai.azure.com") <= 1
+    assert requests[-1].url.path == "/openai/deployments/chat/chat/completions"
+    assert requests[-1].headers["host"] == "westus.openai.azure.com"
+    assert requests[-1].content == b'{"messages": []}'
+    backends = {backend["endpoint"]: backend for backend in pool.stats()["backends"]}
+    assert backends["https://westus.openai.azure.com"]["requests"] == 5
+    assert backends["https://westus.openai.azure.com"]["remaining_tokens"] == 5000
+    assert backends["https://westus.openai.azure.com"]["deployment"] == "chat"
+    assert backends.get("https://eastus.openai.azure.com", {"ejected": True})["ejected"]
+
+
+@pytest.mark.asyncio
+async def test_openai_pool_returns_last_failure():
+    def handler(request: httpx.Request):
+        return httpx.Response(503, json={"error": "unavailable"})
+
+    pool = create_pool(handler)
+    async with httpx.AsyncClient(transport=pool) as client:
+        response = await client.post(CHAT_URL, json={"messages": []})
+        # Every backend failed, so the SDK gets the error and applies its own retries
+        assert response.status_code == 503
+        assert all(backend["failures"] == 1 for backend in pool.stats()["backends"])
+
+        # While all of them are ejected, requests still go to the one that comes back first
+        response = await client.post(CHAT_URL, json={"messages": []})
+        assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_openai_pool_fails_over_on_connection_error():
+    def handler(request: httpx.Request):
+        if request.url.host == "eastus.openai.azure.com":
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json={"ok": True})
+
+    pool = create_pool(handler)
+    async with httpx.AsyncClient(transport=pool) as client:
+        for _ in range(3):
+            response = await client.post(CHAT_URL, json={"messages": []})
+            assert response.status_code == 200
+
+    # With no backend left to fail over to, the error reaches the SDK
+    pool = OpenAIBackendPool(pool.backends[:1], transport=httpx.MockTransport(handler))
+    async with httpx.AsyncClient(transport=pool) as client:
+        with pytest.raises(httpx.ConnectError):
+            await client.post(CHAT_URL, json={"messages": []})
+
+
+@pytest.mark.asyncio
+async def test_openai_pool_rate_limit_readings_expire(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr("core.openaipool.time.monotonic", lambda: now)
+
+    def handler(request: httpx.Request):
+        if request.url.host == "eastus.openai.azure.com":
+            return httpx.Response(200, headers={"x-ratelimit-remaining-tokens": "1"}, json={"ok": True})
+        return httpx.Response(200, headers={"x-ratelimit-remaining-tokens": "not-a-number"}, json={"ok": True})
+
+    pool = create_pool(handler)
+    eastus, westus = pool.backends
+    async with httpx.AsyncClient(transport=pool) as client:
+        while pool.state(eastus, "chat").requests == 0 or pool.state(westus, "chat").requests == 0:
+            # A malformed header doesn't fail the request
+            assert (await client.post(CHAT_URL, json={"messages": []})).status_code == 200
+
+    assert pool.state(westus, "chat").remaining_tokens is None
+    assert pool.effective_weight(eastus, "chat") == 1 / pool.TOKENS_HEADROOM
+    # Once the quota window has passed, the backend gets its full weight back
+    now += pool.LIMITS_TTL_SECONDS + 1
+    assert pool.effective_weight(eastus, "chat") == 1
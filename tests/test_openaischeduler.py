@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from core.openaischeduler import (
+    PRIORITY_ANSWER,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    OpenAIScheduler,
+    estimate_tokens,
+)
+
+
+def test_estimate_tokens():
+    messages = [
+        {"role": "system", "content": "a" * 40},
+        {"role": "user", "content": [{"type": "text", "text": "b" * 20}, {"type": "image_url", "image_url": {}}]},
+    ]
+    assert estimate_tokens(messages, max_tokens=100) == 115
+    assert estimate_tokens(["What is the capital of France?"]) == 7
+
+
+@pytest.mark.asyncio
+async def test_scheduler_admits_by_priority():
+    scheduler = OpenAIScheduler(max_concurrency=1)
+    admitted = []
+
+    async def call(name, priority):
+        async with scheduler.slot(priority, tokens=10):
+            admitted.append(name)
+
+    await scheduler.acquire(PRIORITY_ANSWER, tokens=10)
+    tasks = [
+        asyncio.create_task(call("prefetch", PRIORITY_BACKGROUND)),
+        asyncio.create_task(call("answer", PRIORITY_ANSWER)),
+        asyncio.create_task(call("rewrite", PRIORITY_INTERACTIVE)),
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.stats()["priorities"]["background"]["queued"] == 1
+    scheduler.release()
+    await asyncio.gather(*tasks)
+
+    # The rewrite arrived last but goes first, and the speculative prefetch only gets the leftover capacity
+    assert admitted == ["rewrite", "answer", "prefetch"]
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 0
+    assert stats["priorities"]["interactive"]["admitted"] == 1
+    assert stats["priorities"]["answer"]["admitted"] == 2
+    assert stats["priorities"]["background"]["queue_wait_seconds"] > 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_token_bucket():
+    scheduler = OpenAIScheduler(max_concurrency=10, tokens_per_minute=6000)
+    async with scheduler.slot(PRIORITY_ANSWER, tokens=5990):
+        pass
+    # 100 tokens per second are refilled, so the next call waits for about 0.1 seconds
+    call = asyncio.create_task(scheduler.acquire(PRIORITY_INTERACTIVE, tokens=20))
+    await asyncio.sleep(0.01)
+    assert not call.done()
+    await asyncio.wait_for(call, timeout=1)
+    scheduler.release()
+    assert scheduler.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_cancelled_waiter():
+    scheduler = OpenAIScheduler(max_concurrency=1)
+    await scheduler.acquire(PRIORITY_ANSWER, tokens=10)
+    waiting = asyncio.create_task(scheduler.acquire(PRIORITY_INTERACTIVE, tokens=10))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    scheduler.release()
+    await asyncio.wait_for(scheduler.acquire(PRIORITY_BACKGROUND, tokens=10), timeout=1)
+    assert scheduler.stats()["in_flight"] == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_max_queue_wait():
+    scheduler = OpenAIScheduler(max_concurrency=1, max_queue_wait=0.05)
+    admitted = []
+
+    async def call(name, priority):
+        async with scheduler.slot(priority, tokens=10):
+            admitted.append(name)
+
+    await scheduler.acquire(PRIORITY_INTERACTIVE, tokens=10)
+    prefetch = asyncio.create_task(call("prefetch", PRIORITY_BACKGROUND))
+    await asyncio.sleep(0.06)
+    rewrite = asyncio.create_task(call("rewrite", PRIORITY_INTERACTIVE))
+    await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(prefetch, rewrite)
+
+    # The prefetch waited too long to be passed over again
+    assert admitted == ["prefetch", "rewrite"]
+    assert scheduler.stats()["in_flight"] == 0
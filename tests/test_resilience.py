@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from core.resilience import CircuitBreaker, CircuitOpenError, ResiliencePolicy
+
+
+def test_circuit_breaker(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr("core.resilience.time.monotonic", lambda: now)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # After the reset timeout a single trial call is allowed
+    now = 131.0
+    assert breaker.state == "half-open"
+    breaker.before_call()
+    assert not breaker.allows()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now = 162.0
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.times_opened == 1
+
+
+@pytest.mark.asyncio
+async def test_policy_hedges_slow_calls():
+    policy = ResiliencePolicy("Test", timeout=5, hedge_percentile=50, min_samples=2)
+    delays = [0.001, 0.001, 5, 0.001]
+
+    async def call():
+        await asyncio.sleep(delays.pop(0))
+        return "done"
+
+    assert await policy.call(call) == "done"
+    assert await policy.call(call) == "done"
+    # The third call hangs, so a duplicate is fired after the median latency and wins
+    assert await asyncio.wait_for(policy.call(call), timeout=1) == "done"
+    assert policy.stats() == {
+        "calls": 3,
+        "hedged": 1,
+        "hedges_won": 1,
+        "hedges_over_budget": 0,
+        "timeouts": 0,
+        "failures": 0,
+        "rejected": 0,
+        "breakers": {"default": "closed"},
+    }
+
+
+@pytest.mark.asyncio
+async def test_policy_hedge_budget():
+    policy = ResiliencePolicy("Test", timeout=5, hedge_percentile=50, hedge_budget=0.25, min_samples=2)
+
+    async def call(delay):
+        await asyncio.sleep(delay)
+        return "done"
+
+    await policy.call(lambda: call(0.001))
+    await policy.call(lambda: call(0.001))
+    # Every call is slow from now on, only a quarter of them are hedged
+    await asyncio.gather(*(policy.call(lambda: call(0.02)) for _ in range(6)))
+    stats = policy.stats()
+    assert stats["calls"] == 8
+    assert stats["hedged"] == 2
+    assert stats["hedges_over_budget"] == 4
+
+
+@pytest.mark.asyncio
+async def test_policy_deadline_and_breaker():
+    policy = ResiliencePolicy("Test", timeout=0.01, hedge_percentile=0, failure_threshold=2)
+
+    async def hanging_call():
+        await asyncio.sleep(1)
+
+    async def failing_call():
+        raise ValueError("bad request")
+
+    with pytest.raises(asyncio.TimeoutError):
+        await policy.call(hanging_call, kind="text")
+    with pytest.raises(ValueError):
+        await policy.call(failing_call, kind="text")
+    assert not policy.allows("text")
+    with pytest.raises(CircuitOpenError):
+        await policy.call(failing_call, kind="text")
+    # Each kind of call has its own breaker
+    assert policy.allows("vectors")
+    assert policy.stats()["breakers"] == {"text": "open", "vectors": "closed"}
+    assert policy.stats()["rejected"] == 1
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from approaches.approach import ThoughtStep
+from core.thoughtstore import ThoughtStore
+
+
+def test_thoughtstore_defer():
+    thought_store = ThoughtStore(max_size=1024 * 1024, ttl=60)
+    context = {
+        "data_points": {"text": ["a.pdf: A"], "images": ["data:image/png;base64,iVBORw0KGgo="]},
+        "thoughts": [ThoughtStep("Prompt", ["user: question"], {"model": "gpt-4v"})],
+        "followup_questions": ["Why?"],
+    }
+
+    minimal_context = thought_store.defer(context, owner="OID_X")
+    assert minimal_context == {
+        "data_points": {"text": ["a.pdf"]},
+        "followup_questions": ["Why?"],
+        "thoughts_id": minimal_context["thoughts_id"],
+    }
+    assert thought_store.get(minimal_context["thoughts_id"], "OID_Y") is None
+    assert json.loads(thought_store.get(minimal_context["thoughts_id"], "OID_X")) == {
+        "thoughts": [{"title": "Prompt", "description": ["user: question"], "props": {"model": "gpt-4v"}}],
+        "data_points": {"text": ["a.pdf: A"], "images": ["data:image/png;base64,iVBORw0KGgo="]},
+    }
+
+
+@pytest.mark.asyncio
+async def test_thoughtstore_defer_stream():
+    thought_store = ThoughtStore(max_size=1024 * 1024, ttl=60)
+
+    async def gen():
+        yield {"choices": [{"delta": {"role": "assistant"}, "context": {"data_points": {}, "thoughts": []}}]}
+        yield {"choices": [{"delta": {"content": "Paris"}}]}
+        yield {"choices": [{"delta": {"role": "assistant"}, "context": {"followup_questions": ["Why?"]}}]}
+
+    events = [event async for event in thought_store.defer_stream(gen(), owner=None)]
+    assert events[0]["choices"][0]["context"]["data_points"] == {"text": []}
+    assert thought_store.get(events[0]["choices"][0]["context"]["thoughts_id"], None) is not None
+    assert events[1:] == [
+        {"choices": [{"delta": {"content": "Paris"}}]},
+        {"choices": [{"delta": {"role": "assistant"}, "context": {"followup_questions": ["Why?"]}}]},
+    ]